@@ -8,12 +8,12 @@ import logging
 from logging.handlers import RotatingFileHandler
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 
 from config import config_list
+from app.database import Database
+from app.token.cache import CachingJWTManager
 
 __version__ = "0.1.dev"
 
@@ -24,9 +24,9 @@ if env_ in config_list:
 else:
     raise EnvironmentError('Cannot find environment config')
 
-db = SQLAlchemy()
+db = Database()
 migrate = Migrate()
-jwt = JWTManager()
+jwt = CachingJWTManager()
 
 
 def create_app(config_class: object = config_val):
@@ -39,6 +39,9 @@ def create_app(config_class: object = config_val):
     jwt.init_app(app)
     CORS(app)
 
+    from app.token.revocation import revocation_list
+    jwt.token_in_blacklist_loader(revocation_list.is_token_revoked)
+
     from app.rest import bp as rest_bp
     app.register_blueprint(rest_bp)
 
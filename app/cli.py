@@ -4,9 +4,18 @@ Implements commands required to maintain the application.
 """
 
 import functools
+import time
+from datetime import datetime as dt
 import click
+from flask import current_app
+
+from app import db
 from app.user.models import create_user, modify_user, get_user_by_username, \
     toggle_admin
+from app.note.models import Note
+from app.note.retention import RetentionPolicy
+from app.user.hashing import HashPolicy
+from app.token.revocation import revocation_list
 
 
 def check_user(func):
@@ -101,3 +110,120 @@ def register(app):
         user_ = kwargs['user']
         toggle_admin(user_, False)
         print(f'Revoked admin rights from the user {username}')
+
+    @user.command()
+    @click.option('--method', default=None,
+                  help='The hash method, pbkdf2:sha256 or bcrypt.')
+    @click.option('--cost', type=int, default=None,
+                  help='The PBKDF2 iterations or the bcrypt cost.')
+    @click.option('--seconds', type=float, default=2.0,
+                  help='How long to hash for.')
+    def bench_hash(method: str, cost: int, seconds: float):
+        """Measure the password hashes per second of a single core.
+
+        The configured hash policy is measured unless the options override
+        it.
+        """
+        policy = HashPolicy.from_config(current_app.config)
+        try:
+            if method is not None:
+                policy = HashPolicy(method, policy.iterations, policy.rounds)
+        except ValueError as err:
+            return print(str(err))
+        if cost is not None:
+            policy.iterations = cost
+            policy.rounds = cost
+
+        count = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < seconds or not count:
+            policy.hash('benchmark password')
+            count += 1
+            elapsed = time.perf_counter() - started
+
+        print(f'{policy.method} cost {policy.cost}: '
+              f'{count / elapsed:.2f} hashes/s per core, '
+              f'{elapsed / count * 1000:.1f} ms per hash')
+
+    @app.cli.group()
+    def notes():
+        """Implement note commands."""
+        pass
+
+    @notes.command()
+    @click.option('--keep-last', type=int, default=None,
+                  help='The number of last versions to keep.')
+    @click.option('--keep-daily/--no-keep-daily', default=None,
+                  help='Keep the last version of every older day.')
+    @click.option('--max-age-days', type=int, default=None,
+                  help='Remove the versions older than this.')
+    @click.option('--batch-size', type=int, default=100,
+                  help='The number of notes compacted per batch.')
+    @click.option('--pause', type=float, default=0.5,
+                  help='The seconds to wait between batches.')
+    @click.option('--start-id', type=int, default=0,
+                  help='Resume after the note with this id.')
+    def compact_versions(keep_last: int, keep_daily: bool, max_age_days: int,
+                         batch_size: int, pause: float, start_id: int):
+        """Remove the note versions the retention policy does not keep.
+
+        The policy is configured by the NOTE_VERSION_KEEP_LAST,
+        NOTE_VERSION_KEEP_DAILY and NOTE_VERSION_MAX_AGE_DAYS settings,
+        which the options override. Every note is compacted in its own
+        transaction, and the last note id of every batch is reported so
+        that an interrupted run can be resumed with --start-id.
+        """
+        policy = RetentionPolicy.from_config(current_app.config)
+        if keep_last is not None:
+            policy.keep_last = keep_last
+        if keep_daily is not None:
+            policy.keep_daily = keep_daily
+        if max_age_days is not None:
+            policy.max_age_days = max_age_days
+        if not policy.enabled:
+            return print('No retention policy is configured')
+
+        now = dt.utcnow()
+        last_id = start_id
+        total_removed = 0
+        total_reclaimed = 0
+        while True:
+            note_ids = [row[0] for row in db.session.query(Note.id).filter(
+                Note.id > last_id, Note.version_count > 0).order_by(
+                Note.id).limit(batch_size)]
+            if not note_ids:
+                break
+
+            for note_id in note_ids:
+                note = Note.query.get(note_id)
+                removed, reclaimed = note.compact_versions(policy, now)
+                if removed:
+                    # A core update, so that the note is not versioned
+                    db.session.query(Note).filter(Note.id == note_id).update(
+                        {Note.version_count: Note.version_count - removed},
+                        synchronize_session=False)
+                db.session.commit()
+                total_removed += removed
+                total_reclaimed += reclaimed
+
+            last_id = note_ids[-1]
+            print(f'Compacted notes up to id {last_id}: removed '
+                  f'{total_removed} versions, reclaimed {total_reclaimed} '
+                  f'bytes')
+            if len(note_ids) == batch_size:
+                time.sleep(pause)
+
+        print(f'Removed {total_removed} versions, reclaimed '
+              f'{total_reclaimed} bytes')
+
+    @app.cli.group()
+    def tokens():
+        """Implement token commands."""
+        pass
+
+    @tokens.command()
+    def prune():
+        """Delete the expired tokens from the revoked tokens."""
+        removed = revocation_list.prune()
+        print(f'Removed {removed} expired revoked tokens')
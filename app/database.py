@@ -0,0 +1,285 @@
+"""The database extension, its connection pool and read replicas.
+
+The pool of the databases using a queue pool is sized by the
+DATABASE_POOL_* settings and records how long the checkouts wait for a
+connection, so that the pool of every worker process can be sized from the
+numbers reported by /admin/metrics.
+
+The replicas listed in DATABASE_REPLICA_URIS are added as binds. Within
+replica_reads, the plain SELECTs of the session go to one of them, picked
+at random. Anything else - a flush, a bulk update, a locking or textual
+statement - goes to the primary, and so do all the statements after it.
+
+SQLite only enforces foreign keys, and their ON DELETE actions, on the
+connections that enable them, which the engines of the application do.
+
+This module does not import the application, it is imported by it.
+"""
+
+import contextlib
+import random
+import threading
+import time
+from typing import Union
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import Pool, QueuePool
+from sqlalchemy.sql.expression import Select, CompoundSelect
+
+REPLICA_BIND_PREFIX = 'replica'
+
+
+def enable_foreign_keys(connection, connection_record):
+    """Enforce the foreign keys on a new SQLite connection."""
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A queue pool recording the waits of its checkouts.
+
+    The wait of a checkout includes opening a new connection when the pool
+    has none available.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the pool."""
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict(checkouts=0, timeouts=0, wait_seconds=0.0,
+                             max_wait_seconds=0.0, max_in_use=0)
+
+    def _do_get(self):
+        """Check a connection out and record the wait."""
+        started = time.monotonic()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self._metrics['timeouts'] += 1
+            raise
+
+        waited = time.monotonic() - started
+        in_use = self.checkedout()
+        with self._metrics_lock:
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_seconds'] += waited
+            self._metrics['max_wait_seconds'] = max(
+                self._metrics['max_wait_seconds'], waited)
+            self._metrics['max_in_use'] = max(self._metrics['max_in_use'],
+                                              in_use)
+        return connection
+
+    def get_metrics(self) -> dict:
+        """Return the checkout counters and waits of the pool."""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        checkouts = metrics['checkouts']
+        metrics['avg_wait_seconds'] = \
+            metrics['wait_seconds'] / checkouts if checkouts else 0.0
+        return metrics
+
+
+def get_pool_metrics(pool: Pool) -> dict:
+    """Return the state of a connection pool.
+
+    Only queue pools report their size and usage.
+    """
+    metrics = dict(pool_class=type(pool).__name__)
+    if isinstance(pool, QueuePool):
+        metrics.update(size=pool.size(), checked_in=pool.checkedin(),
+                       in_use=pool.checkedout(),
+                       overflow=max(pool.overflow(), 0),
+                       max_overflow=pool._max_overflow)
+    if isinstance(pool, InstrumentedQueuePool):
+        metrics.update(pool.get_metrics())
+    return metrics
+
+
+class ReplicaRouting(object):
+    """The routing of the reads of a block to a replica."""
+
+    def __init__(self, bind_key: str):
+        """Initialize the routing.
+
+        :param bind_key: the bind of the replica
+        """
+        self.bind_key = bind_key
+        self.used = False
+        self.wrote = False
+        self.missed = False
+
+
+def get_replica_routing() -> Union[ReplicaRouting, None]:
+    """Return the replica routing of the current block, if any."""
+    if not has_app_context():
+        return None
+    return g.get('db_replica_routing')
+
+
+def reads_from_replica() -> bool:
+    """Return True if the reads of the session go to a replica.
+
+    What is read from a lagging replica must not fill the process caches.
+    """
+    routing = get_replica_routing()
+    return routing is not None and not routing.wrote
+
+
+def record_replica_miss():
+    """Record that an entity looked up on a replica was not found.
+
+    The entity may exist on the primary and not be replicated yet.
+    """
+    routing = get_replica_routing()
+    if routing is not None and not routing.wrote:
+        routing.missed = True
+
+
+def is_plain_select(clause) -> bool:
+    """Return True if a statement only reads without locking."""
+    if isinstance(clause, CompoundSelect):
+        return True
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(SignallingSession):
+    """A session sending the plain reads of replica_reads blocks to a
+    replica."""
+
+    def __init__(self, db, **options):
+        """Initialize the session."""
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        """Return the engine of a statement."""
+        routing = get_replica_routing()
+        if routing is None or routing.wrote:
+            return super().get_bind(mapper, clause)
+
+        if self._flushing or not is_plain_select(clause):
+            routing.wrote = True
+            return super().get_bind(mapper, clause)
+
+        if mapper is not None and \
+                mapper.persist_selectable.info.get('bind_key') is not None:
+            return super().get_bind(mapper, clause)
+
+        routing.used = True
+        return self._db.get_engine(self.app, bind=routing.bind_key)
+
+
+class Database(SQLAlchemy):
+    """The SQLAlchemy extension with a configurable, instrumented pool and
+    read replicas."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the extension."""
+        self._replica_lock = threading.Lock()
+        self._replicas_down = {}
+        self._replica_metrics = dict(replica_blocks=0, fallbacks=0,
+                                     failures=0)
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        """Register the extension with an app, adding the replica binds."""
+        uris = app.config.setdefault('DATABASE_REPLICA_URIS', [])
+        app.config.setdefault('DATABASE_REPLICA_RETRY_INTERVAL', 30)
+        if uris:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            for index, uri in enumerate(uris):
+                binds[f'{REPLICA_BIND_PREFIX}{index}'] = uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+
+    def create_session(self, options):
+        """Create the factory of routing sessions."""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_replica_keys(self, app=None) -> list:
+        """Return the binds of the replicas."""
+        app = self.get_app(app)
+        return [f'{REPLICA_BIND_PREFIX}{index}' for index
+                in range(len(app.config['DATABASE_REPLICA_URIS']))]
+
+    def choose_replica(self) -> Union[str, None]:
+        """Return the bind of a replica that has not failed recently."""
+        now = time.monotonic()
+        with self._replica_lock:
+            keys = [key for key in self.get_replica_keys()
+                    if self._replicas_down.get(key, 0) <= now]
+        if not keys:
+            return None
+        return random.choice(keys)
+
+    def mark_replica_down(self, bind_key: str):
+        """Leave a failing replica out for DATABASE_REPLICA_RETRY_INTERVAL
+        seconds."""
+        retry_interval = \
+            self.get_app().config['DATABASE_REPLICA_RETRY_INTERVAL']
+        with self._replica_lock:
+            self._replicas_down[bind_key] = time.monotonic() + retry_interval
+            self._replica_metrics['failures'] += 1
+
+    def record_replica_fallback(self):
+        """Count a block run again on the primary."""
+        with self._replica_lock:
+            self._replica_metrics['fallbacks'] += 1
+
+    @contextlib.contextmanager
+    def replica_reads(self):
+        """Route the plain reads of the session to a replica in a block.
+
+        Yields the routing, or None when there is no available replica.
+        """
+        previous = g.get('db_replica_routing')
+        bind_key = self.choose_replica()
+        routing = ReplicaRouting(bind_key) if bind_key else None
+        if routing is not None:
+            with self._replica_lock:
+                self._replica_metrics['replica_blocks'] += 1
+        g.db_replica_routing = routing
+        try:
+            yield routing
+        finally:
+            g.db_replica_routing = previous
+
+    def get_replica_metrics(self) -> dict:
+        """Return the routing counters and the pools of the replicas."""
+        now = time.monotonic()
+        with self._replica_lock:
+            metrics = dict(self._replica_metrics)
+            down = [key for key, until in self._replicas_down.items()
+                    if until > now]
+        metrics['down'] = sorted(down)
+        metrics['pools'] = {
+            key: get_pool_metrics(self.get_engine(bind=key).pool)
+            for key in self.get_replica_keys()}
+        return metrics
+
+    def create_engine(self, sa_url, engine_opts):
+        """Create an engine, enforcing the foreign keys of SQLite."""
+        engine = super().create_engine(sa_url, engine_opts)
+        if sa_url.drivername.startswith('sqlite'):
+            event.listen(engine, 'connect', enable_foreign_keys)
+        return engine
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """Add the pool settings to the engine options.
+
+        SQLite databases keep the pool chosen by Flask-SQLAlchemy.
+        """
+        super().apply_driver_hacks(app, sa_url, options)
+        if 'poolclass' in options or sa_url.drivername.startswith('sqlite'):
+            return
+
+        config = app.config
+        options.update(poolclass=InstrumentedQueuePool,
+                       pool_size=config['DATABASE_POOL_SIZE'],
+                       max_overflow=config['DATABASE_POOL_MAX_OVERFLOW'],
+                       pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+                       pool_recycle=config['DATABASE_POOL_RECYCLE'],
+                       pool_pre_ping=config['DATABASE_POOL_PRE_PING'])
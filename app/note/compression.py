@@ -0,0 +1,72 @@
+"""Compressed storage of note texts.
+
+A stored value starts with a codec marker byte followed by the encoded
+text. Texts below a size threshold, or that do not get smaller, are stored
+as plain UTF-8. Values without a marker are read as plain UTF-8 too, so
+rows written before compression was introduced stay readable.
+"""
+
+import zlib
+from typing import Union
+
+from app import db
+
+CODEC_PLAIN = b'\x00'
+CODEC_ZLIB = b'\x01'
+
+COMPRESSION_THRESHOLD = 256
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(text: Union[str, None],
+                  threshold: int = COMPRESSION_THRESHOLD,
+                  level: int = COMPRESSION_LEVEL) -> Union[bytes, None]:
+    """Encode a text for storage, compressing it if it is large enough."""
+    if text is None:
+        return None
+
+    data = text.encode('utf-8')
+    if len(data) >= threshold:
+        compressed = zlib.compress(data, level)
+        if len(compressed) < len(data):
+            return CODEC_ZLIB + compressed
+    return CODEC_PLAIN + data
+
+
+def decompress_text(value: Union[bytes, str, None]) -> Union[str, None]:
+    """Decode a stored text."""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    marker, data = value[:1], value[1:]
+    if marker == CODEC_ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if marker == CODEC_PLAIN:
+        return data.decode('utf-8')
+    return value.decode('utf-8')
+
+
+class CompressedText(db.TypeDecorator):
+    """A text stored compressed in a binary column."""
+
+    impl = db.LargeBinary
+
+    def __init__(self, *args, threshold: int = COMPRESSION_THRESHOLD,
+                 level: int = COMPRESSION_LEVEL, **kwargs):
+        """Initialize the type.
+
+        :param threshold: the size in bytes from which texts are compressed
+        :param level: the zlib compression level
+        """
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        self.level = level
+
+    def process_bind_param(self, value, dialect):
+        """Encode a text on its way to the database."""
+        return compress_text(value, self.threshold, self.level)
+
+    def process_result_value(self, value, dialect):
+        """Decode a text read from the database."""
+        return decompress_text(value)
@@ -0,0 +1,56 @@
+"""Line based deltas between versions of a note text.
+
+A delta describes a target text in terms of a base text. It is a list of
+operations, each one either a [start, end] pair copying the lines
+base[start:end] or a string inserted as is.
+"""
+
+import difflib
+import json
+from typing import Union
+
+
+def _split_lines(text: Union[str, None]) -> list:
+    """Split a text into lines, keeping the line endings."""
+    if not text:
+        return []
+    return text.splitlines(keepends=True)
+
+
+def make_delta(base: Union[str, None], target: Union[str, None]) -> list:
+    """Return the delta that rebuilds the target text from the base text."""
+    base_lines = _split_lines(base)
+    target_lines = _split_lines(target)
+
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines,
+                                      autojunk=False)
+    delta = []
+    for tag, base_start, base_end, target_start, target_end \
+            in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([base_start, base_end])
+        elif tag in ('replace', 'insert'):
+            delta.append(''.join(target_lines[target_start:target_end]))
+    return delta
+
+
+def apply_delta(delta: list, base: Union[str, None]) -> str:
+    """Rebuild a text by applying a delta to its base text."""
+    base_lines = _split_lines(base)
+    parts = []
+    for operation in delta:
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(base_lines[operation[0]:operation[1]])
+    return ''.join(parts)
+
+
+def encode_delta(delta: list) -> str:
+    """Serialize a delta for storage."""
+    return json.dumps(delta, separators=(',', ':'))
+
+
+def decode_delta(value: str) -> list:
+    """Deserialize a stored delta."""
+    return json.loads(value)
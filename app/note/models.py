@@ -7,6 +7,14 @@ from flask_jwt_extended import get_jwt_identity
 
 from flask import current_app
 from app import db
+from app.token.principal import Principal
+from app.note.delta import make_delta, apply_delta, encode_delta, \
+    decode_delta
+from app.note.compression import CompressedText, compress_text
+from app.note.retention import RetentionPolicy
+
+VERSION_STORAGE_FULL = 'full'
+VERSION_STORAGE_DELTA = 'delta'
 
 
 class Note(db.Model):
@@ -17,16 +25,70 @@ class Note(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'),
                            nullable=False, index=True)
 
-    title = db.Column(db.String(255), index=True, default='Untitled')
-    text = db.Column(db.Text, nullable=True)
+    # The versioned columns keep their previous value when they are set,
+    # even if they were deferred, see old_data
+    title = db.column_property(
+        db.Column(db.String(255), index=True, default='Untitled'),
+        active_history=True)
+    text = db.column_property(db.Column(db.Text, nullable=True),
+                              active_history=True)
 
     created_at = db.Column(db.DateTime, default=dt.utcnow)
-    last_modified = db.Column(db.DateTime, default=dt.utcnow)
-
-    version_num = db.Column(db.Integer, nullable=False, default=1)
+    last_modified = db.column_property(
+        db.Column(db.DateTime, default=dt.utcnow), active_history=True)
+
+    version_num = db.column_property(
+        db.Column(db.Integer, nullable=False, default=1),
+        active_history=True)
+    # The number of note_versions rows, kept up to date by create_version
+    version_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
+    # Legacy JSON history, versions are stored in note_versions now
     versions = db.Column(db.Text, nullable=True)
 
     author = db.relationship('User', backref='author')
+    # The versions are deleted with the note by the database
+    version_rows = db.relationship('NoteVersion', backref='note',
+                                   cascade="all,delete-orphan",
+                                   lazy='dynamic', passive_deletes=True)
+
+    @staticmethod
+    def get_props() -> list:
+        """Return the properties that are available to the API."""
+        return ['id', 'username', 'title', 'text', 'created_by',
+                'version_num', 'version_count', 'ts_created_at',
+                'ts_last_modified']
+
+    @staticmethod
+    def get_prop_columns() -> dict:
+        """Return the columns each property of the API is built from."""
+        return dict(
+            id=['id'],
+            username=['created_by'],
+            title=['title'],
+            text=['text'],
+            created_by=['created_by'],
+            version_num=['version_num'],
+            version_count=['version_count'],
+            ts_created_at=['created_at'],
+            ts_last_modified=['last_modified']
+        )
+
+    @staticmethod
+    def get_prop_relationships() -> dict:
+        """Return the relationships properties of the API are built from."""
+        return dict(username=['author'])
+
+    @staticmethod
+    def get_filter_columns() -> list:
+        """Return the columns the API may filter and sort notes by."""
+        return ['id', 'created_by', 'title', 'text', 'created_at',
+                'last_modified', 'version_num']
+
+    @staticmethod
+    def get_match_columns() -> list:
+        """Return the columns with a full-text index."""
+        return ['title', 'text']
 
     @property
     def ts_created_at(self) -> float:
@@ -46,10 +108,38 @@ class Note(db.Model):
 
     @property
     def old_data(self) -> Union[dict, None]:
-        """Return the old data of the note."""
+        """Return the old data of the note.
+
+        Unless old data has been set explicitly, it is read from the
+        attribute history when needed: the values the note had in the
+        database before the changes of the session. Columns that were not
+        loaded were not changed either, their stored value is loaded. Notes
+        that were never stored have no old data.
+        """
         if self._old_data:
             return self._old_data
-        return None
+
+        state = db.inspect(self)
+        if state.key is None:
+            return None
+
+        old_data = {}
+        for key in ['title', 'text', 'last_modified', 'version_num']:
+            history = state.attrs[key].history
+            if history.deleted:
+                value = history.deleted[0]
+            elif history.unchanged:
+                value = history.unchanged[0]
+            elif state.session is not None:
+                with state.session.no_autoflush:
+                    value = getattr(self, key)
+            else:
+                continue
+            if isinstance(value, dt):
+                value = value.timestamp()
+            old_data[key] = value
+
+        return old_data or None
 
     @old_data.setter
     def old_data(self, value):
@@ -59,9 +149,26 @@ class Note(db.Model):
                 value[key] = item.timestamp()
         self._old_data = value
 
+    _version_list = None
+
     @property
     def version_list(self) -> dict:
-        """Return a dictionary of versions."""
+        """Return a dictionary of versions keyed by the version number.
+
+        The list is built once and kept on the instance until the legacy
+        versions or the text are set, a version is created or removed, or
+        the note is expired.
+        """
+        if self._version_list is None:
+            self._version_list = self._build_version_list()
+        return self._version_list
+
+    def _build_version_list(self) -> dict:
+        """Build the version list from the legacy JSON and the version rows.
+
+        The texts of delta encoded versions are rebuilt in a single pass
+        from the newest version to the oldest one.
+        """
         if self.versions is None:
             old_versions = {}
         else:
@@ -71,21 +178,321 @@ class Note(db.Model):
                 current_app.logger.error(str(ex))
                 old_versions = {}
 
+        rows = sorted(self.version_rows, key=lambda row: row.version_num,
+                      reverse=True)
+        texts = []
+        text = self.text
+        for version in rows:
+            text = version.get_text(text)
+            texts.append(text)
+
+        for version, text in reversed(list(zip(rows, texts))):
+            old_versions[str(version.version_num)] = version.to_dict(text)
+
         return old_versions
 
+    def _get_rows_after(self, version_num: int):
+        """Yield the version rows newer than a version, from the oldest one.
+
+        The rows are loaded in pages of a keyframe interval and a row, the
+        longest chain up to a keyframe, so that a caller stopping at the
+        next keyframe loads no more rows than it needs.
+        """
+        page_size = (get_keyframe_interval() or 1) + 1
+        while True:
+            rows = self.version_rows.filter(
+                NoteVersion.version_num > version_num).order_by(
+                NoteVersion.version_num.asc()).limit(page_size).all()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            version_num = rows[-1].version_num
+
+    def get_version(self, version_num: int) -> Union[dict, None]:
+        """Return a single version, rebuilding its text if needed.
+
+        Only the rows from the version up to the next keyframe are loaded.
+        """
+        chain = []
+        next_text = self.text
+        for version in self._get_rows_after(version_num - 1):
+            if not chain and version.version_num != version_num:
+                return None
+            chain.append(version)
+            if version.is_keyframe:
+                next_text = None
+                break
+
+        if not chain:
+            return None
+
+        for version in reversed(chain):
+            next_text = version.get_text(next_text)
+        return chain[0].to_dict(next_text)
+
+    def get_version_texts(self, versions: list) -> dict:
+        """Return the texts of consecutive versions keyed by version number.
+
+        The versions must be ordered from the newest to the oldest one, as
+        in a page of the version history. Besides them only the rows from
+        the newest version up to the next keyframe are loaded.
+        """
+        if not versions:
+            return {}
+
+        chain = []
+        next_text = self.text
+        if not versions[0].is_keyframe:
+            for version in self._get_rows_after(versions[0].version_num):
+                chain.append(version)
+                if version.is_keyframe:
+                    break
+        for version in reversed(chain):
+            next_text = version.get_text(next_text)
+
+        texts = {}
+        for version in versions:
+            next_text = version.get_text(next_text)
+            texts[version.version_num] = next_text
+        return texts
+
     def create_version(self):
-        """Create a version by storing the old data."""
-        old_versions = self.version_list
-
-        if self.old_data is not None:
-            old_versions[self.version_num] = self.old_data
-            old_versions[self.version_num][
-                'version_at'] = dt.utcnow().timestamp()
-            old_versions[self.version_num][
-                'modified_by'] = get_current_user_name(get_jwt_identity)
-        self.versions = json.dumps(old_versions)
+        """Create a version by storing the old data.
+
+        The version is appended as a single note_versions row, the existing
+        versions are neither loaded nor rewritten. In the delta storage mode
+        the old text is stored as a delta against the new text of the note.
+        If a retention policy is configured, the versions it does not keep
+        are removed.
+        """
+        old_data = self.old_data
+        if old_data is not None:
+            self.version_rows.append(NoteVersion.from_data(
+                int(self.version_num), old_data,
+                get_current_user_name(get_jwt_identity), self.text,
+                get_keyframe_interval()))
+            self.version_count = (self.version_count or 0) + 1
+            self._version_list = None
+
+            policy = RetentionPolicy.from_config(current_app.config)
+            if policy.enabled and self.id is not None:
+                removed, _ = self.compact_versions(policy)
+                self.version_count -= removed
         self.version_num = str(int(self.version_num) + 1)
 
+    def compact_versions(self, policy: RetentionPolicy,
+                         now: dt = None) -> tuple:
+        """Remove the versions a retention policy does not keep.
+
+        The policy is applied to the version metadata. The rows from the
+        newest version down to the next kept one below the removed ones are
+        loaded, to store the kept versions again against their new following
+        text. Keyframes are placed by the position in the kept chain, so
+        that no more than a keyframe interval of rows is replayed to rebuild
+        a version, counting the delta encoded versions created next. The
+        note's version_count is left to the caller.
+
+        :return: the number of removed versions and of reclaimed bytes
+        """
+        metadata = self.version_rows.with_entities(
+            NoteVersion.version_num, NoteVersion.version_at).order_by(
+            NoteVersion.version_num.desc()).all()
+        pruned = set(policy.get_pruned(metadata, now))
+        if not pruned:
+            return 0, 0
+        self._version_list = None
+
+        lowest = min(pruned)
+        boundary = max([version.version_num for version in metadata
+                        if version.version_num < lowest] or [lowest])
+
+        keyframe_interval = get_keyframe_interval()
+        rows = self.version_rows.filter(
+            NoteVersion.version_num >= boundary).order_by(
+            NoteVersion.version_num.desc()).all()
+        chain = 0
+        if keyframe_interval:
+            # The chains below the boundary end within an interval of rows
+            rows += self.version_rows.filter(
+                NoteVersion.version_num < boundary).order_by(
+                NoteVersion.version_num.desc()).limit(keyframe_interval).all()
+            # The delta encoded versions created up to the next keyframe
+            chain = -(metadata[0].version_num + 1) % keyframe_interval
+
+        reclaimed = 0
+        next_text = self.text
+        kept_text = self.text
+        relink = False
+        for version in rows:
+            text = version.get_text(next_text)
+            next_text = text
+
+            if version.version_num in pruned:
+                reclaimed += version.get_stored_size()
+                db.session.delete(version)
+                relink = True
+                continue
+
+            if not version.is_keyframe:
+                chain += 1
+                if relink or chain >= keyframe_interval:
+                    stored_size = version.get_stored_size()
+                    version.set_text(text, kept_text,
+                                     chain >= keyframe_interval)
+                    reclaimed += stored_size - version.get_stored_size()
+            relink = False
+            kept_text = text
+
+            if version.is_keyframe:
+                chain = 0
+                if version.version_num <= boundary:
+                    break
+
+        return len(pruned), reclaimed
+
+
+class NoteVersion(db.Model):
+    """A previous version of a note."""
+
+    __tablename__ = 'note_versions'
+    __table_args__ = (
+        db.Index('ix_note_versions_note_id_version_num', 'note_id',
+                 'version_num', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer,
+                        db.ForeignKey('notes.id', ondelete='CASCADE'),
+                        nullable=False)
+    version_num = db.Column(db.Integer, nullable=False)
+
+    title = db.Column(db.String(255), nullable=True)
+    # The full text of keyframes, delta encoded versions store a delta
+    # against the text of the next version (or of the note) instead.
+    # Both are stored compressed.
+    text = db.Column(CompressedText(), nullable=True)
+    delta = db.Column(CompressedText(), nullable=True)
+    is_keyframe = db.Column(db.Boolean, nullable=False, default=True)
+    last_modified = db.Column(db.DateTime, nullable=True)
+
+    version_at = db.Column(db.DateTime, default=dt.utcnow)
+    modified_by = db.Column(db.String(64), nullable=True)
+
+    def __repr__(self) -> str:
+        """Generate a representation of the note version model."""
+        return f'<NoteVersion {self.note_id} - {self.version_num}>'
+
+    @property
+    def ts_last_modified(self) -> Union[float, None]:
+        """Return the timestamp of the last_modified time."""
+        if self.last_modified is None:
+            return None
+        return self.last_modified.timestamp()
+
+    @property
+    def ts_version_at(self) -> Union[float, None]:
+        """Return the timestamp of the version_at time."""
+        if self.version_at is None:
+            return None
+        return self.version_at.timestamp()
+
+    @staticmethod
+    def get_props() -> list:
+        """Return the properties that are available to the API."""
+        return ['version_num', 'title', 'modified_by', 'ts_last_modified',
+                'ts_version_at']
+
+    @staticmethod
+    def get_prop_columns() -> dict:
+        """Return the columns each property of the API is built from."""
+        return dict(
+            version_num=['version_num'],
+            title=['title'],
+            modified_by=['modified_by'],
+            ts_last_modified=['last_modified'],
+            ts_version_at=['version_at'],
+            text=['text', 'delta', 'is_keyframe']
+        )
+
+    @staticmethod
+    def get_filter_columns() -> list:
+        """Return the columns the API may filter and sort versions by."""
+        return ['id', 'note_id', 'version_num']
+
+    @staticmethod
+    def from_data(version_num: int, data: dict, modified_by: str,
+                  next_text: str = None,
+                  keyframe_interval: int = 0) -> 'NoteVersion':
+        """Create a version from the old data of a note.
+
+        :param version_num: the number of the version
+        :param data: the old data of the note
+        :param modified_by: the name of the user modifying the note
+        :param next_text: the text following this version
+        :param keyframe_interval: store the text as a delta against
+            next_text, except for every keyframe_interval-th version;
+            0 stores every text in full
+        """
+        last_modified = data.get('last_modified')
+        if last_modified is not None:
+            last_modified = dt.fromtimestamp(last_modified)
+
+        version = NoteVersion(version_num=version_num,
+                              title=data.get('title'),
+                              last_modified=last_modified,
+                              version_at=dt.utcnow(),
+                              modified_by=modified_by)
+        version.set_text(data.get('text'), next_text,
+                         not keyframe_interval or
+                         version_num % keyframe_interval == 0)
+        return version
+
+    def set_text(self, text: Union[str, None], next_text: str = None,
+                 keyframe: bool = True):
+        """Store the text of the version in full or as a delta.
+
+        :param text: the text of the version
+        :param next_text: the text following this version
+        :param keyframe: store the text in full; otherwise it is stored as
+            a delta against next_text, if the delta is smaller than the text
+        """
+        self.is_keyframe = True
+        self.text = text
+        self.delta = None
+
+        if text is None or keyframe:
+            return
+
+        delta = encode_delta(make_delta(next_text, text))
+        if len(delta) < len(text):
+            self.is_keyframe = False
+            self.text = None
+            self.delta = delta
+
+    def get_stored_size(self) -> int:
+        """Return the number of bytes the text of the version is stored in."""
+        return sum(len(compress_text(value) or b'')
+                   for value in [self.text, self.delta])
+
+    def get_text(self, next_text: Union[str, None]) -> Union[str, None]:
+        """Return the text of the version given the text following it."""
+        if self.is_keyframe:
+            return self.text
+        return apply_delta(decode_delta(self.delta), next_text)
+
+    def to_dict(self, text: Union[str, None]) -> dict:
+        """Return the version in the format of the version list.
+
+        :param text: the text of the version, see get_text
+        """
+        result = dict(title=self.title, text=text,
+                      version_num=self.version_num,
+                      modified_by=self.modified_by)
+        for key in ['last_modified', 'version_at']:
+            value = getattr(self, key)
+            result[key] = value.timestamp() if value else None
+        return result
+
 
 def note_before_commit_listener(session):
     """Create a version for all updated notes in the session."""
@@ -95,16 +502,12 @@ def note_before_commit_listener(session):
             updated.last_modified = dt.utcnow()
 
 
-def note_load_listener(session, instance):
-    """Listen to the notes being loaded and save data as old data."""
-    if isinstance(instance, Note):
-        old_data = dict(
-            title=instance.title,
-            text=instance.text,
-            last_modified=instance.last_modified,
-            version_num=instance.version_num
-        )
-        instance.old_data = old_data
+def get_keyframe_interval() -> int:
+    """Return the keyframe interval of the configured version storage, 0
+    when every text is stored in full."""
+    if current_app.config['NOTE_VERSION_STORAGE'] == VERSION_STORAGE_DELTA:
+        return current_app.config['NOTE_VERSION_KEYFRAME_INTERVAL']
+    return 0
 
 
 def get_current_user_name(identity) -> str:
@@ -116,10 +519,19 @@ def get_current_user_name(identity) -> str:
 
 
 db.event.listen(db.session, 'before_commit', note_before_commit_listener)
-db.event.listen(db.session, 'loaded_as_persistent', note_load_listener)
 
 
-def validate_note(creator: db.Model, title: str) -> bool:
+def note_version_list_reset_listener(target, *args):
+    """Forget the memoized version list of a note."""
+    target._version_list = None
+
+
+db.event.listen(Note.versions, 'set', note_version_list_reset_listener)
+db.event.listen(Note.text, 'set', note_version_list_reset_listener)
+db.event.listen(Note, 'expire', note_version_list_reset_listener)
+
+
+def validate_note(creator: Principal, title: str) -> bool:
     """Validate a note."""
     if not creator or not creator.id:
         raise ValueError('Invalid user')
@@ -130,20 +542,41 @@ def validate_note(creator: db.Model, title: str) -> bool:
     return True
 
 
-def get_note_details(note: Note) -> dict:
-    """Return a dict of note properties."""
-    username = "system"
-    if note.author:
-        username = note.author.username
-
-    return dict(
-        id=note.id,
-        username=username,
-        title=note.title,
-        text=note.text,
-        created_by=note.created_by,
-        version_num=note.version_num,
-        ts_created_at=note.ts_created_at,
-        ts_last_modified=note.ts_last_modified,
-        version_list=note.version_list
-    )
+def get_note_details(note: Note, fields: list = None) -> dict:
+    """Return a dict of note properties.
+
+    :param note: the note
+    :param fields: the properties to return, all of them by default
+    """
+    if fields is None:
+        fields = Note.get_props()
+
+    details = {}
+    for field in fields:
+        if field == 'username':
+            details[field] = "system"
+            if note.author:
+                details[field] = note.author.username
+        else:
+            details[field] = getattr(note, field)
+    return details
+
+
+def get_version_details(version: NoteVersion, fields: list = None,
+                        text: str = None) -> dict:
+    """Return a dict of note version properties.
+
+    :param version: the note version
+    :param fields: the properties to return, all but the text by default
+    :param text: the text of the version, see Note.get_version_texts
+    """
+    if fields is None:
+        fields = NoteVersion.get_props()
+
+    details = {}
+    for field in fields:
+        if field == 'text':
+            details[field] = text
+        else:
+            details[field] = getattr(version, field)
+    return details
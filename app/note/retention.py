@@ -0,0 +1,77 @@
+"""Retention of the versions of a note.
+
+A policy keeps the last versions of a note and, for the older history,
+optionally the last version of every day. Versions older than a maximum
+age are dropped, unless they are among the last ones.
+"""
+
+from datetime import datetime as dt, timedelta
+
+
+class RetentionPolicy(object):
+    """Decide which versions of a note are kept."""
+
+    def __init__(self, keep_last: int = 0, keep_daily: bool = False,
+                 max_age_days: int = 0):
+        """Initialize the policy.
+
+        :param keep_last: the number of last versions always kept,
+            0 keeps every version unless it is too old
+        :param keep_daily: keep the last version of every day among the
+            versions before the last ones
+        :param max_age_days: drop the versions older than this, 0 for no
+            limit
+        """
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.max_age_days = max_age_days
+
+    @staticmethod
+    def from_config(config: dict) -> 'RetentionPolicy':
+        """Create the policy configured for the application."""
+        return RetentionPolicy(
+            keep_last=config['NOTE_VERSION_KEEP_LAST'],
+            keep_daily=config['NOTE_VERSION_KEEP_DAILY'],
+            max_age_days=config['NOTE_VERSION_MAX_AGE_DAYS'])
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if the policy drops any version."""
+        return bool(self.keep_last or self.max_age_days)
+
+    def get_pruned(self, versions: list, now: dt = None) -> list:
+        """Return the version numbers the policy does not keep.
+
+        :param versions: objects with a version_num and a version_at,
+            ordered from the newest to the oldest version
+        :param now: the current time
+        """
+        if now is None:
+            now = dt.utcnow()
+
+        min_version_at = None
+        if self.max_age_days:
+            min_version_at = now - timedelta(days=self.max_age_days)
+
+        pruned = []
+        days = set()
+        for index, version in enumerate(versions):
+            if self.keep_last and index < self.keep_last:
+                continue
+
+            if min_version_at is not None and \
+                    version.version_at is not None and \
+                    version.version_at < min_version_at:
+                pruned.append(version.version_num)
+                continue
+
+            if not self.keep_last:
+                continue
+
+            day = version.version_at.date() if version.version_at else None
+            if self.keep_daily and day not in days:
+                days.add(day)
+                continue
+
+            pruned.append(version.version_num)
+        return pruned
@@ -1,4 +1,4 @@
 """Initializes the Rest package."""
 
 from app.rest.blueprint import bp
-from app.rest import auth, user, note
+from app.rest import auth, user, note, admin
@@ -0,0 +1,31 @@
+"""REST Admin API."""
+
+from flask import jsonify
+from flask_jwt_extended import jwt_required
+
+from app import db, jwt
+from app.database import get_pool_metrics
+from app.rest import bp
+from app.rest.blueprint import get_principal
+from app.user.hashing import password_hasher
+from app.token.revocation import revocation_list
+
+CONST_UNAUTHORISED = 'Missing permissions'
+STATUS_ERROR = 'error'
+
+
+@bp.route('/admin/metrics', methods=['GET'])
+@jwt_required
+def admin_metrics():
+    """Process the route to get the runtime metrics of the application."""
+    principal = get_principal()
+    if not principal or not principal.is_admin:
+        return jsonify(dict(status=STATUS_ERROR,
+                            error_message=CONST_UNAUTHORISED)), 401
+
+    result = dict(password_hashing=password_hasher.get_metrics(),
+                  jwt_cache=jwt.token_cache.get_metrics(),
+                  token_revocation=revocation_list.get_metrics(),
+                  database_pool=get_pool_metrics(db.engine.pool),
+                  database_replicas=db.get_replica_metrics())
+    return jsonify(result), 200
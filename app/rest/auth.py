@@ -1,20 +1,31 @@
 """REST Auth API."""
 
 import datetime
-from datetime import datetime as dt
 from flask_jwt_extended import create_access_token, create_refresh_token, \
-    jwt_refresh_token_required, get_jwt_identity
+    jwt_required, jwt_refresh_token_required, get_jwt_identity, get_raw_jwt
 
 from flask_jwt_extended.config import config as jwt_config
 
-from flask import request, make_response, jsonify
+from flask import request, make_response, jsonify, current_app
 
 from app import db
 from app.rest import bp
 from app.user.models import get_user_by_username, get_user_details
+from app.user.activity import last_seen_tracker
+from app.user.hashing import PasswordHashingUnavailable
+from app.token.revocation import revocation_list
 
 CONST_LOGIN_MSG = 'Could not verify'
 CONST_REALM_MSG = 'Please login'
+STATUS_ERROR = 'error'
+
+
+def get_user_claims(user) -> dict:
+    """Return the claims of the access tokens of a user.
+
+    Handlers read them through get_principal instead of loading the user.
+    """
+    return {'is_admin': bool(user.is_admin), 'user_id': user.id}
 
 
 @bp.route('/auth/login', methods=['POST'])
@@ -32,15 +43,23 @@ def login():
         return make_response(CONST_LOGIN_MSG, 401, {
             'WWW-Authenticate': f'Basic realm="{CONST_REALM_MSG}"'})
 
-    if user.check_password(password):
-        if user.is_admin:
-            claims = {'is_admin': True}
-        else:
-            claims = {'is_admin': False}
+    try:
+        password_valid = user.check_password(password)
+    except PasswordHashingUnavailable as ex:
+        return jsonify(dict(error_message=str(ex))), 503
 
-        user.last_seen = dt.utcnow()
-        db.session.add(user)
-        db.session.commit()
+    if password_valid:
+        try:
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+        except (PasswordHashingUnavailable, ValueError) as ex:
+            # A misconfigured hash policy must not lock the users out
+            current_app.logger.warning(str(ex))
+
+        claims = get_user_claims(user)
+
+        last_seen_tracker.record(user.username)
 
         now = datetime.datetime.now(datetime.timezone.utc)
         access_expires = (now + jwt_config.access_expires).timestamp()
@@ -75,10 +94,7 @@ def refresh():
         return make_response(CONST_LOGIN_MSG, 401, {
             'WWW-Authenticate': f'Basic realm="{CONST_REALM_MSG}"'})
 
-    if user.is_admin:
-        claims = {'is_admin': True}
-    else:
-        claims = {'is_admin': False}
+    claims = get_user_claims(user)
 
     now = datetime.datetime.now(datetime.timezone.utc)
     access_expires = (now + jwt_config.access_expires).timestamp()
@@ -94,3 +110,32 @@ def refresh():
 
     }
     return jsonify(response), 200
+
+
+def revoke_current_token():
+    """Revoke the token of the request and return the response."""
+    status = 200
+    try:
+        revoked_token = revocation_list.revoke(get_raw_jwt())
+        db.session.commit()
+        result = dict(revoked_jti=revoked_token.jti)
+    except ValueError as ex:
+        current_app.logger.error(str(ex))
+        status = 500
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
+
+    return jsonify(result), status
+
+
+@bp.route('/auth/logout', methods=['POST'])
+@jwt_required
+def logout():
+    """Process the logout request, revoking the access token."""
+    return revoke_current_token()
+
+
+@bp.route('/auth/logout/refresh', methods=['POST'])
+@jwt_refresh_token_required
+def logout_refresh():
+    """Process the logout request, revoking the refresh token."""
+    return revoke_current_token()
@@ -1,13 +1,16 @@
 """Defines the blueprint for the REST package."""
 
 import functools
-from datetime import datetime as dt
+from typing import Union
 from flask import Blueprint
-from flask import request, make_response
+from flask import request, make_response, current_app
+from sqlalchemy import exc
 
 from app import db
 from app.user.models import get_user_by_username
-from flask_jwt_extended import get_jwt_identity
+from app.token.principal import Principal
+from app.user.activity import last_seen_tracker
+from flask_jwt_extended import get_jwt_identity, get_jwt_claims
 
 bp = Blueprint('rest', __name__)
 
@@ -24,16 +27,98 @@ def json_required(fn):
     return wrapper
 
 
+def replica_reads(fn):
+    """Route the reads of a read-only view to a database replica.
+
+    Replicas lag behind the primary, so a view answering an error after
+    looking up an entity the replica doesn't have yet is run again on the
+    primary, see record_replica_miss. Other errors, such as invalid input
+    or missing permissions, are answered as they are. A view failing on
+    the replica is run again on the primary too, and the replica is left
+    out for a while.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with db.replica_reads() as routing:
+            if routing is None:
+                return fn(*args, **kwargs)
+            try:
+                response = current_app.make_response(fn(*args, **kwargs))
+            except exc.DBAPIError as ex:
+                if not routing.used or routing.wrote:
+                    raise
+                current_app.logger.warning(
+                    f'Replica {routing.bind_key} failed: {ex}')
+                db.mark_replica_down(routing.bind_key)
+            else:
+                if response.status_code < 400 or not routing.missed:
+                    return response
+
+        db.session.rollback()
+        db.record_replica_fallback()
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def get_fields_arg() -> Union[list, None]:
+    """Return the fields requested by the comma separated "fields" argument.
+
+    None is returned when the argument is missing, meaning all fields.
+    """
+    fields = request.args.get('fields', None)
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def get_principal() -> Union[Principal, None]:
+    """Return the user of the current access token.
+
+    The principal is built from the token claims without a query. Tokens
+    issued without a user_id claim fall back to loading the user. None is
+    returned if there is no such user.
+
+    The tokens of deleted users are revoked, see RevocationList.revoke_user.
+    """
+    username = get_jwt_identity()
+    if not username:
+        return None
+
+    claims = get_jwt_claims()
+    if 'user_id' in claims:
+        return Principal(claims['user_id'], username,
+                         bool(claims.get('is_admin')))
+
+    user = get_user_by_username(username)
+    if not user:
+        return None
+    return Principal(user.id, user.username,
+                     bool(claims.get('is_admin', user.is_admin)))
+
+
 @bp.after_request
 def after_request(response):
-    """Execute logic after processing a request."""
+    """Execute logic after processing a request.
+
+    The activity of the user is only recorded here, it is stored in batches
+    by teardown_request.
+    """
     if response.status_code == 500:
         return response
     username = get_jwt_identity()
     if username:
-        user = get_user_by_username(username)
-        if user:
-            user.last_seen = dt.utcnow()
-            db.session.add(user)
-            db.session.commit()
+        last_seen_tracker.record(username)
     return response
+
+
+@bp.teardown_request
+def teardown_request(exception):
+    """Store the recorded user activity when it is due."""
+    if not last_seen_tracker.is_due:
+        return
+    try:
+        last_seen_tracker.flush()
+    except Exception as ex:
+        current_app.logger.error(str(ex))
@@ -3,16 +3,19 @@
 import json
 from json import JSONDecodeError
 from flask import request, current_app, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 
 from app import db
-from app.utils import get_entities
+from app.utils import get_entities, get_entities_by_cursor, get_entity, \
+    COUNT_EXACT
 from app.rest import bp
-from app.rest.blueprint import json_required
-from app.note.models import Note, validate_note, get_note_details
-from app.user.models import get_user_by_username
+from app.rest.blueprint import json_required, get_fields_arg, \
+    get_principal, replica_reads
+from app.note.models import Note, NoteVersion, validate_note, \
+    get_note_details, get_version_details
 
 NOTES_PER_PAGE = 10
+NOTE_VERSIONS_PER_PAGE = 10
 STATUS_ERROR = 'error'
 
 
@@ -24,12 +27,12 @@ def note_create():
     status = 200
 
     try:
-        user = get_user_by_username(get_jwt_identity())
+        principal = get_principal()
 
         title = request.json.get('title')
         text = request.json.get('text')
-        validate_note(user, title)
-        note = Note(created_by=user.id, title=title, text=text)
+        validate_note(principal, title)
+        note = Note(created_by=principal.id, title=title, text=text)
         db.session.add(note)
         db.session.commit()
 
@@ -110,6 +113,7 @@ def note_delete():
 
 @bp.route('/note', methods=['GET', 'OPTIONS'])
 @jwt_required
+@replica_reads
 def note_get():
     """Process the route for to get a single note."""
     status = 200
@@ -117,12 +121,12 @@ def note_get():
     note_id = request.args.get('id', None)
 
     try:
-        note = Note.query.get(note_id)
+        fields = get_fields_arg()
+        note = get_entity(Note, note_id, fields)
         if not note:
             raise ValueError('Invalid note')
 
-        note = Note.query.get(note_id)
-        result = get_note_details(note)
+        result = get_note_details(note, fields)
     except ValueError as ex:
         status = 500
         result = dict(error_message=str(ex))
@@ -132,6 +136,7 @@ def note_get():
 
 @bp.route('/notes', methods=['GET'])
 @jwt_required
+@replica_reads
 def notes_get():
     """Process the route to get multiple notes."""
     status = 200
@@ -139,6 +144,8 @@ def notes_get():
     per_page = NOTES_PER_PAGE
     filters = None
     order = None
+    count = COUNT_EXACT
+    fields = None
 
     try:
         filter_ = json.loads(request.args.get('filter'))
@@ -154,18 +161,99 @@ def notes_get():
         if 'order' in filter_:
             order = filter_['order']
 
-        notes = get_entities(Note, page=page, per_page=per_page,
-                             filters=filters,
-                             order=order)
-
-        note_list = list(map(lambda x: get_note_details(x), notes.items))
-        required_attrs = ['has_next', 'has_prev', 'next_num', 'page', 'pages',
-                          'per_page', 'prev_num', 'total']
+        if 'count' in filter_:
+            count = filter_['count']
+
+        if 'fields' in filter_:
+            fields = filter_['fields']
+
+        if 'cursor' in filter_:
+            notes = get_entities_by_cursor(Note, per_page=per_page,
+                                           filters=filters,
+                                           order=order,
+                                           cursor=filter_['cursor'],
+                                           fields=fields)
+            required_attrs = ['has_next', 'next_cursor', 'per_page']
+        else:
+            notes = get_entities(Note, page=page, per_page=per_page,
+                                 filters=filters,
+                                 order=order,
+                                 count=count,
+                                 fields=fields)
+            required_attrs = ['has_next', 'has_prev', 'next_num', 'page',
+                              'pages', 'per_page', 'prev_num', 'total']
+
+        note_list = list(map(lambda x: get_note_details(x, fields),
+                             notes.items))
 
         result = {attr: getattr(notes, attr) for attr in required_attrs}
         result['entity_list'] = note_list
     except JSONDecodeError as ex:
         status = 500
         result = dict(status=STATUS_ERROR, error_message=str(ex))
+    except ValueError as ex:
+        status = 500
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
+
+    return jsonify(result), status
+
+
+@bp.route('/note/versions', methods=['GET'])
+@jwt_required
+@replica_reads
+def note_versions_get():
+    """Process the route to get the versions of a note, newest first.
+
+    The versions are paged by the page and per_page arguments or by a
+    cursor. Only their metadata is returned unless include_content is set,
+    in which case the texts of the page are rebuilt as well.
+    """
+    status = 200
+
+    note_id = request.args.get('note_id', None, type=int)
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', NOTE_VERSIONS_PER_PAGE, type=int)
+    cursor = request.args.get('cursor', None)
+    include_content = request.args.get('include_content', '').lower() in \
+        ['1', 'true', 'yes']
+
+    try:
+        note = get_entity(Note, note_id, ['id'])
+        if not note:
+            raise ValueError('Invalid note')
+
+        fields = NoteVersion.get_props()
+        if include_content:
+            fields = fields + ['text']
+
+        filters = [dict(column='note_id', type='eq', value=note.id)]
+        order = dict(column='version_num', dir='desc')
+        if cursor is not None:
+            versions = get_entities_by_cursor(NoteVersion, per_page=per_page,
+                                              filters=filters, order=order,
+                                              cursor=cursor, fields=fields)
+            required_attrs = ['has_next', 'next_cursor', 'per_page']
+        else:
+            versions = get_entities(NoteVersion, page=page,
+                                    per_page=per_page, filters=filters,
+                                    order=order, fields=fields)
+            required_attrs = ['has_next', 'has_prev', 'next_num', 'page',
+                              'pages', 'per_page', 'prev_num', 'total']
+
+        texts = {}
+        if include_content:
+            texts = note.get_version_texts(versions.items)
+
+        version_list = [
+            get_version_details(version, fields,
+                                texts.get(version.version_num))
+            for version in versions.items]
+
+        result = {attr: getattr(versions, attr) for attr in required_attrs}
+        result['note_id'] = note.id
+        result['entity_list'] = version_list
+    except ValueError as ex:
+        status = 500
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
 
     return jsonify(result), status
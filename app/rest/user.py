@@ -5,15 +5,17 @@ from json import JSONDecodeError
 from flask import request, current_app, jsonify
 
 from flask_jwt_extended import (
-    get_jwt_identity,
     jwt_required,
     get_jwt_claims
 )
 
 from app import db
-from app.utils import get_entities
-from app.rest.blueprint import json_required
+from app.utils import get_entities, get_entities_by_cursor, get_entity, \
+    COUNT_EXACT
+from app.rest.blueprint import json_required, get_fields_arg, \
+    get_principal, replica_reads
 from app.rest import bp
+from app.token.revocation import revocation_list
 
 from app.user.models import (
     get_user_by_username,
@@ -24,6 +26,7 @@ from app.user.models import (
     USERS_PER_PAGE,
     get_user_details
 )
+from app.user.hashing import PasswordHashingUnavailable
 
 CONST_UNAUTHORISED = 'Missing permissions'
 STATUS_ERROR = 'error'
@@ -48,6 +51,9 @@ def user_create():
             current_app.logger.error(str(ex))
             status = 500
             result = dict(status=STATUS_ERROR, error_message=str(ex))
+        except PasswordHashingUnavailable as ex:
+            status = 503
+            result = dict(status=STATUS_ERROR, error_message=str(ex))
         return jsonify(result), status
 
     return jsonify(dict(status=STATUS_ERROR,
@@ -69,10 +75,11 @@ def user_modify():
         if not user_to_edit:
             raise ValueError(f'Username {username} is invalid')
 
-        claims = get_jwt_claims()
+        principal = get_principal()
+        if not principal:
+            raise ValueError('Invalid user')
 
-        user = get_user_by_username(get_jwt_identity())
-        if user.id != user_to_edit.id and not claims['is_admin']:
+        if principal.id != user_to_edit.id and not principal.is_admin:
             return jsonify(dict(status=STATUS_ERROR,
                                 error_message=CONST_UNAUTHORISED)), 401
         updated_user = modify_user(user_to_edit, modify)
@@ -83,6 +90,9 @@ def user_modify():
         current_app.logger.error(str(ex))
         status = 500
         result = dict(status=STATUS_ERROR, error_message=str(ex))
+    except PasswordHashingUnavailable as ex:
+        status = 503
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
 
     return jsonify(result), status
 
@@ -102,13 +112,14 @@ def user_admin():
         if not user_to_edit:
             raise ValueError(f'Username {username} is invalid')
 
-        claims = get_jwt_claims()
-        user = get_user_by_username(get_jwt_identity())
+        principal = get_principal()
+        if not principal:
+            raise ValueError('Invalid user')
 
-        if user.id == user_to_edit.id:
+        if principal.id == user_to_edit.id:
             raise ValueError('Cannot edit one\'s own admin status')
 
-        if not claims['is_admin']:
+        if not principal.is_admin:
             return jsonify(dict(status=STATUS_ERROR,
                                 error_message=CONST_UNAUTHORISED)), 401
 
@@ -126,6 +137,7 @@ def user_admin():
 
 @bp.route('/user', methods=['GET', 'OPTIONS'])
 @jwt_required
+@replica_reads
 def user_get():
     """Process the route to get a single user."""
     status = 200
@@ -133,17 +145,23 @@ def user_get():
     id_ = request.args.get('id', None)
     username = request.args.get('username', None)
 
-    user = None
-    if id_:
-        user = User.query.get(id_)
-    if not user and username:
-        user = get_user_by_username(username)
-
-    if not user:
-        status = 404
-        result = dict(status=STATUS_ERROR, error_message="User not found")
-    else:
-        result = get_user_details(user)
+    try:
+        fields = get_fields_arg()
+
+        user = None
+        if id_:
+            user = get_entity(User, id_, fields)
+        if not user and username:
+            user = get_user_by_username(username)
+
+        if not user:
+            status = 404
+            result = dict(status=STATUS_ERROR, error_message="User not found")
+        else:
+            result = get_user_details(user, fields)
+    except ValueError as ex:
+        status = 500
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
 
     return jsonify(result), status
 
@@ -162,16 +180,19 @@ def user_delete():
         if not user_to_delete:
             raise ValueError(f'Username {username} is invalid')
 
-        claims = get_jwt_claims()
-        user = get_user_by_username(get_jwt_identity())
+        principal = get_principal()
+        if not principal:
+            raise ValueError('Invalid user')
 
-        if user.id == user_to_delete.id:
+        if principal.id == user_to_delete.id:
             raise ValueError('Cannot delete one\'s own account')
 
-        if not claims['is_admin']:
+        if not principal.is_admin:
             return jsonify(dict(status=STATUS_ERROR,
                                 error_message=CONST_UNAUTHORISED)), 401
 
+        revocation_list.revoke_user(user_to_delete.id,
+                                    user_to_delete.username)
         db.session.delete(user_to_delete)
         db.session.commit()
 
@@ -187,6 +208,7 @@ def user_delete():
 
 @bp.route('/users', methods=['GET'])
 @jwt_required
+@replica_reads
 def users_get():
     """Process the route to get multiple users."""
     status = 200
@@ -194,6 +216,8 @@ def users_get():
     per_page = USERS_PER_PAGE
     filters = None
     order = None
+    count = COUNT_EXACT
+    fields = None
     try:
         filter_ = json.loads(request.args.get('filter'))
         if 'page' in filter_:
@@ -208,18 +232,38 @@ def users_get():
         if 'order' in filter_:
             order = filter_['order']
 
-        users = get_entities(User, page=page, per_page=per_page,
-                             filters=filters,
-                             order=order)
-
-        user_list = list(map(lambda x: get_user_details(x), users.items))
-        required_attrs = ['has_next', 'has_prev', 'next_num', 'page', 'pages',
-                          'per_page', 'prev_num', 'total']
+        if 'count' in filter_:
+            count = filter_['count']
+
+        if 'fields' in filter_:
+            fields = filter_['fields']
+
+        if 'cursor' in filter_:
+            users = get_entities_by_cursor(User, per_page=per_page,
+                                           filters=filters,
+                                           order=order,
+                                           cursor=filter_['cursor'],
+                                           fields=fields)
+            required_attrs = ['has_next', 'next_cursor', 'per_page']
+        else:
+            users = get_entities(User, page=page, per_page=per_page,
+                                 filters=filters,
+                                 order=order,
+                                 count=count,
+                                 fields=fields)
+            required_attrs = ['has_next', 'has_prev', 'next_num', 'page',
+                              'pages', 'per_page', 'prev_num', 'total']
+
+        user_list = list(map(lambda x: get_user_details(x, fields),
+                             users.items))
 
         result = {attr: getattr(users, attr) for attr in required_attrs}
         result['entity_list'] = user_list
     except JSONDecodeError as ex:
         status = 500
         result = dict(status=STATUS_ERROR, error_message=str(ex))
+    except ValueError as ex:
+        status = 500
+        result = dict(status=STATUS_ERROR, error_message=str(ex))
 
     return jsonify(result), status
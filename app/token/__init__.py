@@ -0,0 +1 @@
+"""Initializes the Token package."""
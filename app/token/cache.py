@@ -0,0 +1,125 @@
+"""A cache of verified JWTs.
+
+The access tokens of a client are sent with every request for hours.
+Instead of verifying the signature and parsing the claims of the same
+token on every request, the decoded claims are kept in a bounded LRU cache
+keyed by a hash of the token and of the decoding key.
+
+This module does not import the application, it is imported by it.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+from typing import Union
+from flask import current_app
+from flask_jwt_extended import JWTManager
+from flask_jwt_extended import view_decorators
+from flask_jwt_extended.config import config as jwt_config
+from flask_jwt_extended.utils import decode_token
+
+JWT_EXTENSION = 'flask-jwt-extended'
+
+
+class VerifiedTokenCache(object):
+    """A bounded LRU cache of the claims of verified tokens.
+
+    An entry is dropped when the token expires, and at the latest
+    JWT_CACHE_TTL seconds after it was cached. JWT_CACHE_SIZE bounds the
+    number of entries, 0 disables the cache.
+    """
+
+    def __init__(self):
+        """Initialize the cache."""
+        self._lock = threading.Lock()
+        self._tokens = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(encoded_token: Union[str, bytes]) -> bytes:
+        """Return the cache key of a token."""
+        digest = hashlib.sha256()
+        for value in [jwt_config.decode_key, encoded_token]:
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            digest.update(value or b'')
+            digest.update(b'\0')
+        return digest.digest()
+
+    def decode(self, encoded_token: Union[str, bytes], decode_func) -> dict:
+        """Return the claims of a token, verifying it with decode_func when
+        it is not cached."""
+        size = current_app.config['JWT_CACHE_SIZE']
+        if not size:
+            return decode_func()
+
+        key = self.get_key(encoded_token)
+        now = time.time()
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached is not None and cached[1] > now:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return dict(cached[0])
+            if cached is not None:
+                del self._tokens[key]
+            self.misses += 1
+
+        decoded = decode_func()
+
+        expires = now + current_app.config['JWT_CACHE_TTL']
+        if 'exp' in decoded:
+            expires = min(expires, decoded['exp'] + jwt_config.leeway)
+        with self._lock:
+            self._tokens[key] = (dict(decoded), expires)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > size:
+                self._tokens.popitem(last=False)
+        return decoded
+
+    def get_metrics(self) -> dict:
+        """Return the hit and miss counters of the cache."""
+        with self._lock:
+            return dict(size=len(self._tokens), hits=self.hits,
+                        misses=self.misses)
+
+    def clear(self):
+        """Remove all the tokens and reset the counters."""
+        with self._lock:
+            self._tokens.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def cached_decode_token(encoded_token, csrf_value=None, allow_expired=False):
+    """Decode a token like flask_jwt_extended's decode_token, using the
+    token cache of the application's JWT manager when possible."""
+    manager = current_app.extensions.get(JWT_EXTENSION)
+    token_cache = getattr(manager, 'token_cache', None)
+    if token_cache is None or csrf_value is not None or allow_expired:
+        return decode_token(encoded_token, csrf_value, allow_expired)
+    return token_cache.decode(encoded_token,
+                              lambda: decode_token(encoded_token))
+
+
+class CachingJWTManager(JWTManager):
+    """A JWT manager caching the tokens verified by the view decorators.
+
+    flask_jwt_extended has no hook for the decoding of the tokens of a
+    request, so the decode_token function its view decorators use is
+    replaced by cached_decode_token.
+    """
+
+    def __init__(self, app=None):
+        """Initialize the manager."""
+        self.token_cache = VerifiedTokenCache()
+        super().__init__(app)
+
+    def init_app(self, app):
+        """Register the manager with an app and install the cache."""
+        super().init_app(app)
+        app.config.setdefault('JWT_CACHE_SIZE', 1024)
+        app.config.setdefault('JWT_CACHE_TTL', 300)
+        view_decorators.decode_token = cached_decode_token
@@ -0,0 +1,21 @@
+"""Models for the Token package."""
+
+from datetime import datetime as dt
+
+from app import db
+
+
+class RevokedToken(db.Model):
+    """A revoked token, kept until the token expires."""
+
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=False, index=True, unique=True)
+    token_type = db.Column(db.String(10), nullable=False)
+    username = db.Column(db.String(64), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    revoked_at = db.Column(db.DateTime, default=dt.utcnow, index=True)
+
+    def __repr__(self) -> str:
+        """Generate a representation of the revoked token model."""
+        return '<RevokedToken {}>'.format(self.jti)
@@ -0,0 +1,5 @@
+"""The user an access token was issued to."""
+
+from collections import namedtuple
+
+Principal = namedtuple('Principal', ['id', 'username', 'is_admin'])
@@ -0,0 +1,292 @@
+"""Revocation of tokens.
+
+Revoked tokens are stored in the revoked_tokens table by their jti until
+they expire. Every request checks its token, so the process keeps a Bloom
+filter of the revoked jtis: a token not in the filter is not revoked
+without any query. The few tokens in the filter are looked up in the table
+once and the answer is kept in a small exact cache.
+
+The filter picks up the tokens revoked by other processes every
+JWT_REVOCATION_SYNC_INTERVAL seconds, loading only the rows revoked since
+the last sync. Rows are not committed in the order of their revocation
+time, and the clocks of the processes may differ, so every sync reads back
+JWT_REVOCATION_SYNC_MARGIN seconds before the last one. As expired tokens
+can't be removed from a Bloom filter, it is rebuilt from the table every
+JWT_REVOCATION_REBUILD_INTERVAL seconds.
+
+Deleting a user revokes all the tokens issued to the user until then. The
+revocation is stored as a row keyed by the user id instead of a jti, and a
+token with a user_id claim is checked against the filter for both keys.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+from datetime import datetime as dt, timedelta
+from typing import Union
+from flask import current_app
+from flask_jwt_extended.config import config as jwt_config
+
+from app import db
+from app.token.models import RevokedToken
+
+# The prefix of the keys revoking all the tokens of a user
+USER_KEY_PREFIX = 'user:'
+
+
+def get_user_key(user_id: int) -> str:
+    """Return the key the tokens of a user are revoked by."""
+    return f'{USER_KEY_PREFIX}{user_id}'
+
+
+class BloomFilter(object):
+    """A set of strings with false positives and no false negatives."""
+
+    def __init__(self, bits: int, hashes: int):
+        """Initialize the filter.
+
+        :param bits: the size of the filter in bits
+        :param hashes: the number of bits set per string
+        """
+        if bits < 8 or hashes < 1:
+            raise ValueError('Invalid Bloom filter size')
+        self.bits = bits
+        self.hashes = hashes
+        self.count = 0
+        self._array = bytearray((bits + 7) // 8)
+
+    def _get_positions(self, value: str) -> list:
+        """Return the bit positions of a string, derived from two halves of
+        its SHA-256."""
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        return [(first + index * second) % self.bits
+                for index in range(self.hashes)]
+
+    def add(self, value: str):
+        """Add a string to the filter."""
+        for position in self._get_positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        """Return True if a string may have been added to the filter."""
+        return all(self._array[position >> 3] & (1 << (position & 7))
+                   for position in self._get_positions(value))
+
+
+class RevocationList(object):
+    """The revoked tokens, checked without a query for most tokens."""
+
+    def __init__(self):
+        """Initialize the list."""
+        self._lock = threading.Lock()
+        self._filter = None
+        self._loaded_until = None
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._confirmed = collections.OrderedDict()
+        self._metrics = dict(checked=0, filter_hits=0, lookups=0, revoked=0)
+
+    def _new_filter(self) -> BloomFilter:
+        """Create an empty filter of the configured size."""
+        config = current_app.config
+        return BloomFilter(config['JWT_REVOCATION_FILTER_BITS'],
+                           config['JWT_REVOCATION_FILTER_HASHES'])
+
+    @staticmethod
+    def _load(since: Union[dt, None]) -> list:
+        """Return the jtis and the revocation times of the unexpired tokens
+        revoked since a time, or of all of them."""
+        query = db.session.query(RevokedToken.jti,
+                                 RevokedToken.revoked_at).filter(
+            db.or_(RevokedToken.expires_at.is_(None),
+                   RevokedToken.expires_at > dt.utcnow()))
+        if since is not None:
+            query = query.filter(RevokedToken.revoked_at >= since)
+        return query.all()
+
+    def refresh(self):
+        """Rebuild or sync the filter when it is due."""
+        config = current_app.config
+        now = time.monotonic()
+        with self._lock:
+            rebuild = self._filter is None or \
+                now - self._built_at >= \
+                config['JWT_REVOCATION_REBUILD_INTERVAL']
+            sync = now - self._synced_at >= \
+                config['JWT_REVOCATION_SYNC_INTERVAL']
+            since = None if rebuild else self._loaded_until
+        if not rebuild and not sync:
+            return
+
+        if since is not None:
+            since -= timedelta(seconds=config['JWT_REVOCATION_SYNC_MARGIN'])
+        started = dt.utcnow()
+        rows = self._load(since)
+        with self._lock:
+            if rebuild:
+                self._filter = self._new_filter()
+                self._confirmed.clear()
+                self._built_at = now
+            for jti, revoked_at in rows:
+                if jti not in self._filter:
+                    self._filter.add(jti)
+                if jti in self._confirmed:
+                    self._confirmed[jti] = revoked_at
+            self._loaded_until = started
+            self._synced_at = now
+
+    def _confirm(self, jti: str, revoked_at: Union[dt, bool]):
+        """Keep the answer of a lookup in the exact cache, the revocation
+        time or False."""
+        with self._lock:
+            self._confirmed[jti] = revoked_at
+            self._confirmed.move_to_end(jti)
+            while len(self._confirmed) > \
+                    current_app.config['JWT_REVOCATION_CACHE_SIZE']:
+                self._confirmed.popitem(last=False)
+
+    def get_revoked_at(self, jti: str) -> Union[dt, None]:
+        """Return the revocation time of the token with a jti, None if it is
+        not revoked."""
+        self.refresh()
+        with self._lock:
+            self._metrics['checked'] += 1
+            if jti not in self._filter:
+                return None
+            self._metrics['filter_hits'] += 1
+            revoked_at = self._confirmed.get(jti)
+            if revoked_at is not None:
+                self._confirmed.move_to_end(jti)
+                return revoked_at or None
+            self._metrics['lookups'] += 1
+
+        revoked_at = db.session.query(RevokedToken.revoked_at).filter(
+            RevokedToken.jti == jti).scalar()
+        self._confirm(jti, revoked_at or False)
+        return revoked_at
+
+    def is_revoked(self, jti: str) -> bool:
+        """Return True if the token with a jti is revoked."""
+        return self.get_revoked_at(jti) is not None
+
+    def is_token_revoked(self, decoded_token: dict) -> bool:
+        """Check a decoded token, the token_in_blacklist_loader callback.
+
+        Tokens without a jti can't be revoked by themselves. Tokens with a
+        user_id claim are revoked if they were issued before their user was
+        revoked.
+        """
+        jti = decoded_token.get('jti')
+        if jti and self.is_revoked(jti):
+            return True
+
+        claims = decoded_token.get(jwt_config.user_claims_key)
+        if not isinstance(claims, dict) or claims.get('user_id') is None:
+            return False
+        revoked_at = self.get_revoked_at(get_user_key(claims['user_id']))
+        if revoked_at is None:
+            return False
+        issued_at = decoded_token.get('iat')
+        return issued_at is None or \
+            dt.utcfromtimestamp(issued_at) <= revoked_at
+
+    def revoke(self, decoded_token: dict) -> RevokedToken:
+        """Revoke a decoded token.
+
+        The token is added to the session and to the filter, the caller
+        commits the session.
+
+        :raise ValueError: if the token has no jti
+        """
+        jti = decoded_token.get('jti')
+        if not jti:
+            raise ValueError('The token has no jti')
+
+        expires_at = None
+        if decoded_token.get('exp'):
+            expires_at = dt.utcfromtimestamp(decoded_token['exp'])
+        revoked_token = RevokedToken(
+            jti=jti, token_type=decoded_token.get('type', 'access'),
+            username=decoded_token.get(jwt_config.identity_claim_key),
+            expires_at=expires_at)
+        db.session.add(revoked_token)
+
+        self.refresh()
+        with self._lock:
+            self._filter.add(jti)
+            self._confirmed.pop(jti, None)
+            self._metrics['revoked'] += 1
+        return revoked_token
+
+    def revoke_user(self, user_id: int,
+                    username: str = None) -> RevokedToken:
+        """Revoke all the tokens issued to a user until now.
+
+        The revocation expires with the last of these tokens. It is added
+        to the session and to the filter, the caller commits the session.
+        """
+        key = get_user_key(user_id)
+        now = dt.utcnow()
+        expires_at = None
+        lifetimes = [jwt_config.access_expires, jwt_config.refresh_expires]
+        if all(lifetimes):
+            expires_at = now + max(lifetimes)
+
+        # The id of a deleted user may be given to a new user
+        revoked_user = RevokedToken.query.filter(
+            RevokedToken.jti == key).first()
+        if revoked_user is None:
+            revoked_user = RevokedToken(jti=key, token_type='user')
+            db.session.add(revoked_user)
+        revoked_user.username = username
+        revoked_user.revoked_at = now
+        revoked_user.expires_at = expires_at
+
+        self.refresh()
+        with self._lock:
+            self._filter.add(key)
+            self._confirmed.pop(key, None)
+            self._metrics['revoked'] += 1
+        return revoked_user
+
+    @staticmethod
+    def prune(now: dt = None) -> int:
+        """Delete the expired tokens from the table.
+
+        The filter forgets them at its next rebuild.
+
+        :return: the number of tokens deleted
+        """
+        if now is None:
+            now = dt.utcnow()
+        removed = RevokedToken.query.filter(
+            RevokedToken.expires_at <= now).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def get_metrics(self) -> dict:
+        """Return the counters of the checks."""
+        with self._lock:
+            metrics = dict(self._metrics, confirmed=len(self._confirmed))
+            metrics['filter_size'] = self._filter.count \
+                if self._filter is not None else 0
+        return metrics
+
+    def clear(self):
+        """Forget the filter and the counters, the filter is rebuilt on
+        the next check."""
+        with self._lock:
+            self._filter = None
+            self._loaded_until = None
+            self._synced_at = 0.0
+            self._built_at = 0.0
+            self._confirmed.clear()
+            for key in self._metrics:
+                self._metrics[key] = 0
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,97 @@
+"""Tracking of the last activity of the users."""
+
+import threading
+import time
+from datetime import datetime as dt
+from flask import current_app
+from sqlalchemy import bindparam
+
+from app import db
+from app.utils import count_cache
+from app.user.models import User
+
+
+class LastSeenTracker(object):
+    """Collect the last activity of the users and store it in batches.
+
+    The activity of a user is recorded in memory at most once every
+    LAST_SEEN_GRANULARITY seconds. The recorded times are written with a
+    single batched UPDATE, at most once every LAST_SEEN_FLUSH_INTERVAL
+    seconds, outside of the transactions of the requests.
+    """
+
+    def __init__(self):
+        """Initialize the tracker."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._recorded = {}
+        self._flushed_at = time.monotonic()
+
+    def record(self, username: str, when: dt = None) -> bool:
+        """Record the activity of a user.
+
+        :return: False if the activity was recorded recently already
+        """
+        now = time.monotonic()
+        granularity = current_app.config['LAST_SEEN_GRANULARITY']
+        with self._lock:
+            recorded = self._recorded.get(username)
+            if recorded is not None and now - recorded < granularity:
+                return False
+            self._recorded[username] = now
+            self._pending[username] = when or dt.utcnow()
+        return True
+
+    @property
+    def is_due(self) -> bool:
+        """Return True if the recorded activity should be stored."""
+        interval = current_app.config['LAST_SEEN_FLUSH_INTERVAL']
+        with self._lock:
+            return bool(self._pending) and \
+                time.monotonic() - self._flushed_at >= interval
+
+    def flush(self) -> int:
+        """Store the recorded activity.
+
+        If the update fails, the activity is kept for the next flush.
+
+        :return: the number of users updated
+        """
+        now = time.monotonic()
+        granularity = current_app.config['LAST_SEEN_GRANULARITY']
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = now
+            for username in [username for username, recorded
+                             in self._recorded.items()
+                             if now - recorded >= granularity]:
+                del self._recorded[username]
+        if not pending:
+            return 0
+
+        users = User.__table__
+        statement = users.update().where(
+            users.c.username == bindparam('_username')).values(
+            last_seen=bindparam('_last_seen'))
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, [
+                    dict(_username=username, _last_seen=last_seen)
+                    for username, last_seen in pending.items()])
+        except Exception:
+            with self._lock:
+                for username, last_seen in pending.items():
+                    self._pending.setdefault(username, last_seen)
+            raise
+
+        count_cache.invalidate(users.name)
+        return len(pending)
+
+    def clear(self):
+        """Forget the recorded activity without storing it."""
+        with self._lock:
+            self._pending.clear()
+            self._recorded.clear()
+
+
+last_seen_tracker = LastSeenTracker()
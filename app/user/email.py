@@ -0,0 +1,187 @@
+"""Validation of the email addresses of the users.
+
+EMAIL_VALIDATION_MODE selects how much is checked:
+- syntax - only the syntax of the address
+- cached - the syntax, and whether the domain accepts mail, looked up in
+  the DNS at most once every EMAIL_DNS_CACHE_TTL seconds per domain
+- full - the syntax and a DNS lookup of the domain for every address
+
+With EMAIL_DNS_ASYNC, the cached mode accepts an address whose domain is
+not cached yet and looks the domain up in the background instead.
+
+A domain is only undeliverable if it doesn't exist or has no MX, A or AAAA
+record. If the lookup itself fails, e.g. without a reachable name server,
+the address is accepted and the result is cached for EMAIL_DNS_ERROR_TTL
+seconds only.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+import dns.resolver
+from flask import current_app
+from email_validator import validate_email, EmailUndeliverableError
+
+EMAIL_VALIDATION_SYNTAX = 'syntax'
+EMAIL_VALIDATION_CACHED = 'cached'
+EMAIL_VALIDATION_FULL = 'full'
+EMAIL_VALIDATION_MODES = (EMAIL_VALIDATION_SYNTAX, EMAIL_VALIDATION_CACHED,
+                          EMAIL_VALIDATION_FULL)
+
+EMAIL_DNS_WORKERS = 2
+
+# The records of a domain accepting mail, looked up in this order
+MAIL_RECORD_TYPES = ('MX', 'A', 'AAAA')
+
+# deliverable is None if the lookup failed
+DomainResult = collections.namedtuple('DomainResult',
+                                      ['deliverable', 'message'])
+
+
+def check_domain(domain: str, domain_i18n: str,
+                 timeout: int) -> DomainResult:
+    """Look up whether a domain accepts mail."""
+    try:
+        resolver = dns.resolver.get_default_resolver()
+        for record_type in MAIL_RECORD_TYPES:
+            try:
+                resolver.query(domain + '.', record_type, lifetime=timeout)
+                return DomainResult(True, None)
+            except dns.resolver.NoAnswer:
+                continue
+    except dns.resolver.NXDOMAIN:
+        pass
+    except Exception as ex:
+        # No name server answered, the lookup timed out or there is no
+        # resolver configured: the domain is not to blame
+        return DomainResult(None, str(ex))
+    return DomainResult(False,
+                        f'The domain name {domain_i18n} does not exist.')
+
+
+def get_result_ttl(result: DomainResult, ttl: int, error_ttl: int) -> int:
+    """Return the seconds the result of a domain is cached for."""
+    return error_ttl if result.deliverable is None else ttl
+
+
+class EmailDomainCache(object):
+    """A process level cache of the deliverability of email domains.
+
+    The entries expire after EMAIL_DNS_CACHE_TTL seconds and the least
+    recently used ones are dropped beyond EMAIL_DNS_CACHE_SIZE entries.
+    """
+
+    def __init__(self):
+        """Initialize the cache."""
+        self._lock = threading.Lock()
+        self._domains = collections.OrderedDict()
+        self._pending = set()
+        self._executor = None
+
+    def get(self, domain: str) -> Union[DomainResult, None]:
+        """Return the cached result of a domain."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._domains.get(domain)
+            if cached is None:
+                return None
+            if cached[1] <= now:
+                del self._domains[domain]
+                return None
+            self._domains.move_to_end(domain)
+            return cached[0]
+
+    def _store(self, domain: str, result: DomainResult, ttl: int,
+               size: int):
+        """Cache the result of a domain."""
+        with self._lock:
+            self._domains[domain] = (result, time.monotonic() + ttl)
+            self._domains.move_to_end(domain)
+            while len(self._domains) > size:
+                self._domains.popitem(last=False)
+
+    def check(self, domain: str, domain_i18n: str) -> DomainResult:
+        """Look up a domain and cache the result."""
+        config = current_app.config
+        result = check_domain(domain, domain_i18n,
+                              config['EMAIL_DNS_TIMEOUT'])
+        self._store(domain, result,
+                    get_result_ttl(result, config['EMAIL_DNS_CACHE_TTL'],
+                                   config['EMAIL_DNS_ERROR_TTL']),
+                    config['EMAIL_DNS_CACHE_SIZE'])
+        return result
+
+    def check_later(self, domain: str, domain_i18n: str):
+        """Look up a domain in the background and cache the result.
+
+        A domain already being looked up is not looked up again.
+        """
+        config = current_app.config
+        args = (domain, domain_i18n, config['EMAIL_DNS_TIMEOUT'],
+                config['EMAIL_DNS_CACHE_TTL'], config['EMAIL_DNS_ERROR_TTL'],
+                config['EMAIL_DNS_CACHE_SIZE'])
+        with self._lock:
+            if domain in self._pending:
+                return
+            self._pending.add(domain)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=EMAIL_DNS_WORKERS,
+                    thread_name_prefix='email-dns')
+            executor = self._executor
+        executor.submit(self._check_in_background, *args)
+
+    def _check_in_background(self, domain: str, domain_i18n: str,
+                             timeout: int, ttl: int, error_ttl: int,
+                             size: int):
+        """Look up a domain in a worker thread."""
+        try:
+            result = check_domain(domain, domain_i18n, timeout)
+            self._store(domain, result,
+                        get_result_ttl(result, ttl, error_ttl), size)
+        finally:
+            with self._lock:
+                self._pending.discard(domain)
+
+    def clear(self):
+        """Remove all the cached results."""
+        with self._lock:
+            self._domains.clear()
+
+
+email_domain_cache = EmailDomainCache()
+
+
+def validate_email_address(email: str) -> dict:
+    """Validate an email address according to EMAIL_VALIDATION_MODE.
+
+    :return: the information on the address given by email_validator
+    :raise EmailNotValidError: if the address is not valid
+    """
+    config = current_app.config
+    mode = config['EMAIL_VALIDATION_MODE']
+    if mode not in EMAIL_VALIDATION_MODES:
+        raise ValueError(f'Invalid email validation mode {mode}')
+
+    info = validate_email(email, check_deliverability=False)
+    if mode == EMAIL_VALIDATION_SYNTAX:
+        return info
+
+    if mode == EMAIL_VALIDATION_FULL:
+        result = check_domain(info['domain'], info['domain_i18n'],
+                              config['EMAIL_DNS_TIMEOUT'])
+    else:
+        result = email_domain_cache.get(info['domain'])
+    if result is None:
+        if config['EMAIL_DNS_ASYNC']:
+            email_domain_cache.check_later(info['domain'],
+                                           info['domain_i18n'])
+            return info
+        result = email_domain_cache.check(info['domain'],
+                                          info['domain_i18n'])
+
+    if result.deliverable is False:
+        raise EmailUndeliverableError(result.message)
+    return info
@@ -0,0 +1,228 @@
+"""Password hashing off the request threads.
+
+New passwords are hashed according to a policy choosing PBKDF2 or bcrypt
+and their work factor. Hashing runs in a bounded pool of worker threads:
+hashlib's PBKDF2, used by werkzeug, and bcrypt both release the GIL, so the
+workers hash in parallel while the number of CPUs busy hashing stays
+bounded.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+from typing import Union
+from werkzeug.security import generate_password_hash, check_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+from flask import current_app, has_app_context
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+METHOD_PBKDF2 = 'pbkdf2:sha256'
+METHOD_BCRYPT = 'bcrypt'
+HASH_METHODS = (METHOD_PBKDF2, METHOD_BCRYPT)
+
+BCRYPT_PREFIX = '$2'
+DEFAULT_BCRYPT_ROUNDS = 12
+
+
+class PasswordHashingUnavailable(Exception):
+    """Raised when a password can't be hashed because the pool is busy."""
+
+
+class HashPolicy(object):
+    """The algorithm and work factor of new password hashes.
+
+    Passwords hashed by any supported algorithm can be verified. Hashes
+    made with another algorithm or work factor than the policy's should be
+    replaced, see needs_rehash.
+    """
+
+    def __init__(self, method: str = METHOD_PBKDF2,
+                 iterations: int = DEFAULT_PBKDF2_ITERATIONS,
+                 rounds: int = DEFAULT_BCRYPT_ROUNDS):
+        """Initialize the policy.
+
+        :param method: pbkdf2:sha256 or bcrypt
+        :param iterations: the PBKDF2 iterations
+        :param rounds: the bcrypt cost, the log2 of its rounds
+        """
+        if method not in HASH_METHODS:
+            raise ValueError(f'Invalid password hash method {method}')
+        if method == METHOD_BCRYPT and bcrypt is None:
+            raise ValueError('The bcrypt package is not installed')
+
+        self.method = method
+        self.iterations = iterations
+        self.rounds = rounds
+
+    @staticmethod
+    def from_config(config: dict) -> 'HashPolicy':
+        """Create the policy configured for the application."""
+        return HashPolicy(method=config['PASSWORD_HASH_METHOD'],
+                          iterations=config['PASSWORD_HASH_ITERATIONS'],
+                          rounds=config['PASSWORD_HASH_BCRYPT_ROUNDS'])
+
+    @staticmethod
+    def get_current() -> 'HashPolicy':
+        """Return the policy of the current application, or the default
+        policy outside of an application context."""
+        if has_app_context():
+            return HashPolicy.from_config(current_app.config)
+        return HashPolicy()
+
+    @property
+    def cost(self) -> int:
+        """Return the work factor of the policy's method."""
+        if self.method == METHOD_BCRYPT:
+            return self.rounds
+        return self.iterations
+
+    def hash(self, password: str) -> str:
+        """Hash a password."""
+        if self.method == METHOD_BCRYPT:
+            return bcrypt.hashpw(password.encode('utf-8'),
+                                 bcrypt.gensalt(self.rounds)).decode('ascii')
+        return generate_password_hash(
+            password, method=f'{self.method}:{self.iterations}')
+
+    def needs_rehash(self, password_hash: Union[str, None]) -> bool:
+        """Return True if a hash was not made with the policy's method and
+        work factor."""
+        if not password_hash:
+            return False
+        return get_hash_parameters(password_hash) != (self.method, self.cost)
+
+
+def get_hash_parameters(password_hash: str) -> tuple:
+    """Return the method and the work factor of a password hash.
+
+    Unknown formats give a None work factor.
+    """
+    if password_hash.startswith(BCRYPT_PREFIX):
+        try:
+            return METHOD_BCRYPT, int(password_hash.split('$')[2])
+        except (IndexError, ValueError):
+            return METHOD_BCRYPT, None
+
+    parts = password_hash.split('$', 1)[0].split(':')
+    method = ':'.join(parts[:2])
+    try:
+        return method, int(parts[2])
+    except (IndexError, ValueError):
+        return method, None
+
+
+def verify_password(password_hash: Union[str, None], password: str) -> bool:
+    """Check a password against a hash of any supported method."""
+    if not password_hash or password is None:
+        return False
+    if password_hash.startswith(BCRYPT_PREFIX):
+        if bcrypt is None:
+            raise ValueError('The bcrypt package is not installed')
+        return bcrypt.checkpw(password.encode('utf-8'),
+                              password_hash.encode('ascii'))
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher(object):
+    """Run password hashing functions in a bounded worker pool.
+
+    The pool has PASSWORD_HASH_WORKERS threads. At most
+    PASSWORD_HASH_QUEUE_SIZE more hashes wait for a worker, further hashes
+    are rejected. A caller waits at most PASSWORD_HASH_TIMEOUT seconds for
+    its hash. Outside of an application context hashing runs inline.
+    """
+
+    def __init__(self):
+        """Initialize the hasher."""
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._metrics = dict(hashed=0, rejected=0, timed_out=0,
+                             hash_seconds=0.0, max_hash_seconds=0.0,
+                             wait_seconds=0.0, max_wait_seconds=0.0)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the worker pool, creating it on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=current_app.config['PASSWORD_HASH_WORKERS'],
+                    thread_name_prefix='password-hash')
+            return self._executor
+
+    def _measure(self, func, submitted: float, *args):
+        """Run a hashing function in a worker and record its latency."""
+        started = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                self._metrics['hashed'] += 1
+                for key, value in [('hash_seconds', finished - started),
+                                   ('wait_seconds', started - submitted)]:
+                    self._metrics[key] += value
+                    self._metrics[f'max_{key}'] = max(
+                        self._metrics[f'max_{key}'], value)
+
+    def run(self, func, *args):
+        """Run a hashing function in the pool and return its result.
+
+        :raise PasswordHashingUnavailable: if the pool is saturated or the
+            hash takes too long
+        """
+        if not has_app_context():
+            return func(*args)
+
+        config = current_app.config
+        executor = self._get_executor()
+        with self._lock:
+            if self._in_flight >= config['PASSWORD_HASH_WORKERS'] + \
+                    config['PASSWORD_HASH_QUEUE_SIZE']:
+                self._metrics['rejected'] += 1
+                raise PasswordHashingUnavailable(
+                    'Too many password requests, try again later')
+            self._in_flight += 1
+
+        try:
+            future = executor.submit(self._measure, func, time.monotonic(),
+                                     *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+        try:
+            return future.result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeoutError:
+            with self._lock:
+                self._metrics['timed_out'] += 1
+            raise PasswordHashingUnavailable(
+                'Password request timed out, try again later')
+
+    def get_metrics(self) -> dict:
+        """Return the counters and latencies of the hashing."""
+        with self._lock:
+            metrics = dict(self._metrics, in_flight=self._in_flight)
+        hashed = metrics['hashed']
+        metrics['avg_hash_seconds'] = \
+            metrics['hash_seconds'] / hashed if hashed else 0.0
+        metrics['avg_wait_seconds'] = \
+            metrics['wait_seconds'] / hashed if hashed else 0.0
+        return metrics
+
+    def shutdown(self):
+        """Stop the worker pool, it is created again when needed."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
@@ -1,14 +1,20 @@
 """Models for the User package."""
 
+import collections
+import threading
+import time
 from typing import Union, List
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
-from email_validator import validate_email, EmailNotValidError
-from flask import current_app
+from email_validator import EmailNotValidError
+from flask import current_app, g, has_app_context
+from sqlalchemy.orm import make_transient_to_detached
 
 from app import db
+from app.database import reads_from_replica, record_replica_miss
 from app.utils import apply_filter
 from app.note.models import Note
+from app.user.hashing import HashPolicy, password_hasher, verify_password
+from app.user.email import validate_email_address
 
 USERS_PER_PAGE = 10
 
@@ -33,12 +39,25 @@ class User(db.Model):
         return '<User {}>'.format(self.id)
 
     def set_password(self, password):
-        """Set the user password."""
-        self.password_hash = generate_password_hash(password)
+        """Set the user password, hashed according to the hash policy.
+
+        :raise PasswordHashingUnavailable: if the hashing pool is busy
+        """
+        self.password_hash = password_hasher.run(
+            HashPolicy.get_current().hash, password)
 
     def check_password(self, password) -> bool:
-        """Check the user password."""
-        return check_password_hash(self.password_hash, password)
+        """Check the user password.
+
+        :raise PasswordHashingUnavailable: if the hashing pool is busy
+        """
+        return password_hasher.run(verify_password, self.password_hash,
+                                   password)
+
+    def password_needs_rehash(self) -> bool:
+        """Return True if the password hash doesn't follow the hash
+        policy."""
+        return HashPolicy.get_current().needs_rehash(self.password_hash)
 
     @staticmethod
     def get_props() -> list:
@@ -46,6 +65,24 @@ class User(db.Model):
         return ['id', 'username', 'email', 'is_admin', 'ts_created_at',
                 'ts_last_seen']
 
+    @staticmethod
+    def get_prop_columns() -> dict:
+        """Return the columns each property of the API is built from."""
+        return dict(
+            id=['id'],
+            username=['username'],
+            email=['email'],
+            is_admin=['is_admin'],
+            ts_created_at=['created_at'],
+            ts_last_seen=['last_seen']
+        )
+
+    @staticmethod
+    def get_filter_columns() -> list:
+        """Return the columns the API may filter and sort users by."""
+        return ['id', 'username', 'email', 'is_admin', 'created_at',
+                'last_seen']
+
     @property
     def ts_last_seen(self) -> float:
         """Return the timestamp of the last_seen time."""
@@ -62,15 +99,143 @@ class User(db.Model):
         return sorted_.all()
 
 
+class UserCache(object):
+    """A process level cache of users keyed by username.
+
+    The cache holds the column values of the users, so that a cached user
+    can be added to any session without a query. The entries expire after
+    USER_CACHE_TTL seconds, 0 disables the cache, and the least recently
+    used entries are dropped beyond USER_CACHE_SIZE entries. Every flush
+    that changes or deletes a user invalidates its entry.
+
+    Other processes only see a change when their entry expires, so the
+    password hash and the admin flag are not cached: they are loaded from
+    the database when a cached user's credentials or permissions are
+    checked.
+    """
+
+    UNCACHED_COLUMNS = ('password_hash', 'is_admin')
+
+    def __init__(self):
+        """Initialize the cache."""
+        self._lock = threading.Lock()
+        self._users = collections.OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if the cache is configured."""
+        return bool(current_app.config['USER_CACHE_TTL'])
+
+    def get(self, username: str) -> Union[dict, None]:
+        """Return the cached column values of a user."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._users.get(username)
+            if cached is None:
+                return None
+            if cached[1] <= now:
+                del self._users[username]
+                return None
+            self._users.move_to_end(username)
+            return cached[0]
+
+    def set(self, user: User):
+        """Cache the column values of a user."""
+        values = {column.key: getattr(user, column.key)
+                  for column in User.__table__.columns
+                  if column.key not in self.UNCACHED_COLUMNS}
+        expires = time.monotonic() + current_app.config['USER_CACHE_TTL']
+        with self._lock:
+            self._users[user.username] = (values, expires)
+            self._users.move_to_end(user.username)
+            while len(self._users) > current_app.config['USER_CACHE_SIZE']:
+                self._users.popitem(last=False)
+
+    def invalidate(self, username: str):
+        """Remove a user from the cache."""
+        with self._lock:
+            self._users.pop(username, None)
+
+    def clear(self):
+        """Remove all the users."""
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+def _get_request_users() -> dict:
+    """Return the users looked up by username during the current request
+    (or application context)."""
+    if not has_app_context():
+        return {}
+    return g.setdefault('users_by_username', {})
+
+
+def _load_cached_user(values: dict) -> User:
+    """Add a user to the session from its cached column values."""
+    identity_key = db.inspect(User).identity_key_from_primary_key(
+        [values['id']])
+    user = db.session.identity_map.get(identity_key)
+    if user is not None:
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
 def get_user_by_username(username: str) -> Union[User, None]:
     """Get a user by username.
 
+    A user is looked up once per request. If the process level cache is
+    enabled, it is taken from there before the database is queried. Users
+    read from a replica are not cached.
+
     :param username: user name
     """
-    user = User.query.filter_by(username=username).first()
+    if username is None:
+        return None
+
+    request_users = _get_request_users()
+    user = request_users.get(username)
+    if user is not None and user in db.session:
+        return user
+
+    values = None
+    if user_cache.enabled:
+        values = user_cache.get(username)
+
+    if values is not None:
+        user = _load_cached_user(values)
+    else:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            record_replica_miss()
+        elif user_cache.enabled and not reads_from_replica():
+            user_cache.set(user)
+
+    if user is not None:
+        request_users[username] = user
     return user
 
 
+def user_cache_flush_listener(session, flush_context):
+    """Invalidate the cached users changed or deleted by a flush."""
+    request_users = _get_request_users()
+    for instance in list(session.dirty) + list(session.deleted):
+        if not isinstance(instance, User):
+            continue
+        history = db.inspect(instance).attrs.username.history
+        for username in [instance.username] + list(history.deleted or []):
+            user_cache.invalidate(username)
+            request_users.pop(username, None)
+
+
+db.event.listen(db.session, 'after_flush', user_cache_flush_listener)
+
+
 def get_user_by_email(email: str) -> Union[User, None]:
     """Get a user by email.
 
@@ -100,7 +265,7 @@ def create_user(username: str, email: str, password: str) -> User:
         raise ValueError(f'Email {email} is taken')
 
     try:
-        validate_email(email)
+        validate_email_address(email)
     except EmailNotValidError as e:
         current_app.logger.error(str(e))
         raise ValueError(f'Email {email} is invalid')
@@ -133,7 +298,7 @@ def modify_user(user: User, values: dict) -> User:
 
         elif _property == 'email':
             try:
-                validate_email(value)
+                validate_email_address(value)
 
             except EmailNotValidError as e:
                 current_app.logger.error(str(e))
@@ -162,6 +327,12 @@ def toggle_admin(user: User, status: bool = False) -> User:
     return user
 
 
-def get_user_details(user: User) -> dict:
-    """Return user details as a dictionary."""
-    return {attr: getattr(user, attr) for attr in User.get_props()}
+def get_user_details(user: User, fields: list = None) -> dict:
+    """Return user details as a dictionary.
+
+    :param user: the user
+    :param fields: the properties to return, all of them by default
+    """
+    if fields is None:
+        fields = User.get_props()
+    return {attr: getattr(user, attr) for attr in fields}
@@ -1,8 +1,31 @@
 """Utils module."""
 
+import base64
+import binascii
+import collections
 import datetime
-from flask_sqlalchemy import BaseQuery
+import json
+import math
+import threading
+import time
+from flask import current_app
+from flask_sqlalchemy import BaseQuery, Pagination
+from sqlalchemy import tuple_, bindparam, select, table, \
+    column as sql_column, literal_column
+from sqlalchemy.orm import load_only, selectinload
 from app import db
+from app.database import reads_from_replica, record_replica_miss
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+COUNT_OPTIONS = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+QUERY_PLAN_CACHE_SIZE = 256
+FILTER_IN_MAX_VALUES = 500
+
+# The order by the relevance of the match filter of the query
+ORDER_RELEVANCE = 'relevance'
 
 
 def strip_column_prefix(column):
@@ -13,72 +36,773 @@ def strip_column_prefix(column):
 
 
 def process_filter_value(filter_):
-    """Process filter values: identify timestamps and convert to datetime."""
+    """Process filter values: identify timestamps and convert to datetime.
+
+    A list value is processed item by item.
+    """
     value = filter_['value']
     if filter_['column'].find("ts_") == 0:
-        value = datetime.datetime.fromtimestamp(value)
+        if isinstance(value, list):
+            value = [datetime.datetime.fromtimestamp(item) for item in value]
+        else:
+            value = datetime.datetime.fromtimestamp(value)
 
     return value
 
 
+def get_dialect_name() -> str:
+    """Return the name of the database dialect in use."""
+    return db.engine.dialect.name
+
+
+def match_criterion(column, value):
+    """Build a full-text search criterion for a column.
+
+    On MySQL the FULLTEXT index of the column is used. Other databases
+    (SQLite) search the FTS5 table named after the table of the model.
+    """
+    model = column.class_
+    match_columns = []
+    if hasattr(model, 'get_match_columns'):
+        match_columns = model.get_match_columns()
+    if column.key not in match_columns:
+        raise ValueError(f'Invalid match column {column.key}')
+
+    if get_dialect_name() == 'mysql':
+        return column.match(value)
+
+    fts = table(f'{model.__tablename__}_fts', sql_column('rowid'),
+                sql_column(column.key))
+    return model.id.in_(
+        select([fts.c.rowid]).where(fts.c[column.key].match(value)))
+
+
+def match_score(column, value):
+    """Build the relevance of a full-text search, higher is more relevant.
+
+    On MySQL this is the MATCH ... AGAINST score, on SQLite the negated
+    bm25 rank of the FTS5 table, looked up for every matched row.
+    """
+    model = column.class_
+    if get_dialect_name() == 'mysql':
+        return column.match(value)
+
+    fts_name = f'{model.__tablename__}_fts'
+    fts = table(fts_name, sql_column('rowid'), sql_column(column.key))
+    return -select([db.func.bm25(literal_column(fts_name))]).where(
+        fts.c[column.key].match(value)).where(
+        fts.c.rowid == model.id).as_scalar()
+
+
+# The characters of the MySQL boolean mode syntax, dropped from search terms
+MYSQL_MATCH_OPERATORS = '"+-<>()~*@'
+
+
+def match_param(value) -> str:
+    """Turn a search string into a full-text query matching all its words.
+
+    On SQLite the words are quoted, doubling their quotes, so characters of
+    the FTS5 query syntax in the search string are searched for instead of
+    being interpreted. MySQL can't escape a quote within a quoted phrase, so
+    the characters of its boolean mode syntax separate the words instead.
+    """
+    value = str(value)
+    mysql = get_dialect_name() == 'mysql'
+    if mysql:
+        value = value.translate(
+            {ord(char): ' ' for char in MYSQL_MATCH_OPERATORS})
+    terms = ['"{}"'.format(term.replace('"', '""'))
+             for term in value.split()]
+    if not terms:
+        raise ValueError('Search value cannot be empty')
+
+    if mysql:
+        terms = ['+' + term for term in terms]
+    return ' '.join(terms)
+
+
+def prefix_param(value) -> str:
+    """Turn a value into a LIKE pattern matching the strings it starts."""
+    value = str(value).replace('\\', '\\\\').replace(
+        '%', '\\%').replace('_', '\\_')
+    return value + '%'
+
+
+def in_param(value) -> list:
+    """Validate the list of values of an in type filter."""
+    if not isinstance(value, list) or not value:
+        raise ValueError('The in filter requires a list of values')
+    if len(value) > FILTER_IN_MAX_VALUES:
+        raise ValueError(
+            f'The in filter accepts at most {FILTER_IN_MAX_VALUES} values')
+    return value
+
+
+def between_param(value) -> list:
+    """Validate the bounds of a between type filter."""
+    if not isinstance(value, list) or len(value) != 2:
+        raise ValueError('The between filter requires two values')
+    return value
+
+
+FilterType = collections.namedtuple(
+    'FilterType', ['criterion', 'transform', 'arity', 'expanding'])
+
+
+def filter_type(criterion, transform=None, arity: int = 1,
+                expanding: bool = False) -> FilterType:
+    """Define a filter type.
+
+    - criterion - builds the where clause from the column and the values
+    - transform - converts the filter value into the value(s) to bind
+    - arity - the number of values the criterion takes
+    - expanding - True if the value is a list bound to an IN clause
+    """
+    return FilterType(criterion, transform, arity, expanding)
+
+
+FILTER_TYPES = {
+    'like': filter_type(lambda column, value: column.like(value),
+                        lambda value: "%{}%".format(str(value))),
+    'prefix': filter_type(
+        lambda column, value: column.like(value, escape='\\'),
+        prefix_param),
+    'eq': filter_type(lambda column, value: column == value),
+    'geq': filter_type(lambda column, value: column >= value),
+    'leq': filter_type(lambda column, value: column <= value),
+    'in': filter_type(lambda column, value: column.in_(value), in_param,
+                      expanding=True),
+    'between': filter_type(
+        lambda column, low, high: column.between(low, high),
+        between_param, arity=2),
+    'match': filter_type(match_criterion, match_param),
+}
+
+
+def is_complete_filter(filter_: dict) -> bool:
+    """Return True if the filter has a column, a type and a value."""
+    return 'column' in filter_ and 'value' in filter_ and 'type' in filter_
+
+
+def check_shape_names(part: dict, keys: tuple, name: str):
+    """Raise a ValueError unless the keys naming the columns and the types
+    of a filter or an order are strings."""
+    if not isinstance(part, dict):
+        raise ValueError(f'Invalid {name}')
+    for key in keys:
+        if key in part and not isinstance(part[key], str):
+            raise ValueError(f'Invalid {name} {key}')
+
+
+def get_filter_column(model: db.Model, column: str):
+    """Return the model attribute of a column the model allows to filter
+    and sort by."""
+    column = strip_column_prefix(column)
+    if column not in model.get_filter_columns():
+        raise ValueError(f'Invalid filter column {column}')
+    return getattr(model, column)
+
+
+def get_filter_type(type_: str) -> FilterType:
+    """Return the filter type definition by its name."""
+    if type_ not in FILTER_TYPES:
+        raise ValueError(f'Invalid filter type {type_}')
+    return FILTER_TYPES[type_]
+
+
+def get_filter_params(filter_: dict) -> list:
+    """Return the values a filter binds to its criterion."""
+    value = process_filter_value(filter_)
+    filter_type_ = get_filter_type(filter_['type'])
+    if filter_type_.transform:
+        value = filter_type_.transform(value)
+    if filter_type_.arity == 1:
+        return [value]
+    return list(value)
+
+
 def apply_filter(query: BaseQuery, model: db.Model, filter_: dict):
     """Apply a filter to a query.
-    
+
     Possible filter types are:
     - like - builds a where clause "column like '%column_value%'"
+    - prefix - builds a where clause "column like 'column_value%'"
     - eq  - builds a where clause "column = 'column_value'"
     - geq - builds a where clause "column => 'column_value'"
     - leq - builds a where clause "column <= 'column_value'"
-    
+    - in - builds a where clause "column in (value_1, value_2, ...)"
+    - between - builds a where clause "column between value_1 and value_2"
+    - match - a full-text search for all the words of the value, available
+      for the columns of model.get_match_columns()
+
     The filter has to have three elements:
     - column - name of the column that corresponds to an attribute of the model
-    - type - one of the four types described above
+    - type - one of the types described above
     - value - a value to filter the column by.
     """
-    if 'column' in filter_ and 'value' in filter_ and 'type' in filter_:
-        column = strip_column_prefix(filter_['column'])
-        value = process_filter_value(filter_)
+    if is_complete_filter(filter_):
+        column = get_filter_column(model, filter_['column'])
+        filter_type_ = get_filter_type(filter_['type'])
+        query = query.filter(
+            filter_type_.criterion(column, *get_filter_params(filter_)))
+    return query
 
-        if filter_['type'] == 'like':
-            query = query.filter(
-                getattr(model, column).like("%{}%".format(str(value))))
 
-        if filter_['type'] == 'eq':
-            query = query.filter(getattr(model, column) == value)
+def get_field_columns(model: db.Model, fields: list) -> list:
+    """Return the names of the columns needed to serialize some fields of a
+    model."""
+    if not isinstance(fields, list):
+        raise ValueError('Fields must be a list')
 
-        if filter_['type'] == 'geq':
-            query = query.filter(getattr(model, column) >= value)
+    prop_columns = model.get_prop_columns()
+    columns = []
+    for field in fields:
+        if field not in prop_columns:
+            raise ValueError(f'Invalid field {field}')
+        for column in prop_columns[field]:
+            if column not in columns:
+                columns.append(column)
+    return columns
 
-        if filter_['type'] == 'leq':
-            query = query.filter(getattr(model, column) <= value)
-    return query
+
+def get_field_relationships(model: db.Model, fields: list = None) -> list:
+    """Return the names of the relationships needed to serialize some
+    fields of a model, or all of its fields by default."""
+    if not hasattr(model, 'get_prop_relationships'):
+        return []
+
+    prop_relationships = model.get_prop_relationships()
+    if fields is None:
+        fields = list(prop_relationships.keys())
+
+    relationships = []
+    for field in fields:
+        for relationship in prop_relationships.get(field, []):
+            if relationship not in relationships:
+                relationships.append(relationship)
+    return relationships
+
+
+def get_entity(entity_class: db.Model, entity_id, fields: list = None):
+    """Return an entity by id, loading only the columns of some fields.
+
+    The other columns are deferred and only loaded if they are accessed.
+    """
+    query = entity_class.query
+    if fields is not None:
+        query = query.options(
+            load_only(*get_field_columns(entity_class, fields)))
+    entity = query.get(entity_id)
+    if entity is None:
+        record_replica_miss()
+    return entity
+
+
+class QueryPlan(object):
+    """A compiled, reusable form of an entity list query.
+
+    A plan is built once for a query shape: the model, the columns and types
+    of the filters, the order and the columns to load. Its criteria use
+    bound parameters in place of the filter values, so the same statements
+    serve every request of the shape and their compiled SQL is kept in the
+    plan's compiled cache.
+    """
+
+    def __init__(self, entity_class: db.Model, filter_shape: tuple,
+                 order_shape: tuple = None, columns: tuple = None,
+                 relationships: tuple = ()):
+        """Resolve the columns and build the criteria of the plan.
+
+        The relationships are loaded for all the entities of a slice with
+        one extra query each, instead of one query per entity.
+        """
+        self.entity_class = entity_class
+        self.compiled_cache = {}
+        self.load_options = [
+            selectinload(getattr(entity_class, relationship))
+            for relationship in relationships]
+
+        self.criteria = []
+        for index, (column, type_) in enumerate(filter_shape):
+            filter_type_ = get_filter_type(type_)
+            params = [bindparam(f'filter_{index}_{number}',
+                                expanding=filter_type_.expanding)
+                      for number in range(filter_type_.arity)]
+            self.criteria.append(filter_type_.criterion(
+                get_filter_column(entity_class, column), *params))
+
+        self.order_column = None
+        self.order_by = []
+        self.descending = False
+        if order_shape and order_shape[0] == ORDER_RELEVANCE:
+            self.order_by = self._get_relevance_order(
+                entity_class, filter_shape, order_shape[1] != 'asc')
+        elif order_shape:
+            self.order_column = get_filter_column(entity_class,
+                                                  order_shape[0])
+            self.descending = order_shape[1] == 'desc'
+            if self.descending:
+                self.order_by = [self.order_column.desc()]
+            else:
+                self.order_by = [self.order_column.asc()]
+
+        self.columns = None
+        if columns is not None:
+            self.columns = ['id']
+            if self.order_column is not None:
+                self.columns.append(self.order_column.key)
+            self.columns += [column for column in columns
+                             if column not in self.columns]
+
+        self._page_statement = None
+        self._seek_statements = {}
+        self._count_statement = None
+
+    @staticmethod
+    def _get_relevance_order(entity_class: db.Model, filter_shape: tuple,
+                             descending: bool) -> list:
+        """Return the order by the relevance of the first match filter,
+        the most relevant first unless ascending, then by id."""
+        for index, (column, type_) in enumerate(filter_shape):
+            if type_ == 'match':
+                score = match_score(get_filter_column(entity_class, column),
+                                    bindparam(f'filter_{index}_0'))
+                if descending:
+                    return [score.desc(), entity_class.id.asc()]
+                return [score.asc(), entity_class.id.asc()]
+        raise ValueError('The relevance order requires a match filter')
+
+    @staticmethod
+    def get_params(filters: list) -> dict:
+        """Return the values to bind to the criteria of a plan."""
+        params = {}
+        for index, filter_ in enumerate(filters):
+            for number, value in enumerate(get_filter_params(filter_)):
+                params[f'filter_{index}_{number}'] = value
+        return params
+
+    def _select(self, *criteria):
+        """Return a labeled select statement of the entity table.
+
+        Only the columns of the plan are selected, the others are left
+        unloaded by the ORM.
+        """
+        table_ = self.entity_class.__table__
+        if self.columns is None:
+            statement = select([table_], use_labels=True)
+        else:
+            statement = select([table_.c[column] for column in self.columns],
+                               use_labels=True)
+        for criterion in self.criteria + list(criteria):
+            statement = statement.where(criterion)
+        return statement
+
+    def _fetch(self, statement, params: dict) -> list:
+        """Load the entities of a statement using the compiled cache."""
+        return self.entity_class.query.options(
+            *self.load_options).from_statement(statement).params(
+            params).execution_options(
+            compiled_cache=self.compiled_cache).all()
+
+    def get_query(self, params: dict) -> BaseQuery:
+        """Return an ORM query equivalent to the statements of the plan."""
+        query = self.entity_class.query.options(*self.load_options).filter(
+            *self.criteria).order_by(*self.order_by).params(params)
+        if self.columns is not None:
+            query = query.options(load_only(*self.columns))
+        return query
+
+    def fetch(self, params: dict, limit: int, offset: int = 0) -> list:
+        """Load a slice of the entities matched by the plan."""
+        if self._page_statement is None:
+            self._page_statement = self._select().order_by(
+                *self.order_by).limit(bindparam('_limit')).offset(
+                bindparam('_offset'))
+        return self._fetch(self._page_statement,
+                           dict(params, _limit=limit, _offset=offset))
+
+    def fetch_after(self, params: dict, position: list, limit: int) -> list:
+        """Load the entities sorted after a (value, id) position.
+
+        Without a position the slice starts from the first entity.
+        """
+        if self.order_column is None:
+            raise ValueError('Cursors require an order by a column')
+
+        has_position = position is not None
+        statement = self._seek_statements.get(has_position)
+        if statement is None:
+            id_column = self.entity_class.id
+            if self.descending:
+                order_by = [self.order_column.desc(), id_column.desc()]
+            else:
+                order_by = [self.order_column.asc(), id_column.asc()]
+
+            criteria = []
+            if has_position:
+                sort_key = tuple_(self.order_column, id_column)
+                seek = tuple_(
+                    bindparam('_seek_value', type_=self.order_column.type),
+                    bindparam('_seek_id', type_=id_column.type))
+                if self.descending:
+                    criteria.append(sort_key < seek)
+                else:
+                    criteria.append(sort_key > seek)
+
+            statement = self._select(*criteria).order_by(
+                *order_by).limit(bindparam('_limit'))
+            self._seek_statements[has_position] = statement
+
+        params = dict(params, _limit=limit)
+        if has_position:
+            params['_seek_value'], params['_seek_id'] = position
+        return self._fetch(statement, params)
+
+    def count(self, params: dict) -> int:
+        """Count the entities matched by the plan with a single COUNT."""
+        if self._count_statement is None:
+            statement = select([db.func.count(self.entity_class.id)])
+            for criterion in self.criteria:
+                statement = statement.where(criterion)
+            self._count_statement = statement
+
+        connection = db.session.connection(
+            mapper=self.entity_class.__mapper__).execution_options(
+            compiled_cache=self.compiled_cache)
+        return connection.execute(self._count_statement, params).scalar()
+
+
+class QueryPlanCache(object):
+    """A bounded LRU cache of query plans keyed by the query shape."""
+
+    def __init__(self, size: int = QUERY_PLAN_CACHE_SIZE):
+        """Initialize the cache."""
+        self.size = size
+        self._lock = threading.Lock()
+        self._plans = collections.OrderedDict()
+
+    def get_plan(self, entity_class: db.Model, filters: list = None,
+                 order: dict = None, columns: list = None,
+                 relationships: list = None) -> QueryPlan:
+        """Return the plan of a query shape, compiling it on first use."""
+        filter_shape = tuple((filter_['column'], filter_['type'])
+                             for filter_ in filters or [])
+        order_shape = None
+        if order is not None:
+            order_shape = (order['column'], order['dir'])
+        if columns is not None:
+            columns = tuple(columns)
+        relationships = tuple(relationships or ())
+        key = (entity_class, filter_shape, order_shape, columns,
+               relationships)
+
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+
+        plan = QueryPlan(entity_class, filter_shape, order_shape, columns,
+                         relationships)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        """Remove all the plans."""
+        with self._lock:
+            self._plans.clear()
+
+
+query_plan_cache = QueryPlanCache()
+
+
+def get_query_plan(entity_class: db.Model, filters: list = None,
+                   order: dict = None, fields: list = None) -> tuple:
+    """Return the plan of a query and the parameters to bind to it.
+
+    Filters missing a column, a type or a value are ignored. If fields are
+    given, the plan loads only the columns needed to serialize them. The
+    relationships the fields are serialized from are eagerly loaded.
+    """
+    for filter_ in filters or []:
+        check_shape_names(filter_, ('column', 'type'), 'filter')
+    if order is not None:
+        check_shape_names(order, ('column', 'dir'), 'order')
+    filters = [filter_ for filter_ in filters or []
+               if is_complete_filter(filter_)]
+    columns = None
+    if fields is not None:
+        columns = get_field_columns(entity_class, fields)
+    relationships = get_field_relationships(entity_class, fields)
+    plan = query_plan_cache.get_plan(entity_class, filters, order, columns,
+                                     relationships)
+    return plan, plan.get_params(filters)
+
+
+def filter_entities(entity_class: db.Model, filters: list = None) -> BaseQuery:
+    """Return a query of the entity class with all filters applied."""
+    plan, params = get_query_plan(entity_class, filters)
+    return plan.get_query(params)
 
 
 def get_entities(entity_class: db.Model, page: int, per_page: int,
-                 filters: list = None, order: dict = None):
-    """Return a list of entities, paged, filtered, sorted."""
-    if filters is None:
-        filters = []
+                 filters: list = None, order: dict = None,
+                 count: str = COUNT_EXACT, fields: list = None):
+    """Return a list of entities, paged, filtered, sorted.
+
+    The count option controls how the total is obtained:
+    - exact - a COUNT is run for the filtered set
+    - estimate - the total is taken from the count cache when possible
+    - none - no total is computed, total and pages are None
+
+    If fields are given, only the columns needed to serialize them are
+    loaded. The "relevance" order column sorts the entities by the
+    relevance of the match filter of the query.
+    """
     if order is None:
         order = {"column": "id", "dir": "asc"}
 
-    entities = entity_class.query
-    for filter_ in filters:
-        entities = apply_filter(entities, entity_class, filter_)
+    if count not in COUNT_OPTIONS:
+        raise ValueError(f'Invalid count option {count}')
 
-    column = order['column']
-    if column.find("ts_") == 0:
-        column = column.replace("ts_", "", 1)
+    plan, params = get_query_plan(entity_class, filters, order, fields)
+
+    if count == COUNT_NONE:
+        return paginate_entities_uncounted(plan, params, page, per_page)
 
-    if order['dir'] == 'desc':
-        entities = entities.order_by(
-            getattr(entity_class, column).desc())
+    if count == COUNT_ESTIMATE:
+        def count_func():
+            return count_cache.get_count(entity_class, filters,
+                                         lambda: plan.count(params))
     else:
-        entities = entities.order_by(
-            getattr(entity_class, column).asc())
+        def count_func():
+            return plan.count(params)
+
+    return paginate_entities(plan, params, page, per_page, count_func)
+
+
+def count_entities(entity_class: db.Model, entities: BaseQuery) -> int:
+    """Count the rows matched by a query with a single COUNT statement.
+
+    Unlike BaseQuery.count() this does not wrap the query in a sub-select of
+    every column, so no row data is read to produce the number.
+    """
+    return entities.order_by(None).with_entities(
+        db.func.count(entity_class.id)).scalar()
+
+
+def paginate_entities(plan: QueryPlan, params: dict, page: int,
+                      per_page: int, count_func) -> Pagination:
+    """Paginate a query plan, moving a page that is out of range to the
+    last one.
+
+    Only the rows of the requested page are loaded; the total is computed
+    by count_func, which is skipped when the first page is not full.
+    """
+    page = max(page, 1)
+    query = plan.get_query(params)
+
+    items = plan.fetch(params, per_page, (page - 1) * per_page)
+    if page == 1 and len(items) < per_page:
+        return Pagination(query, page, per_page, len(items), items)
+
+    total = count_func()
+    if not items and page > 1:
+        page = max(math.ceil(total / per_page), 1)
+        items = plan.fetch(params, per_page, (page - 1) * per_page)
+
+    return Pagination(query, page, per_page, total, items)
+
+
+class UncountedPagination(Pagination):
+    """A pagination object that knows only whether a next page exists."""
+
+    def __init__(self, query: BaseQuery, page: int, per_page: int,
+                 items: list, has_next: bool):
+        """Initialize the pagination without a total."""
+        super().__init__(query, page, per_page, None, items)
+        self._has_next = has_next
+
+    @property
+    def pages(self):
+        """Return None as the number of pages is unknown."""
+        return None
+
+    @property
+    def has_next(self) -> bool:
+        """Return True if a row past this page has been found."""
+        return self._has_next
+
+
+def paginate_entities_uncounted(plan: QueryPlan, params: dict, page: int,
+                                per_page: int) -> UncountedPagination:
+    """Paginate a query plan without counting the rows.
+
+    One row more than a page is fetched to find out if there is a next page.
+    """
+    page = max(page, 1)
+
+    items = plan.fetch(params, per_page + 1, (page - 1) * per_page)
+    has_next = len(items) > per_page
+
+    return UncountedPagination(plan.get_query(params), page, per_page,
+                               items[:per_page], has_next)
+
+
+class CountCache(object):
+    """Cache of entity counts keyed by the table and a filter signature.
+
+    The entries expire after COUNT_CACHE_TTL seconds. Every flush that
+    inserts, updates or deletes rows of a table invalidates all the
+    entries of that table. Counts read from a replica are not cached.
+    """
+
+    def __init__(self):
+        """Initialize the cache."""
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._generations = {}
+
+    @staticmethod
+    def get_signature(filters: list = None) -> str:
+        """Return a key describing the filter list."""
+        return json.dumps(filters or [], sort_keys=True)
+
+    def get_count(self, entity_class: db.Model, filters: list,
+                  count_func) -> int:
+        """Return a cached count or compute it with count_func."""
+        table = entity_class.__tablename__
+        key = (table, self.get_signature(filters))
+        now = time.monotonic()
+
+        with self._lock:
+            generation = self._generations.get(table, 0)
+            cached = self._counts.get(key)
+        if cached and cached[1] == generation and cached[2] > now:
+            return cached[0]
+
+        value = count_func()
+        if reads_from_replica():
+            return value
+
+        expires = now + current_app.config['COUNT_CACHE_TTL']
+        with self._lock:
+            if self._generations.get(table, 0) == generation:
+                self._counts[key] = (value, generation, expires)
+        return value
+
+    def invalidate(self, table: str):
+        """Invalidate all the counts cached for a table."""
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            for key in [key for key in self._counts if key[0] == table]:
+                del self._counts[key]
+
+    def clear(self):
+        """Remove all the cached counts."""
+        with self._lock:
+            for table in list(self._generations):
+                self._generations[table] += 1
+            self._counts.clear()
+
+
+count_cache = CountCache()
+
+
+def count_cache_flush_listener(session, flush_context):
+    """Invalidate the cached counts of the tables changed by a flush."""
+    tables = set()
+    for instance in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        table = getattr(instance, '__tablename__', None)
+        if table:
+            tables.add(table)
+    for table in tables:
+        count_cache.invalidate(table)
+
+
+db.event.listen(db.session, 'after_flush', count_cache_flush_listener)
+
+
+def _cursor_default(value):
+    """Serialize the cursor values JSON can't handle natively."""
+    if isinstance(value, datetime.datetime):
+        return {'$dt': value.isoformat()}
+    raise TypeError(f'Cannot use {type(value).__name__} in a cursor')
+
+
+def _cursor_object_hook(value: dict):
+    """Restore the cursor values serialized by _cursor_default."""
+    if '$dt' in value:
+        return datetime.datetime.fromisoformat(value['$dt'])
+    return value
+
+
+def encode_cursor(values: list) -> str:
+    """Encode a seek position into an opaque cursor string."""
+    payload = json.dumps(values, default=_cursor_default)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a cursor string created by encode_cursor."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor.encode())
+        values = json.loads(payload, object_hook=_cursor_object_hook)
+    except (AttributeError, binascii.Error, UnicodeDecodeError,
+            ValueError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+class CursorPage(object):
+    """A page of entities fetched by a keyset (cursor) query."""
+
+    def __init__(self, items: list, per_page: int, next_cursor: str = None):
+        """Initialize the page."""
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self) -> bool:
+        """Return True if there is a page after this one."""
+        return self.next_cursor is not None
+
+
+def get_entities_by_cursor(entity_class: db.Model, per_page: int,
+                           filters: list = None, order: dict = None,
+                           cursor: str = None,
+                           fields: list = None) -> CursorPage:
+    """Return a page of entities positioned by a cursor.
+
+    Instead of skipping rows with an offset, the query seeks past the last
+    row of the previous page using the sort column and the id as a
+    tie-breaker: "WHERE (column, id) > (last_value, last_id)". The cost of
+    a page therefore does not depend on how deep into the list it is.
+    """
+    if order is None:
+        order = {"column": "id", "dir": "asc"}
+
+    plan, params = get_query_plan(entity_class, filters, order, fields)
+
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+
+    items = plan.fetch_after(params, position, per_page + 1)
 
-    entity_length = len(entities.all())
-    if entity_length < (page - 1) * per_page + 1:
-        page = entity_length // per_page + 1
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, plan.order_column.key),
+                                     last.id])
 
-    return entities.paginate(page, per_page, False)
+    return CursorPage(items, per_page, next_cursor)
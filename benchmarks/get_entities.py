@@ -0,0 +1,91 @@
+"""Benchmark the page clamping of get_entities.
+
+Compares the former approach, which loaded every matching note to find out
+how many there are, with the COUNT based pagination of app.utils.
+
+Usage: python benchmarks/get_entities.py [note_count]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+
+from app import create_app, db  # noqa: E402
+from app.note.models import Note  # noqa: E402
+from app.user.models import User  # noqa: E402
+from app.utils import get_entities, filter_entities  # noqa: E402
+from config import config_list  # noqa: E402
+
+NOTE_COUNT = 100000
+BATCH_SIZE = 5000
+ROUNDS = 5
+
+
+def get_entities_materialized(entity_class, page, per_page):
+    """Paginate the way get_entities did before the COUNT based clamping."""
+    entities = filter_entities(entity_class).order_by(entity_class.id.asc())
+    entity_length = len(entities.all())
+    if entity_length < (page - 1) * per_page + 1:
+        page = entity_length // per_page + 1
+    return entities.paginate(page, per_page, False)
+
+
+def populate(note_count: int):
+    """Insert a user and note_count notes with a few KB of text each."""
+    user = User(username='bench', email='bench@example.com')
+    db.session.add(user)
+    db.session.commit()
+
+    text = 'lorem ipsum ' * 200
+    for start in range(0, note_count, BATCH_SIZE):
+        db.session.execute(Note.__table__.insert(), [
+            dict(created_by=user.id, title=f'Note {i}', text=text,
+                 version_num=1)
+            for i in range(start, min(start + BATCH_SIZE, note_count))])
+    db.session.commit()
+
+
+def measure(func) -> tuple:
+    """Return the mean duration and peak memory of a paginated call."""
+    durations = []
+    tracemalloc.start()
+    for _ in range(ROUNDS):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sum(durations) / len(durations), peak
+
+
+def main(note_count: int):
+    """Run the benchmark."""
+    db_fd, db_path = tempfile.mkstemp()
+    config = config_list['testing']
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + db_path
+    app = create_app(config)
+
+    with app.app_context():
+        db.create_all()
+        populate(note_count)
+
+        for label, func in [
+            ('materialized', lambda: get_entities_materialized(Note, 5, 10)),
+            ('count', lambda: get_entities(Note, 5, 10))
+        ]:
+            duration, peak = measure(func)
+            print(f'{label:>12}: {duration * 1000:9.2f} ms/call, '
+                  f'peak memory {peak / 1024 / 1024:8.2f} MB')
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NOTE_COUNT)
@@ -0,0 +1,77 @@
+"""Add the delta storage columns of note_versions
+
+Revision ID: 34dce2b3251c
+Revises: f36834f405a7
+Create Date: 2026-10-17 11:20:57.804431
+
+Existing versions keep their full text and become keyframes.
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '34dce2b3251c'
+down_revision = 'f36834f405a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('note_versions',
+                  sa.Column('delta', sa.Text(), nullable=True))
+    op.add_column('note_versions',
+                  sa.Column('is_keyframe', sa.Boolean(create_constraint=False),
+                            nullable=False,
+                            server_default=sa.true()))
+
+
+def _apply_delta(delta: str, base: str) -> str:
+    """Rebuild a text from a stored delta and the text following it."""
+    base_lines = base.splitlines(keepends=True) if base else []
+    parts = []
+    for operation in json.loads(delta):
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(base_lines[operation[0]:operation[1]])
+    return ''.join(parts)
+
+
+def downgrade():
+    notes = sa.table('notes', sa.column('id', sa.Integer),
+                     sa.column('text', sa.Text))
+    note_versions = sa.table('note_versions',
+                             sa.column('id', sa.Integer),
+                             sa.column('note_id', sa.Integer),
+                             sa.column('version_num', sa.Integer),
+                             sa.column('text', sa.Text),
+                             sa.column('delta', sa.Text),
+                             sa.column('is_keyframe', sa.Boolean))
+
+    # Store the full text of the delta encoded versions, note by note
+    connection = op.get_bind()
+    note_ids = [row[0] for row in connection.execute(
+        sa.select([note_versions.c.note_id]).where(
+            note_versions.c.is_keyframe == sa.false()).distinct())]
+    for note_id in note_ids:
+        text = connection.execute(sa.select([notes.c.text]).where(
+            notes.c.id == note_id)).scalar()
+        versions = connection.execute(
+            sa.select([note_versions]).where(
+                note_versions.c.note_id == note_id).order_by(
+                note_versions.c.version_num.desc())).fetchall()
+        for version in versions:
+            if version.is_keyframe:
+                text = version.text
+                continue
+            text = _apply_delta(version.delta, text)
+            connection.execute(
+                note_versions.update().where(
+                    note_versions.c.id == version.id).values(text=text))
+
+    with op.batch_alter_table('note_versions') as batch_op:
+        batch_op.drop_column('is_keyframe')
+        batch_op.drop_column('delta')
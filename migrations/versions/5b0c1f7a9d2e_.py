@@ -0,0 +1,41 @@
+"""Add the version count of the notes
+
+Revision ID: 5b0c1f7a9d2e
+Revises: 34dce2b3251c
+Create Date: 2026-10-17 12:04:31.271093
+
+The count is filled in from the existing note_versions rows.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0c1f7a9d2e'
+down_revision = '34dce2b3251c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('notes',
+                  sa.Column('version_count', sa.Integer(), nullable=False,
+                            server_default='0'))
+
+    notes = sa.table('notes', sa.column('id', sa.Integer),
+                     sa.column('version_count', sa.Integer))
+    note_versions = sa.table('note_versions',
+                             sa.column('note_id', sa.Integer))
+    op.execute(notes.update().values(
+        version_count=sa.select([sa.func.count()])
+        .where(note_versions.c.note_id == notes.c.id)
+        .as_scalar()))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # Unlike a batch migration, which copies the table, this keeps the
+        # full-text triggers of the notes (SQLite 3.35 or newer)
+        op.execute('ALTER TABLE notes DROP COLUMN version_count')
+    else:
+        op.drop_column('notes', 'version_count')
@@ -0,0 +1,68 @@
+"""Add the full-text index of the notes
+
+Revision ID: 8cce9e859412
+Revises: b1151abca250
+Create Date: 2026-10-17 09:12:41.118204
+
+SQLite gets an external content FTS5 table kept in sync by triggers,
+MySQL gets a FULLTEXT index per searchable column.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8cce9e859412'
+down_revision = 'b1151abca250'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        op.create_index('ix_notes_title_fulltext', 'notes', ['title'],
+                        mysql_prefix='FULLTEXT')
+        op.create_index('ix_notes_text_fulltext', 'notes', ['text'],
+                        mysql_prefix='FULLTEXT')
+
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE notes_fts USING fts5("
+                   "title, text, content='notes', content_rowid='id')")
+        op.execute("INSERT INTO notes_fts(notes_fts) VALUES('rebuild')")
+        op.execute("""
+            CREATE TRIGGER notes_fts_after_insert AFTER INSERT ON notes
+            BEGIN
+                INSERT INTO notes_fts(rowid, title, text)
+                VALUES (new.id, new.title, new.text);
+            END""")
+        op.execute("""
+            CREATE TRIGGER notes_fts_after_delete AFTER DELETE ON notes
+            BEGIN
+                INSERT INTO notes_fts(notes_fts, rowid, title, text)
+                VALUES ('delete', old.id, old.title, old.text);
+            END""")
+        op.execute("""
+            CREATE TRIGGER notes_fts_after_update
+            AFTER UPDATE OF title, text ON notes
+            BEGIN
+                INSERT INTO notes_fts(notes_fts, rowid, title, text)
+                VALUES ('delete', old.id, old.title, old.text);
+                INSERT INTO notes_fts(rowid, title, text)
+                VALUES (new.id, new.title, new.text);
+            END""")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        op.drop_index('ix_notes_text_fulltext', table_name='notes')
+        op.drop_index('ix_notes_title_fulltext', table_name='notes')
+
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS notes_fts_after_update')
+        op.execute('DROP TRIGGER IF EXISTS notes_fts_after_delete')
+        op.execute('DROP TRIGGER IF EXISTS notes_fts_after_insert')
+        op.execute('DROP TABLE IF EXISTS notes_fts')
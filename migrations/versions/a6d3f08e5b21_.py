@@ -0,0 +1,27 @@
+"""Index the revocation time of the revoked tokens
+
+Revision ID: a6d3f08e5b21
+Revises: e4b7a2c91d35
+Create Date: 2026-10-17 18:05:12.402716
+
+The processes sync their revoked tokens by revocation time.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3f08e5b21'
+down_revision = 'e4b7a2c91d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_revoked_tokens_revoked_at'), 'revoked_tokens',
+                    ['revoked_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_tokens_revoked_at'),
+                  table_name='revoked_tokens')
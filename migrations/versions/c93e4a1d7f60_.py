@@ -0,0 +1,105 @@
+"""Store the texts of note_versions compressed
+
+Revision ID: c93e4a1d7f60
+Revises: 5b0c1f7a9d2e
+Create Date: 2026-10-17 12:41:09.660512
+
+The text and delta columns become binary columns. The existing rows are
+rewritten in batches by id with a pause between batches, to keep the load
+on a live database low.
+"""
+import time
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93e4a1d7f60'
+down_revision = '5b0c1f7a9d2e'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+BATCH_PAUSE = 0.1
+
+CODEC_PLAIN = b'\x00'
+CODEC_ZLIB = b'\x01'
+COMPRESSION_THRESHOLD = 256
+
+COLUMNS = ['text', 'delta']
+
+
+def _compress(text):
+    """Encode a text the way app.note.compression does."""
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    if len(data) >= COMPRESSION_THRESHOLD:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return CODEC_ZLIB + compressed
+    return CODEC_PLAIN + data
+
+
+def _decompress(value):
+    """Decode a text the way app.note.compression does."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == CODEC_ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if value[:1] == CODEC_PLAIN:
+        return value[1:].decode('utf-8')
+    return value.decode('utf-8')
+
+
+def _copy_columns(source_type, target_type, convert):
+    """Add a column of the target type next to the text and delta columns,
+    fill it in batches and replace the original column with it."""
+    with op.batch_alter_table('note_versions') as batch_op:
+        for column in COLUMNS:
+            batch_op.add_column(sa.Column(f'{column}_new', target_type,
+                                          nullable=True))
+
+    note_versions = sa.table(
+        'note_versions', sa.column('id', sa.Integer),
+        *[sa.column(column, source_type) for column in COLUMNS],
+        *[sa.column(f'{column}_new', target_type) for column in COLUMNS])
+
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([note_versions.c.id] +
+                      [note_versions.c[column] for column in COLUMNS])
+            .where(note_versions.c.id > last_id)
+            .order_by(note_versions.c.id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(
+                note_versions.update()
+                .where(note_versions.c.id == row.id)
+                .values({f'{column}_new': convert(row[column])
+                         for column in COLUMNS}))
+        last_id = rows[-1].id
+        if len(rows) == BATCH_SIZE:
+            time.sleep(BATCH_PAUSE)
+
+    with op.batch_alter_table('note_versions') as batch_op:
+        for column in COLUMNS:
+            batch_op.drop_column(column)
+        for column in COLUMNS:
+            batch_op.alter_column(f'{column}_new', new_column_name=column,
+                                  existing_type=target_type)
+
+
+def upgrade():
+    _copy_columns(sa.Text(), sa.LargeBinary(), _compress)
+
+
+def downgrade():
+    _copy_columns(sa.LargeBinary(), sa.Text(), _decompress)
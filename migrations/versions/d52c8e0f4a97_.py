@@ -0,0 +1,55 @@
+"""Delete the versions of a note with it
+
+Revision ID: d52c8e0f4a97
+Revises: a6d3f08e5b21
+Create Date: 2026-10-17 19:02:37.615204
+
+The foreign key of note_versions.note_id gets ON DELETE CASCADE, so that
+deleting a note doesn't load its versions. SQLite can't alter a foreign key,
+its note_versions table is copied, and the unnamed key is found by a naming
+convention.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd52c8e0f4a97'
+down_revision = 'a6d3f08e5b21'
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEY = 'fk_note_versions_note_id_notes'
+
+NAMING_CONVENTION = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+
+
+def _replace_foreign_key(ondelete):
+    """Replace the foreign key of note_versions.note_id."""
+    connection = op.get_bind()
+    if connection.dialect.name == 'sqlite':
+        with op.batch_alter_table(
+                'note_versions',
+                naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(FOREIGN_KEY, type_='foreignkey')
+            batch_op.create_foreign_key(FOREIGN_KEY, 'notes', ['note_id'],
+                                        ['id'], ondelete=ondelete)
+        return
+
+    for foreign_key in sa.inspect(connection).get_foreign_keys(
+            'note_versions'):
+        if foreign_key['referred_table'] == 'notes':
+            op.drop_constraint(foreign_key['name'], 'note_versions',
+                               type_='foreignkey')
+    op.create_foreign_key(FOREIGN_KEY, 'note_versions', 'notes',
+                          ['note_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_foreign_key('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_key(None)
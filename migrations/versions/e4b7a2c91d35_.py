@@ -0,0 +1,39 @@
+"""Add the revoked_tokens table
+
+Revision ID: e4b7a2c91d35
+Revises: c93e4a1d7f60
+Create Date: 2026-10-17 15:20:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7a2c91d35'
+down_revision = 'c93e4a1d7f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revoked_tokens',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('jti', sa.String(length=36), nullable=False),
+    sa.Column('token_type', sa.String(length=10), nullable=False),
+    sa.Column('username', sa.String(length=64), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('revoked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_revoked_tokens_expires_at'), 'revoked_tokens',
+                    ['expires_at'], unique=False)
+    op.create_index(op.f('ix_revoked_tokens_jti'), 'revoked_tokens',
+                    ['jti'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_tokens_jti'), table_name='revoked_tokens')
+    op.drop_index(op.f('ix_revoked_tokens_expires_at'),
+                  table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
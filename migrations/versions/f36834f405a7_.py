@@ -0,0 +1,158 @@
+"""Move the note versions into the note_versions table
+
+Revision ID: f36834f405a7
+Revises: 8cce9e859412
+Create Date: 2026-10-17 10:02:13.540118
+
+The JSON history of notes.versions is copied into one row per version,
+walking the notes in batches by id, and the JSON is cleared. Notes whose
+JSON can't be parsed keep it and are logged.
+"""
+from datetime import datetime as dt
+import json
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f36834f405a7'
+down_revision = '8cce9e859412'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+logger = logging.getLogger('alembic.env')
+
+notes = sa.table(
+    'notes',
+    sa.column('id', sa.Integer),
+    sa.column('versions', sa.Text)
+)
+
+note_versions = sa.table(
+    'note_versions',
+    sa.column('note_id', sa.Integer),
+    sa.column('version_num', sa.Integer),
+    sa.column('title', sa.String),
+    sa.column('text', sa.Text),
+    sa.column('last_modified', sa.DateTime),
+    sa.column('version_at', sa.DateTime),
+    sa.column('modified_by', sa.String)
+)
+
+
+def _from_timestamp(value):
+    """Convert a JSON timestamp into a datetime."""
+    if value is None:
+        return None
+    return dt.fromtimestamp(value)
+
+
+def _to_timestamp(value):
+    """Convert a datetime into a JSON timestamp."""
+    if value is None:
+        return None
+    return value.timestamp()
+
+
+def _note_batches(connection, criterion):
+    """Yield batches of (id, versions) rows of the notes matching a
+    criterion, ordered by id."""
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([notes.c.id, notes.c.versions])
+            .where(sa.and_(notes.c.id > last_id, criterion))
+            .order_by(notes.c.id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.create_table('note_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('version_num', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=True),
+    sa.Column('text', sa.Text(), nullable=True),
+    sa.Column('last_modified', sa.DateTime(), nullable=True),
+    sa.Column('version_at', sa.DateTime(), nullable=True),
+    sa.Column('modified_by', sa.String(length=64), nullable=True),
+    sa.ForeignKeyConstraint(['note_id'], ['notes.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_note_versions_note_id_version_num', 'note_versions',
+                    ['note_id', 'version_num'], unique=True)
+
+    connection = op.get_bind()
+    failed_ids = []
+    for rows in _note_batches(connection, notes.c.versions.isnot(None)):
+        values = []
+        migrated_ids = []
+        for note_id, versions in rows:
+            try:
+                version_list = json.loads(versions)
+                note_values = [dict(
+                    note_id=note_id,
+                    version_num=int(version_num),
+                    title=data.get('title'),
+                    text=data.get('text'),
+                    last_modified=_from_timestamp(data.get('last_modified')),
+                    version_at=_from_timestamp(data.get('version_at')),
+                    modified_by=data.get('modified_by')
+                ) for version_num, data in version_list.items()]
+            except (AttributeError, TypeError, ValueError) as ex:
+                logger.warning(f'Note {note_id}: versions not migrated, '
+                               f'{ex!r}')
+                failed_ids.append(note_id)
+                continue
+            values += note_values
+            migrated_ids.append(note_id)
+        if values:
+            connection.execute(note_versions.insert(), values)
+        if migrated_ids:
+            connection.execute(
+                notes.update()
+                .where(notes.c.id.in_(migrated_ids))
+                .values(versions=None))
+
+    if failed_ids:
+        logger.warning(f'The versions of {len(failed_ids)} notes were not '
+                       f'migrated and are kept in notes.versions: '
+                       f'{failed_ids}')
+
+
+def downgrade():
+    connection = op.get_bind()
+    for rows in _note_batches(connection, sa.true()):
+        note_ids = [row[0] for row in rows]
+        version_lists = {note_id: {} for note_id in note_ids}
+        for version in connection.execute(
+                sa.select([note_versions])
+                .where(note_versions.c.note_id.in_(note_ids))
+                .order_by(note_versions.c.note_id,
+                          note_versions.c.version_num)):
+            version_lists[version.note_id][str(version.version_num)] = dict(
+                title=version.title,
+                text=version.text,
+                version_num=version.version_num,
+                last_modified=_to_timestamp(version.last_modified),
+                version_at=_to_timestamp(version.version_at),
+                modified_by=version.modified_by
+            )
+        for note_id, version_list in version_lists.items():
+            if version_list:
+                connection.execute(
+                    notes.update()
+                    .where(notes.c.id == note_id)
+                    .values(versions=json.dumps(version_list)))
+
+    op.drop_index('ix_note_versions_note_id_version_num',
+                  table_name='note_versions')
+    op.drop_table('note_versions')
@@ -0,0 +1,59 @@
+"""Test the note compression module."""
+
+import pytest
+
+from app import db
+from app.note.compression import compress_text, decompress_text, \
+    CODEC_PLAIN, CODEC_ZLIB
+from app.note.models import Note, NoteVersion
+
+
+def test_compression_round_trip():
+    """Test decoding stored texts."""
+    for text in [None, '', 'short text', 'ünïcödé text\n' * 100]:
+        assert decompress_text(compress_text(text)) == text
+
+
+def test_compression_threshold():
+    """Test that only texts above the threshold are compressed."""
+    assert compress_text('short text') == CODEC_PLAIN + b'short text'
+
+    stored = compress_text('some long text\n' * 100)
+    assert stored.startswith(CODEC_ZLIB)
+    assert len(stored) < 100
+
+    assert compress_text('some text', threshold=4).startswith(CODEC_PLAIN)
+
+
+def test_compression_legacy_values():
+    """Test reading values stored without a codec marker."""
+    assert decompress_text('plain text') == 'plain text'
+    assert decompress_text(b'plain text') == 'plain text'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_stored_compressed(app, add_user):
+    """Test that the version texts are stored compressed."""
+    text = 'some long text\n' * 100
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=text)
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        note.text = 'new text'
+        db.session.commit()
+
+    with app.app_context():
+        stored = db.session.execute(
+            'SELECT text FROM note_versions WHERE note_id = :note_id',
+            dict(note_id=note_id)).scalar()
+        assert stored.startswith(CODEC_ZLIB)
+        assert len(stored) < len(text) / 10
+
+        version = NoteVersion.query.filter_by(note_id=note_id).one()
+        assert version.text == text
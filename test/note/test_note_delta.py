@@ -0,0 +1,37 @@
+"""Test the note delta module."""
+
+from app.note.delta import make_delta, apply_delta, encode_delta, \
+    decode_delta
+
+
+def test_delta_round_trip():
+    """Test rebuilding texts from their deltas."""
+    base = 'line 1\nline 2\nline 3\nline 4\n'
+    targets = [
+        base,
+        'line 1\nline 2 changed\nline 3\nline 4\n',
+        'line 0\nline 1\nline 2\nline 3\nline 4\nline 5',
+        'line 4\n',
+        '',
+        None
+    ]
+    for target in targets:
+        delta = decode_delta(encode_delta(make_delta(base, target)))
+        assert apply_delta(delta, base) == (target or '')
+
+
+def test_delta_empty_base():
+    """Test a delta against a missing base text."""
+    delta = make_delta(None, 'some text')
+    assert delta == ['some text']
+    assert apply_delta(delta, None) == 'some text'
+
+
+def test_delta_copies_unchanged_lines():
+    """Test that unchanged lines are referenced instead of copied."""
+    base = ''.join(f'line {number}\n' for number in range(100))
+    target = base.replace('line 50\n', 'line fifty\n')
+
+    delta = make_delta(base, target)
+    assert delta == [[0, 50], 'line fifty\n', [51, 100]]
+    assert len(encode_delta(delta)) < len(target) / 10
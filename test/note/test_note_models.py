@@ -1,12 +1,13 @@
 """Test the Note package"""
 
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta
 import json
 import pytest
 from app import db
 from app.user.models import User
-from app.note.models import Note, get_current_user_name, validate_note, \
-    get_note_details
+from app.note.models import Note, NoteVersion, get_current_user_name, \
+    validate_note, get_note_details
+from app.note.retention import RetentionPolicy
 
 
 @pytest.mark.usefixtures('clean_up_existing_users')
@@ -110,6 +111,31 @@ def test_note_version_list():
     assert '1' in note.version_list.keys()
 
 
+def test_note_version_list_memoized(monkeypatch):
+    """Test that the version list is parsed once until versions change."""
+    loads = []
+
+    def mock_loads(value):
+        loads.append(value)
+        return json.JSONDecoder().decode(value)
+
+    monkeypatch.setattr('app.note.models.json.loads', mock_loads)
+
+    note = Note()
+    note.versions = json.dumps({'1': {'text': 'some text'}})
+    version_list = note.version_list
+    assert note.version_list is version_list
+    assert len(loads) == 1
+
+    note.versions = json.dumps({'1': {'text': 'a'}, '2': {'text': 'b'}})
+    assert len(note.version_list) == 2
+    assert len(loads) == 2
+
+    note.text = 'new text'
+    assert note.version_list is not version_list
+    assert len(loads) == 3
+
+
 def test_note_version_list_non_parsable(app):
     """Test the version_list prop when the versions can't be JSON parsed."""
     with app.app_context():
@@ -171,16 +197,16 @@ def test_note_before_commit_listener(app, add_user):
 
 
 @pytest.mark.usefixtures('clean_up_existing_users')
-def test_note_note_load_listener(app, add_user):
-    """Test the note version creation when the note is updated."""
+def test_note_old_data_history(app, add_user):
+    """Test reading the old data of a note from the attribute history."""
     with app.app_context():
         user = add_user('some_user', 'some_user@email.com')
         note = Note(created_by=user.id, title='version_1_title')
         db.session.add(note)
+        assert note.old_data is None
         db.session.commit()
 
         note_id = note.id
-        assert note.old_data is None
 
     with app.app_context():
         note_loaded = Note.query.get(note_id)
@@ -188,6 +214,72 @@ def test_note_note_load_listener(app, add_user):
         assert isinstance(note_loaded.old_data, dict)
         assert len(note_loaded.old_data) > 0
 
+        note_loaded.title = 'version_2_title'
+        assert note_loaded.old_data['title'] == 'version_1_title'
+        assert note_loaded.old_data['version_num'] == 1
+        assert isinstance(note_loaded.old_data['last_modified'], float)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_old_data_deferred(app, add_user):
+    """Test that a deferred column keeps its old value when it is set."""
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text='version 1 text')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    with app.app_context():
+        note = Note.query.options(db.load_only('title')).get(note_id)
+        assert 'text' not in db.inspect(note).dict
+
+        note.text = 'version 2 text'
+        db.session.commit()
+
+        assert note.version_list['1']['text'] == 'version 1 text'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_old_data_not_loaded(app, add_user):
+    """Test that the columns not loaded are stored in the version."""
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title 1', text='version 1 text')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+        last_modified = note.last_modified
+
+    with app.app_context():
+        note = Note.query.options(db.load_only('title')).get(note_id)
+        assert 'text' not in db.inspect(note).dict
+
+        note.title = 'title 2'
+        db.session.commit()
+
+        version = NoteVersion.query.filter_by(note_id=note_id).one()
+        assert version.title == 'title 1'
+        assert version.get_text(note.text) == 'version 1 text'
+        assert version.last_modified == last_modified
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_load_no_versioning(app, add_user):
+    """Test that loading notes doesn't prepare any version data."""
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert note._old_data is None
+        db.session.commit()
+        assert note.version_num == 1
+
 
 def test_validate_note_invalid_user():
     """Test the note validation with an invalid user."""
@@ -210,7 +302,7 @@ def test_get_note_details():
     now = dt.utcnow()
     note = Note(created_by=1, created_at=now, last_modified=now, version_num=2,
                 title="some title", text='some text')
-    note.versions = json.dumps({1: {'title': 'prev title'}})
+    note.version_count = 1
 
     details = get_note_details(note)
     assert details['created_by'] == 1
@@ -218,5 +310,350 @@ def test_get_note_details():
     assert details['ts_created_at'] == now.timestamp()
     assert details['ts_last_modified'] == now.timestamp()
     assert details['version_num'] == 2
-    assert len(details['version_list']) == 1
-    assert '1' in details['version_list'].keys()
+    assert details['version_count'] == 1
+    assert 'version_list' not in details
+
+
+def test_get_note_details_fields():
+    """Test the get_note_details function with a subset of the fields."""
+    note = Note(created_by=1, title="some title", text='some text')
+
+    details = get_note_details(note, ['title', 'username'])
+    assert details == dict(title='some title', username='system')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_rows(app, add_user):
+    """Test that every update of a note inserts a single version row."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='version_1_title',
+                    text='version 1 text')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    for number in range(2, 5):
+        with app.app_context():
+            note_update = Note.query.get(note_id)
+            note_update.title = f'version_{number}_title'
+            db.event.listen(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+            try:
+                db.session.commit()
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute',
+                                before_cursor_execute)
+
+    version_statements = [statement for statement in statements
+                          if 'note_versions' in statement]
+    assert len(version_statements) == 3
+    assert all(statement.startswith('INSERT')
+               for statement in version_statements)
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert note.version_num == 4
+        assert note.versions is None
+        assert list(note.version_list.keys()) == ['1', '2', '3']
+        assert note.version_list['1']['title'] == 'version_1_title'
+        assert note.version_list['1']['text'] == 'version 1 text'
+        assert note.version_list['3']['title'] == 'version_3_title'
+        assert NoteVersion.query.filter_by(note_id=note_id).count() == 3
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_cascade_delete(app, add_user):
+    """Test that the versions of a note are deleted with the note."""
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='version_1_title')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        note.title = 'version_2_title'
+        db.session.commit()
+        note.title = 'version_3_title'
+        db.session.commit()
+        assert NoteVersion.query.filter_by(note_id=note_id).count() == 2
+
+    loaded = []
+
+    def load_listener(target, context):
+        loaded.append(target.version_num)
+
+    db.event.listen(NoteVersion, 'load', load_listener)
+    try:
+        with app.app_context():
+            note = Note.query.get(note_id)
+            db.session.delete(note)
+            db.session.commit()
+    finally:
+        db.event.remove(NoteVersion, 'load', load_listener)
+
+    with app.app_context():
+        assert loaded == []
+        assert NoteVersion.query.filter_by(note_id=note_id).count() == 0
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_delta_storage(app, add_user):
+    """Test rebuilding delta encoded versions of a note."""
+    paragraph = ''.join(f'line {number}\n' for number in range(200))
+    texts = [paragraph.replace('line 7\n', f'edit {number}\n')
+             for number in range(25)]
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=texts[0])
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    for text in texts[1:]:
+        with app.app_context():
+            note_update = Note.query.get(note_id)
+            note_update.text = text
+            db.session.commit()
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        versions = NoteVersion.query.filter_by(note_id=note_id).all()
+        keyframes = [version.version_num for version in versions
+                     if version.is_keyframe]
+        assert keyframes == [10, 20]
+        stored = sum(len(version.text or version.delta)
+                     for version in versions)
+        assert stored < len(paragraph) * 24 / 5
+
+        version_list = note.version_list
+        assert len(version_list) == 24
+        for number, text in enumerate(texts[:-1], start=1):
+            assert version_list[str(number)]['text'] == text
+            assert note.get_version(number)['text'] == text
+            assert note.get_version(number)['version_num'] == number
+        assert note.get_version(25) is None
+
+        assert note.version_count == 24
+        page = note.version_rows.filter(
+            NoteVersion.version_num <= 15).order_by(
+            NoteVersion.version_num.desc()).limit(5).all()
+        assert note.get_version_texts(page) == {
+            number: texts[number - 1] for number in range(11, 16)}
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_get_version_loaded_rows(app, add_user):
+    """Test that rebuilding a version loads the rows up to a keyframe."""
+    paragraph = ''.join(f'line {number}\n' for number in range(200))
+    texts = [paragraph.replace('line 7\n', f'edit {number}\n')
+             for number in range(30)]
+    interval = app.config['NOTE_VERSION_KEYFRAME_INTERVAL']
+    loaded = []
+
+    def load_listener(target, context):
+        loaded.append(target.version_num)
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=texts[0])
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    for text in texts[1:]:
+        with app.app_context():
+            note_update = Note.query.get(note_id)
+            note_update.text = text
+            db.session.commit()
+
+    db.event.listen(NoteVersion, 'load', load_listener)
+    try:
+        with app.app_context():
+            note = Note.query.get(note_id)
+            assert note.get_version(1)['text'] == texts[0]
+            assert len(loaded) <= interval + 1
+
+            loaded.clear()
+            page = note.version_rows.filter(
+                NoteVersion.version_num <= 3).order_by(
+                NoteVersion.version_num.desc()).all()
+            assert note.get_version_texts(page)[1] == texts[0]
+            assert len(loaded) <= len(page) + interval + 1
+    finally:
+        db.event.remove(NoteVersion, 'load', load_listener)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_full_storage(app, add_user):
+    """Test that the full storage mode stores every text in full."""
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title',
+                    text='some long text\n' * 10)
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    app.config['NOTE_VERSION_STORAGE'] = 'full'
+    try:
+        with app.app_context():
+            note_update = Note.query.get(note_id)
+            note_update.text = 'some long text\n' * 11
+            db.session.commit()
+    finally:
+        app.config['NOTE_VERSION_STORAGE'] = 'delta'
+
+    with app.app_context():
+        version = NoteVersion.query.filter_by(note_id=note_id).one()
+        assert version.text == 'some long text\n' * 10
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_retention(app, add_user):
+    """Test that the retention policy is applied when versions are made."""
+    paragraph = ''.join(f'line {number}\n' for number in range(200))
+    texts = [paragraph.replace('line 7\n', f'edit {number}\n')
+             for number in range(8)]
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=texts[0])
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    app.config['NOTE_VERSION_KEEP_LAST'] = 3
+    app.config['NOTE_VERSION_KEEP_DAILY'] = False
+    try:
+        for text in texts[1:]:
+            with app.app_context():
+                note_update = Note.query.get(note_id)
+                note_update.text = text
+                db.session.commit()
+    finally:
+        app.config['NOTE_VERSION_KEEP_LAST'] = 0
+        app.config['NOTE_VERSION_KEEP_DAILY'] = True
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert note.version_num == 8
+        assert note.version_count == 3
+        version_list = note.version_list
+        assert list(version_list.keys()) == ['5', '6', '7']
+        for number in range(5, 8):
+            assert version_list[str(number)]['text'] == texts[number - 1]
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_compact_versions_relink(app, add_user):
+    """Test that a version following removed ones keeps its text."""
+    paragraph = ''.join(f'line {number}\n' for number in range(200))
+    texts = [paragraph.replace('line 7\n', f'edit {number}\n')
+             for number in range(6)]
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=texts[0])
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    for text in texts[1:]:
+        with app.app_context():
+            note_update = Note.query.get(note_id)
+            note_update.text = text
+            db.session.commit()
+
+    class Policy(object):
+        """Remove the versions 2 and 3."""
+
+        @staticmethod
+        def get_pruned(versions, now=None):
+            return [3, 2]
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert not NoteVersion.query.filter_by(note_id=note_id,
+                                               version_num=1).one().is_keyframe
+        removed, reclaimed = note.compact_versions(Policy())
+        db.session.commit()
+        assert removed == 2
+        assert reclaimed > 0
+
+    with app.app_context():
+        note = Note.query.get(note_id)
+        version_list = note.version_list
+        assert list(version_list.keys()) == ['1', '4', '5']
+        for number in [1, 4, 5]:
+            assert version_list[str(number)]['text'] == texts[number - 1]
+
+
+def get_chain_lengths(note: Note) -> dict:
+    """Return the number of rows replayed to rebuild each version."""
+    lengths = {}
+    chain = 0
+    for version in note.version_rows.order_by(
+            NoteVersion.version_num.desc()):
+        chain = 1 if version.is_keyframe else chain + 1
+        lengths[version.version_num] = chain
+    return lengths
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_compact_versions_keyframes(app, add_user):
+    """Test that compacting a long history keeps the chains bounded."""
+    paragraph = ''.join(f'line {number}\n' for number in range(200))
+    texts = [paragraph.replace('line 7\n', f'edit {number}\n')
+             for number in range(66)]
+    interval = app.config['NOTE_VERSION_KEYFRAME_INTERVAL']
+
+    with app.app_context():
+        user = add_user('some_user', 'some_user@email.com')
+        note = Note(created_by=user.id, title='title', text=texts[0])
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.id
+
+    def update(text_range):
+        for number in text_range:
+            with app.app_context():
+                note_update = Note.query.get(note_id)
+                note_update.text = texts[number]
+                db.session.commit()
+
+    update(range(1, 46))
+    with app.app_context():
+        # Two versions a day, the daily ones are never multiples of ten
+        start = dt(2020, 1, 1)
+        for version in NoteVersion.query.filter_by(note_id=note_id):
+            version.version_at = start + timedelta(
+                days=version.version_num // 2)
+        db.session.commit()
+
+        note = Note.query.get(note_id)
+        removed, _ = note.compact_versions(
+            RetentionPolicy(keep_last=3, keep_daily=True))
+        db.session.commit()
+        assert removed == 20
+        lengths = get_chain_lengths(note)
+        assert len(lengths) == 25
+        assert max(lengths.values()) <= interval
+
+    update(range(46, 66))
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert max(get_chain_lengths(note).values()) <= interval
+        version_list = note.version_list
+        assert len(version_list) == 45
+        for key, version in version_list.items():
+            assert version['text'] == texts[int(key) - 1]
+            assert note.get_version(int(key))['text'] == version['text']
@@ -0,0 +1,47 @@
+"""Test the note retention module."""
+
+from collections import namedtuple
+from datetime import datetime as dt, timedelta
+
+from app.note.retention import RetentionPolicy
+
+Version = namedtuple('Version', ['version_num', 'version_at'])
+
+NOW = dt(2026, 10, 17, 12)
+
+
+def _versions(hours: list) -> list:
+    """Return versions made some hours ago, newest first."""
+    count = len(hours)
+    return [Version(count - index, NOW - timedelta(hours=hour))
+            for index, hour in enumerate(hours)]
+
+
+def test_retention_disabled():
+    """Test that the default policy keeps every version."""
+    policy = RetentionPolicy()
+    assert not policy.enabled
+    assert policy.get_pruned(_versions([1, 2, 3]), NOW) == []
+
+
+def test_retention_keep_last():
+    """Test keeping the last versions."""
+    policy = RetentionPolicy(keep_last=2)
+    assert policy.enabled
+    assert policy.get_pruned(_versions([1, 2, 3, 4]), NOW) == [2, 1]
+
+
+def test_retention_keep_daily():
+    """Test keeping the last version of every day before the last ones."""
+    policy = RetentionPolicy(keep_last=1, keep_daily=True)
+    versions = _versions([1, 2, 3, 30, 31, 60])
+    assert policy.get_pruned(versions, NOW) == [4, 2]
+
+
+def test_retention_max_age():
+    """Test removing the versions older than the maximum age."""
+    policy = RetentionPolicy(max_age_days=1)
+    assert policy.get_pruned(_versions([1, 30, 60]), NOW) == [2, 1]
+
+    policy = RetentionPolicy(keep_last=2, keep_daily=True, max_age_days=1)
+    assert policy.get_pruned(_versions([30, 31, 60]), NOW) == [1]
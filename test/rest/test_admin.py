@@ -0,0 +1,30 @@
+"""Tests for the Admin REST module."""
+
+import pytest
+from flask import url_for
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_admin_metrics(app, client, auth_headers):
+    """Test getting the runtime metrics as an admin."""
+    with app.test_request_context():
+        headers = auth_headers({'is_admin': True})
+
+        response = client.get(url_for('rest.admin_metrics'), headers=headers)
+
+        assert response.status_code == 200
+        assert 'hashed' in response.json['password_hashing']
+        assert 'avg_hash_seconds' in response.json['password_hashing']
+        assert 'pool_class' in response.json['database_pool']
+        assert response.json['database_replicas']['pools'] == {}
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_admin_metrics_no_admin(app, client, auth_headers):
+    """Test that the runtime metrics are restricted to admins."""
+    with app.test_request_context():
+        headers = auth_headers()
+
+        response = client.get(url_for('rest.admin_metrics'), headers=headers)
+
+        assert response.status_code == 401
@@ -3,7 +3,14 @@
 import pytest
 
 from flask import url_for
+from flask_jwt_extended import create_access_token, decode_token, \
+    verify_jwt_in_request
+
+from app import db
+from app.user.models import User
 from app.rest.auth import CONST_LOGIN_MSG
+from app.rest.blueprint import get_principal
+from app.user.hashing import PasswordHashingUnavailable, password_hasher
 
 
 def test_auth_login_no_json(app, client):
@@ -73,3 +80,104 @@ def test_auth_login_refresh_token(app, client, add_user):
         assert 'refresh_token' in response.json
         assert 'refresh_expires' in response.json
         assert 'user' in response.json
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_principal(app, client, add_user):
+    """Check building the principal from the access token claims."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.test_request_context():
+        user = add_user('someuser', 'some@email.com', 'password')
+        user_id = user.id
+        response = client.post(url_for('rest.login'),
+                               json=dict(username='someuser',
+                                         password='password'))
+        access_token = response.json['access_token']
+        assert decode_token(access_token)['user_claims'] == dict(
+            is_admin=False, user_id=user_id)
+
+    old_token = None
+    with app.app_context():
+        old_token = create_access_token(identity='someuser',
+                                        user_claims={'is_admin': True})
+
+    for token, expected_selects in [(access_token, 0), (old_token, 1)]:
+        headers = {'Authorization': f'Bearer {token}'}
+        with app.test_request_context(headers=headers):
+            verify_jwt_in_request()
+            statements.clear()
+            db.event.listen(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+            try:
+                principal = get_principal()
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute',
+                                before_cursor_execute)
+            assert principal.id == user_id
+            assert principal.username == 'someuser'
+            assert principal.is_admin == (token == old_token)
+            assert len(statements) == expected_selects
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_auth_login_hashing_unavailable(app, client, add_user, monkeypatch):
+    """Check that a login is refused when password hashing is saturated."""
+    def mock_run(*args):
+        raise PasswordHashingUnavailable('Too many password requests')
+
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+        monkeypatch.setattr(password_hasher, 'run', mock_run)
+        response = client.post(url_for('rest.login'),
+                               json=dict(username='someuser',
+                                         password='password'))
+        assert response.status_code == 503
+        assert 'Too many password requests' in response.json.get(
+            'error_message')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_auth_login_rehash(app, client, add_user):
+    """Check that an outdated password hash is replaced at login."""
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+
+        iterations = app.config['PASSWORD_HASH_ITERATIONS']
+        app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        try:
+            response = client.post(url_for('rest.login'),
+                                   json=dict(username='someuser',
+                                             password='password'))
+        finally:
+            app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        assert response.status_code == 200
+
+        db.session.expire_all()
+        user = User.query.filter_by(username='someuser').first()
+        assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_auth_login_rehash_invalid_policy(app, client, add_user):
+    """Check that a login succeeds with an invalid password hash policy."""
+    with app.test_request_context():
+        user = add_user('someuser', 'some@email.com', 'password')
+        password_hash = user.password_hash
+
+        method = app.config['PASSWORD_HASH_METHOD']
+        app.config['PASSWORD_HASH_METHOD'] = 'md5'
+        try:
+            response = client.post(url_for('rest.login'),
+                                   json=dict(username='someuser',
+                                             password='password'))
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = method
+        assert response.status_code == 200
+
+        db.session.expire_all()
+        user = User.query.filter_by(username='someuser').first()
+        assert user.password_hash == password_hash
@@ -233,10 +233,11 @@ def test_note_get_single(app, client, add_note, auth_headers):
 
         expected_keys = ['id', 'created_by', 'ts_created_at',
                          'username', 'ts_last_modified', 'title', 'text',
-                         'version_num', 'version_list']
+                         'version_num', 'version_count']
         assert response.status_code == 200
         for key in expected_keys:
             assert key in response.json
+        assert 'version_list' not in response.json
 
 
 @pytest.mark.usefixtures('clean_up_existing_users')
@@ -325,3 +326,244 @@ def test_get_notes_empty_list(app, client, auth_headers):
         assert response.json.get('total') == 0
         assert not response.json.get('prev_num')
         assert len(response.json.get('entity_list')) == 0
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_cursor(app, client, auth_headers, add_ten_notes):
+    """Test fetching a note list in the cursor mode."""
+    with app.test_request_context():
+        headers = auth_headers()
+        add_ten_notes()
+        req_data = dict(cursor=None, per_page=6)
+
+        response = client.get(url_for('rest.notes_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json.get('has_next')
+        assert 'total' not in response.json
+        assert len(response.json.get('entity_list')) == 6
+
+        req_data['cursor'] = response.json.get('next_cursor')
+        response = client.get(url_for('rest.notes_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert not response.json.get('has_next')
+        assert response.json.get('next_cursor') is None
+        assert len(response.json.get('entity_list')) == 4
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_invalid_cursor(app, client, auth_headers):
+    """Test fetching a note list with a malformed cursor."""
+    with app.test_request_context():
+        headers = auth_headers()
+        req_data = dict(cursor='invalid', per_page=6)
+
+        response = client.get(url_for('rest.notes_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 500
+        assert 'Invalid cursor' in response.json.get('error_message')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_invalid_filter_column(app, client, auth_headers):
+    """Test fetching a note list filtered by a column that isn't allowed."""
+    with app.test_request_context():
+        headers = auth_headers()
+        req_data = dict(filters=[dict(column='versions', type='like',
+                                      value='x')])
+
+        response = client.get(url_for('rest.notes_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 500
+        assert 'Invalid filter column' in response.json.get('error_message')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_fields(app, client, auth_headers, add_ten_notes):
+    """Test fetching a note list with a subset of the fields."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.test_request_context():
+        headers = auth_headers()
+        add_ten_notes()
+        req_data = dict(page=1, per_page=5, fields=['id', 'title'])
+
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        try:
+            response = client.get(url_for('rest.notes_get',
+                                          filter=json.dumps(req_data)),
+                                  headers=headers)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+
+        assert response.status_code == 200
+        for note in response.json.get('entity_list'):
+            assert sorted(note.keys()) == ['id', 'title']
+        note_selects = [statement for statement in statements
+                        if 'FROM notes' in statement]
+        assert note_selects
+        for statement in note_selects:
+            assert 'notes.text' not in statement
+            assert 'notes.versions' not in statement
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_query_count(app, client, auth_headers, add_ten_users):
+    """Test that the authors of a note list are loaded in a single query."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        # The revoked tokens and the last seen times are synced on timers,
+        # not per request
+        if statement.startswith('SELECT') and \
+                'revoked_tokens' not in statement:
+            statements.append(statement)
+
+    with app.test_request_context():
+        headers = auth_headers()
+        users = add_ten_users()
+        for user in users:
+            db.session.add(Note(created_by=user.id, title=user.username))
+        db.session.commit()
+
+        counts = []
+        for per_page in [2, 10]:
+            req_data = dict(page=1, per_page=per_page, count='none')
+            statements.clear()
+            db.event.listen(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+            try:
+                response = client.get(url_for('rest.notes_get',
+                                              filter=json.dumps(req_data)),
+                                      headers=headers)
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute',
+                                before_cursor_execute)
+
+            assert response.status_code == 200
+            usernames = [note['username']
+                         for note in response.json.get('entity_list')]
+            assert usernames == [user.username for user in users][:per_page]
+            counts.append(len(statements))
+
+        assert counts[0] == counts[1]
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_notes_invalid_field(app, client, auth_headers):
+    """Test fetching a note list with an unknown field."""
+    with app.test_request_context():
+        headers = auth_headers()
+        req_data = dict(fields=['id', 'password'])
+
+        response = client.get(url_for('rest.notes_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 500
+        assert 'Invalid field password' in response.json.get(
+            'error_message')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_get_single_fields(app, client, add_note, auth_headers):
+    """Check getting a single a note with a subset of the fields."""
+    with app.app_context():
+        note = add_note('Some title', 'some text')
+        note_id = note.id
+
+    with app.test_request_context():
+        headers = auth_headers()
+
+        response = client.get(url_for('rest.note_get', id=note_id,
+                                      fields='title,username'),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json == dict(title='Some title',
+                                     username='some_user')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_get(app, client, add_note, auth_headers):
+    """Test paging through the versions of a note."""
+    with app.app_context():
+        note = add_note('title 1', 'text 1')
+        note_id = note.id
+
+    for number in range(2, 6):
+        with app.app_context():
+            note = Note.query.get(note_id)
+            note.title = f'title {number}'
+            note.text = f'text {number}'
+            db.session.commit()
+
+    with app.test_request_context():
+        headers = auth_headers()
+
+        response = client.get(url_for('rest.note_versions_get',
+                                      note_id=note_id, per_page=3),
+                              headers=headers)
+        assert response.status_code == 200
+        assert response.json['note_id'] == note_id
+        assert response.json['total'] == 4
+        assert response.json['has_next']
+        versions = response.json['entity_list']
+        assert [version['version_num'] for version in versions] == [4, 3, 2]
+        assert versions[0]['title'] == 'title 4'
+        assert 'text' not in versions[0]
+
+        response = client.get(url_for('rest.note_versions_get',
+                                      note_id=note_id, per_page=3, page=2,
+                                      include_content=1),
+                              headers=headers)
+        assert response.status_code == 200
+        versions = response.json['entity_list']
+        assert [version['version_num'] for version in versions] == [1]
+        assert versions[0]['text'] == 'text 1'
+
+        response = client.get(url_for('rest.note_versions_get',
+                                      note_id=note_id, per_page=3,
+                                      cursor='', include_content='true'),
+                              headers=headers)
+        assert response.status_code == 200
+        assert [version['text'] for version in
+                response.json['entity_list']] == ['text 4', 'text 3',
+                                                  'text 2']
+
+        response = client.get(url_for('rest.note_versions_get',
+                                      note_id=note_id, per_page=3,
+                                      cursor=response.json['next_cursor']),
+                              headers=headers)
+        assert response.status_code == 200
+        assert not response.json['has_next']
+        assert [version['version_num'] for version in
+                response.json['entity_list']] == [1]
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_note_versions_get_non_existing(app, client, auth_headers):
+    """Test getting the versions of a non-existing note."""
+    with app.test_request_context():
+        headers = auth_headers()
+
+        response = client.get(url_for('rest.note_versions_get',
+                                      note_id=100000),
+                              headers=headers)
+
+        assert response.status_code == 500
+        assert 'Invalid note' in response.json.get('error_message')
@@ -3,7 +3,11 @@
 import json
 import pytest
 from flask import url_for
+from flask_jwt_extended import create_access_token
+from app import db
 from app.user.models import get_user_by_username
+from app.token.models import RevokedToken
+from app.token.revocation import revocation_list
 
 
 def test_user_create_no_token(app, client):
@@ -438,6 +442,40 @@ def test_user_delete(app, client, auth_headers, add_user):
         assert user_to_delete.id == response.json.get('deleted_user_id')
 
 
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_user_delete_revokes_tokens(app, client, auth_headers, add_user):
+    """Test that the tokens of a deleted user are refused."""
+    with app.test_request_context():
+        headers = auth_headers({'is_admin': True})
+        user_to_delete = add_user('other_user', 'other_user@email.com')
+        token = create_access_token(
+            identity=user_to_delete.username,
+            user_claims={'is_admin': False, 'user_id': user_to_delete.id})
+        user_headers = {'Authorization': f'Bearer {token}'}
+
+        try:
+            response = client.delete(url_for('rest.user_delete'),
+                                     json={'username': 'other_user'},
+                                     headers=headers)
+            assert response.status_code == 200
+
+            response = client.post(url_for('rest.note_create'),
+                                   json=dict(title='title', text='text'),
+                                   headers=user_headers)
+            assert response.status_code == 401
+            assert 'revoked' in response.json.get('error_message')
+
+            response = client.post(url_for('rest.note_create'),
+                                   json=dict(title='title', text='text'),
+                                   headers=headers)
+            assert response.status_code == 200
+        finally:
+            RevokedToken.query.delete()
+            db.session.commit()
+            revocation_list.clear()
+            revocation_list.refresh()
+
+
 @pytest.mark.usefixtures('clean_up_existing_users')
 def test_get_users_no_filter(app, client, auth_headers, add_ten_users):
     """Test fetching an unfiltered user list."""
@@ -514,6 +552,51 @@ def test_get_users_empty_list(app, client, auth_headers):
         assert len(response.json.get('entity_list')) == 0
 
 
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_users_no_count(app, client, auth_headers, add_ten_users):
+    """Test fetching a user list without a total."""
+    with app.test_request_context():
+        headers = auth_headers()
+        add_ten_users()
+        req_data = dict(page=2, per_page=3, count='none')
+
+        response = client.get(url_for('rest.users_get',
+                                      filter=json.dumps(req_data)),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json.get('has_next')
+        assert response.json.get('has_prev')
+        assert response.json.get('next_num') == 3
+        assert response.json.get('pages') is None
+        assert response.json.get('total') is None
+        assert len(response.json.get('entity_list')) == 3
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_user_get_user_fields(app, client, auth_headers, add_user):
+    """Check getting a single user with a subset of the fields."""
+    with app.test_request_context():
+        headers = auth_headers()
+        user_to_get = add_user('user_to_get', 'user_to_get@email.com')
+
+        response = client.get(url_for('rest.user_get', id=user_to_get.id,
+                                      fields='username,is_admin'),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json == dict(username='user_to_get',
+                                     is_admin=False)
+
+        response = client.get(url_for('rest.user_get', id=user_to_get.id,
+                                      fields='password_hash'),
+                              headers=headers)
+
+        assert response.status_code == 500
+        assert 'Invalid field password_hash' in response.json.get(
+            'error_message')
+
+
 @pytest.mark.usefixtures('clean_up_existing_users')
 def test_get_users_json_error(app, client, auth_headers):
     """Test fetching a user list with a malformed filter param."""
@@ -1,7 +1,12 @@
 """Testing the  CLI part of the application."""
 
+from datetime import datetime as dt, timedelta
 import pytest
 
+from app import db
+from app.note.models import Note
+from app.token.models import RevokedToken
+
 
 @pytest.mark.usefixtures('clean_up_existing_users')
 def test_add_user(app):
@@ -223,3 +228,65 @@ def test_toggle_admin_false_non_existing(app):
         [username])
 
     assert f'Username {username} is invalid' in result.output
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_compact_versions(app, add_note):
+    """Test removing the note versions the retention policy drops."""
+    with app.app_context():
+        note = add_note('title 1', 'some long text\n' * 50)
+        note_id = note.id
+
+    for number in range(2, 6):
+        with app.app_context():
+            note = Note.query.get(note_id)
+            note.text = f'edit {number}\n' + 'some long text\n' * 50
+            db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        app.cli.commands['notes'].commands['compact-versions'],
+        ['--keep-last', '2', '--no-keep-daily', '--pause', '0'])
+
+    assert 'Removed 2 versions, reclaimed' in result.output
+    with app.app_context():
+        note = Note.query.get(note_id)
+        assert note.version_count == 2
+        assert note.version_num == 5
+        assert list(note.version_list.keys()) == ['3', '4']
+        assert note.version_list['3']['text'].startswith('edit 3\n')
+
+
+def test_compact_versions_no_policy(app):
+    """Test compacting the note versions without a retention policy."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        app.cli.commands['notes'].commands['compact-versions'], [])
+
+    assert 'No retention policy is configured' in result.output
+
+
+def test_bench_hash(app):
+    """Test measuring the password hashing speed."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(app.cli.commands['user'].commands['bench-hash'],
+                           ['--cost', '1000', '--seconds', '0'])
+
+    assert 'pbkdf2:sha256 cost 1000:' in result.output
+    assert 'hashes/s per core' in result.output
+
+
+def test_tokens_prune(app):
+    """Test pruning the expired revoked tokens."""
+    with app.app_context():
+        db.session.add(RevokedToken(
+            jti='expired-jti', token_type='access',
+            expires_at=dt.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(app.cli.commands['tokens'].commands['prune'])
+
+    assert 'Removed 1 expired revoked tokens' in result.output
+    with app.app_context():
+        assert RevokedToken.query.filter_by(jti='expired-jti').first() is None
@@ -0,0 +1,66 @@
+"""Tests for the database extension and its pool."""
+
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+
+from app import db
+from app.database import InstrumentedQueuePool, get_pool_metrics
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Create an engine with an instrumented pool of one connection."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}",
+                           poolclass=InstrumentedQueuePool, pool_size=1,
+                           max_overflow=1, pool_timeout=0.1)
+    yield engine
+    engine.dispose()
+
+
+def test_pool_metrics(engine):
+    """Test counting the checkouts and the connections in use."""
+    first = engine.connect()
+    second = engine.connect()
+
+    metrics = get_pool_metrics(engine.pool)
+    assert metrics['pool_class'] == 'InstrumentedQueuePool'
+    assert metrics['checkouts'] == 2
+    assert metrics['in_use'] == 2
+    assert metrics['overflow'] == 1
+    assert metrics['max_in_use'] == 2
+
+    first.close()
+    second.close()
+    metrics = get_pool_metrics(engine.pool)
+    assert metrics['in_use'] == 0
+    assert metrics['checked_in'] == 1
+
+
+def test_pool_metrics_timeout(engine):
+    """Test counting the checkouts that time out."""
+    connections = [engine.connect(), engine.connect()]
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+
+    metrics = get_pool_metrics(engine.pool)
+    assert metrics['timeouts'] == 1
+    assert metrics['checkouts'] == 2
+    for connection in connections:
+        connection.close()
+
+
+def test_engine_pool_options(app):
+    """Test that the pool settings apply to the databases with a queue
+    pool only."""
+    options = {}
+    db.apply_driver_hacks(app, make_url('mysql+pymysql://user@host/db'),
+                          options)
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == app.config['DATABASE_POOL_SIZE']
+    assert options['pool_recycle'] == app.config['DATABASE_POOL_RECYCLE']
+    assert options['pool_pre_ping'] is True
+
+    options = {}
+    db.apply_driver_hacks(app, make_url('sqlite:///some.db'), options)
+    assert 'pool_size' not in options
@@ -0,0 +1,209 @@
+"""Tests for the routing of reads to a database replica.
+
+The primary and the replica are two SQLite files, the replica is a copy of
+the primary made by replicate.
+"""
+
+import os
+import shutil
+import tempfile
+import pytest
+from flask import url_for, jsonify
+from flask_migrate import upgrade as _upgrade
+
+from app import create_app, db
+from app.note.models import Note
+from app.rest.blueprint import replica_reads
+from app.user.models import User, get_user_by_username, user_cache
+from app.utils import count_cache
+from config import config_list
+
+
+@pytest.fixture(scope='module')
+def app():
+    """Create an app with a primary database and a replica."""
+    config = config_list['testing']
+    replica_uris = config.DATABASE_REPLICA_URIS
+
+    primary_fd, primary_path = tempfile.mkstemp()
+    replica_fd, replica_path = tempfile.mkstemp()
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + primary_path
+    config.DATABASE_REPLICA_URIS = ['sqlite:///' + replica_path]
+    try:
+        app = create_app(config)
+    finally:
+        config.DATABASE_REPLICA_URIS = replica_uris
+    app.config['PRIMARY_PATH'] = primary_path
+    app.config['REPLICA_PATH'] = replica_path
+
+    directory = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             os.pardir, 'migrations'))
+    with app.app_context():
+        _upgrade(directory)
+
+    yield app
+
+    for fd, path in [(primary_fd, primary_path), (replica_fd, replica_path)]:
+        os.close(fd)
+        os.unlink(path)
+
+
+def replicate(app):
+    """Copy the primary database to the replica."""
+    db.session.remove()
+    shutil.copyfile(app.config['PRIMARY_PATH'], app.config['REPLICA_PATH'])
+    db._replicas_down.clear()
+
+
+def get_email(username):
+    """Read the email of a user without the identity map."""
+    return db.session.query(User.email).filter(
+        User.username == username).scalar()
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_reads(app, add_user):
+    """Test that the reads go to the primary after a write."""
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+        replicate(app)
+        User.query.filter_by(username='someuser').update(
+            {User.email: 'new@email.com'})
+        db.session.commit()
+
+        assert get_email('someuser') == 'new@email.com'
+        with db.replica_reads() as routing:
+            assert get_email('someuser') == 'some@email.com'
+            assert routing.used
+
+            user = User.query.filter_by(username='someuser').first()
+            user.email = 'other@email.com'
+            db.session.flush()
+            assert routing.wrote
+            assert get_email('someuser') == 'other@email.com'
+        db.session.rollback()
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_locking_read(app, add_user):
+    """Test that a locking read goes to the primary."""
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+        replicate(app)
+        with db.replica_reads() as routing:
+            User.query.filter_by(username='someuser').with_for_update().all()
+            assert routing.wrote
+            assert not routing.used
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_view(app, client, add_note, auth_headers):
+    """Test that a read-only view reads from the replica."""
+    with app.test_request_context():
+        headers = auth_headers()
+        note_id = add_note(title='Old title').id
+        replicate(app)
+        Note.query.filter_by(id=note_id).update({Note.title: 'New title'})
+        db.session.commit()
+
+        response = client.get(url_for('rest.note_get', id=note_id),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json['title'] == 'Old title'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_lag_fallback(app, client, add_note, auth_headers):
+    """Test that a view failing on a lagging replica is run on the
+    primary."""
+    with app.test_request_context():
+        headers = auth_headers()
+        replicate(app)
+        note_id = add_note(title='New note').id
+        fallbacks = db.get_replica_metrics()['fallbacks']
+
+        response = client.get(url_for('rest.note_get', id=note_id),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json['title'] == 'New note'
+        assert db.get_replica_metrics()['fallbacks'] == fallbacks + 1
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_error_no_fallback(app, add_user):
+    """Test that errors replica lag can't cause are not run again."""
+    calls = []
+
+    def view(username):
+        calls.append(username)
+        if get_user_by_username(username) is None:
+            return jsonify(error_message='User not found'), 404
+        return jsonify(error_message='Invalid input'), 400
+
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+        replicate(app)
+        add_user('newuser', 'new@email.com', 'password')
+
+        response = app.make_response(replica_reads(view)('someuser'))
+        assert response.status_code == 400
+        assert calls == ['someuser']
+
+        response = app.make_response(replica_reads(view)('newuser'))
+        assert response.status_code == 400
+        assert calls == ['someuser', 'newuser', 'newuser']
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_failure_fallback(app, client, add_note, auth_headers):
+    """Test that a failing replica is left out."""
+    with app.test_request_context():
+        headers = auth_headers()
+        note_id = add_note(title='Some note').id
+        db.session.remove()
+        with open(app.config['REPLICA_PATH'], 'wb'):
+            pass
+
+        response = client.get(url_for('rest.note_get', id=note_id),
+                              headers=headers)
+
+        assert response.status_code == 200
+        assert response.json['title'] == 'Some note'
+        assert db.get_replica_metrics()['down'] == ['replica0']
+        assert db.choose_replica() is None
+        replicate(app)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_replica_reads_not_cached(app, client, add_user, auth_headers):
+    """Test that users and counts read from a replica are not cached."""
+    user_cache_ttl = app.config['USER_CACHE_TTL']
+    app.config['USER_CACHE_TTL'] = 60
+    user_cache.clear()
+    count_cache.clear()
+    try:
+        with app.test_request_context():
+            headers = auth_headers()
+            add_user('someuser', 'some@email.com', 'password')
+            replicate(app)
+            User.query.filter_by(username='someuser').update(
+                {User.email: 'new@email.com'})
+            db.session.commit()
+
+            response = client.get(url_for('rest.user_get',
+                                          username='someuser'),
+                                  headers=headers)
+            assert response.json['email'] == 'some@email.com'
+
+            with db.replica_reads():
+                assert count_cache.get_count(User, [], lambda: 1) == 1
+
+        with app.app_context():
+            assert get_user_by_username('someuser').email == 'new@email.com'
+            assert count_cache.get_count(User, [], lambda: 2) == 2
+    finally:
+        app.config['USER_CACHE_TTL'] = user_cache_ttl
+        user_cache.clear()
+        count_cache.clear()
@@ -3,14 +3,26 @@
 import math
 import pytest
 from datetime import datetime as dt
+from app import db
 from app.user.models import User
 from app.note.models import Note
 from app.utils import (
     apply_filter,
     strip_column_prefix,
     process_filter_value,
-    get_entities
+    get_entities,
+    filter_entities,
+    count_entities,
+    count_cache,
+    get_query_plan,
+    get_field_columns,
+    get_entity,
+    get_entities_by_cursor,
+    encode_cursor,
+    decode_cursor,
+    match_param
 )
+from app import utils
 
 
 def test_strip_column_prefix():
@@ -210,6 +222,30 @@ def test_get_entities_invalid_page_default_sort(app, add_ten_users):
         assert users.total == 10
 
 
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_invalid_page_full_last_page(app, add_ten_users):
+    """Test that a page past a completely filled last page is moved back
+    to the last page instead of an empty one."""
+    with app.app_context():
+        add_ten_users()
+        users = get_entities(User, 3, 5)
+        assert users.page == 2
+        assert len(users.items) == 5
+        assert users.total == 10
+        assert not users.has_next
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_count_entities(app, add_ten_users):
+    """Test counting the entities matched by a filtered query."""
+    with app.app_context():
+        add_ten_users()
+        users = filter_entities(User, [dict(column='id', type='geq',
+                                            value=5)])
+        assert count_entities(User, users) == 6
+        assert count_entities(User, User.query) == 10
+
+
 @pytest.mark.usefixtures('clean_up_existing_users')
 def test_get_users_ten_filter_ts_created_at(app, add_ten_users):
     """Test getting a paged list of users filtered by ts_created_at."""
@@ -221,3 +257,409 @@ def test_get_users_ten_filter_ts_created_at(app, add_ten_users):
         assert str(users.query._order_by[0]) == 'users.created_at DESC'
         assert len(users.items) == 3
         assert users.total == 6
+
+
+def test_cursor_encode_decode():
+    """Test that a cursor survives the encoding round trip."""
+    now = dt.utcnow()
+    assert decode_cursor(encode_cursor(['title', 3])) == ['title', 3]
+    assert decode_cursor(encode_cursor([now, 3])) == [now, 3]
+
+
+def test_cursor_decode_invalid():
+    """Test decoding a malformed cursor."""
+    for cursor in ['not a cursor', encode_cursor([1, 2, 3]), None]:
+        with pytest.raises(ValueError) as err:
+            decode_cursor(cursor)
+        assert 'Invalid cursor' in str(err.value)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_by_cursor_walk(app, add_ten_users):
+    """Test walking through all users page by page with a cursor."""
+    with app.app_context():
+        add_ten_users()
+        seen = []
+        cursor = None
+        while True:
+            users = get_entities_by_cursor(User, 3,
+                                           order=dict(column='username',
+                                                      dir='desc'),
+                                           cursor=cursor)
+            seen += [user.username for user in users.items]
+            if not users.has_next:
+                break
+            cursor = users.next_cursor
+
+        assert len(seen) == 10
+        assert seen == sorted(seen, reverse=True)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_by_cursor_filter_ts(app, add_ten_users):
+    """Test a cursor over a timestamp column combined with a filter."""
+    with app.app_context():
+        add_ten_users()
+        filters = [dict(column='id', type='geq', value=5)]
+        order = dict(column='ts_created_at', dir='asc')
+        first = get_entities_by_cursor(User, 4, filters, order)
+        assert len(first.items) == 4
+        assert first.has_next
+
+        second = get_entities_by_cursor(User, 4, filters, order,
+                                        first.next_cursor)
+        assert len(second.items) == 2
+        assert not second.has_next
+        assert second.next_cursor is None
+        ids = [user.id for user in first.items + second.items]
+        assert len(set(ids)) == 6
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_count_none(app, add_ten_users):
+    """Test getting a page of entities without counting them."""
+    with app.app_context():
+        add_ten_users()
+        users = get_entities(User, 3, 3, count='none')
+        assert len(users.items) == 3
+        assert users.total is None
+        assert users.pages is None
+        assert users.has_next
+        assert users.next_num == 4
+
+        users = get_entities(User, 4, 3, count='none')
+        assert len(users.items) == 1
+        assert not users.has_next
+        assert users.next_num is None
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_count_estimate(app, add_ten_users, add_user):
+    """Test that estimated counts are cached until the table changes."""
+    with app.app_context():
+        count_cache.clear()
+        add_ten_users()
+        filters = [dict(column='id', type='geq', value=1)]
+        users = get_entities(User, 2, 3, filters, count='estimate')
+        assert users.total == 10
+
+        # a bulk insert bypasses the session and the cache is kept
+        User.query.session.execute(User.__table__.insert(), [
+            dict(username='bulk_user', email='bulk_user@email.com',
+                 is_admin=False)])
+        users = get_entities(User, 2, 3, filters, count='estimate')
+        assert users.total == 10
+        users = get_entities(User, 2, 3, filters)
+        assert users.total == 11
+
+        # a flush through the session invalidates the table's counts
+        add_user('new_user', 'new_user@email.com')
+        users = get_entities(User, 2, 3, filters, count='estimate')
+        assert users.total == 12
+
+
+def test_get_entities_count_invalid(app):
+    """Test requesting an unknown count option."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            get_entities(User, 1, 3, count='some')
+        assert 'Invalid count option' in str(err.value)
+
+
+def test_apply_filter_invalid_column(app):
+    """Test filtering by a column that is not in the model's whitelist."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            apply_filter(User.query, User,
+                         {'column': 'password_hash', 'type': 'eq',
+                          'value': 'hash'})
+        assert 'Invalid filter column password_hash' in str(err.value)
+
+
+def test_apply_filter_invalid_type(app):
+    """Test filtering with an unknown filter type."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            apply_filter(User.query, User,
+                         {'column': 'username', 'type': 'regexp',
+                          'value': 'user'})
+        assert 'Invalid filter type regexp' in str(err.value)
+
+
+def test_get_query_plan_reused(app):
+    """Test that filters of the same shape share one plan."""
+    with app.app_context():
+        order = dict(column='ts_created_at', dir='desc')
+        plan, params = get_query_plan(
+            User, [dict(column='username', type='like', value='a')], order)
+        other_plan, other_params = get_query_plan(
+            User, [dict(column='username', type='like', value='b')], order)
+
+        assert plan is other_plan
+        assert params == {'filter_0_0': '%a%'}
+        assert other_params == {'filter_0_0': '%b%'}
+
+        different_plan, _ = get_query_plan(
+            User, [dict(column='username', type='eq', value='b')], order)
+        assert different_plan is not plan
+
+
+def test_get_entities_invalid_order(app):
+    """Test sorting by a column that is not in the model's whitelist."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            get_entities(User, 1, 3, order=dict(column='password_hash',
+                                                dir='asc'))
+        assert 'Invalid filter column password_hash' in str(err.value)
+
+
+def test_get_entities_invalid_shape_names(app):
+    """Test filters and orders naming their column or type by a non-string."""
+    with app.app_context():
+        for filters, order in [
+                ([{'column': ['username'], 'type': 'eq', 'value': 'a'}],
+                 None),
+                ([{'column': 'username', 'type': {}, 'value': 'a'}], None),
+                ([['username', 'eq', 'a']], None),
+                (None, dict(column=['username'], dir='asc')),
+                (None, dict(column='username', dir=1)),
+                (None, 'username')]:
+            with pytest.raises(ValueError) as err:
+                get_entities(User, 1, 3, filters=filters, order=order)
+            assert 'Invalid filter' in str(err.value) or \
+                'Invalid order' in str(err.value)
+
+
+def test_match_param(monkeypatch):
+    """Test escaping the query syntax of the full-text search engines."""
+    monkeypatch.setattr(utils, 'get_dialect_name', lambda: 'sqlite')
+    assert match_param('a"b +c') == '"a""b" "+c"'
+
+    monkeypatch.setattr(utils, 'get_dialect_name', lambda: 'mysql')
+    assert match_param('a"b +c- (d) ~e* @f <g>') == \
+        '+"a" +"b" +"c" +"d" +"e" +"f" +"g"'
+    with pytest.raises(ValueError):
+        match_param('" -+ ()')
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_filter_notes_match(app, add_note):
+    """Test the full-text match type filter on an actual query."""
+    with app.app_context():
+        add_note('Shopping list', 'apples, pears and plums')
+        add_note('Travel plans', 'visit the pear orchard')
+        note = add_note('Reading list', 'a book about apples')
+
+        notes = apply_filter(Note.query, Note,
+                             {'column': 'text', 'type': 'match',
+                              'value': 'apples'})
+        assert len(notes.all()) == 2
+
+        notes = apply_filter(Note.query, Note,
+                             {'column': 'text', 'type': 'match',
+                              'value': 'apples book'})
+        assert [found.id for found in notes.all()] == [note.id]
+
+        # the index follows the updates of the notes
+        note.title = 'Wish list'
+        db.session.add(note)
+        db.session.commit()
+        notes = apply_filter(Note.query, Note,
+                             {'column': 'title', 'type': 'match',
+                              'value': 'list'})
+        assert {found.title for found in notes.all()} == {'Shopping list',
+                                                         'Wish list'}
+
+        # the query syntax in the value is searched for literally
+        notes = apply_filter(Note.query, Note,
+                             {'column': 'title', 'type': 'match',
+                              'value': 'list" OR "plans'})
+        assert len(notes.all()) == 0
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_relevance_order(app, add_note):
+    """Test sorting the notes matched by a full-text search by relevance."""
+    with app.app_context():
+        long_note = add_note('Long', 'a single apple in a long text about '
+                                     'the many fruits of the orchard')
+        repeated_note = add_note('Repeated', 'apple apple apple')
+        short_note = add_note('Short', 'apple pie')
+        add_note('Other', 'pears only')
+
+        filters = [{'column': 'text', 'type': 'match', 'value': 'apple'}]
+        notes = get_entities(Note, 1, 10, filters=filters,
+                             order=dict(column='relevance', dir='desc'))
+        assert [note.id for note in notes.items] == [
+            repeated_note.id, short_note.id, long_note.id]
+
+        notes = get_entities(Note, 1, 10, filters=filters,
+                             order=dict(column='relevance', dir='asc'))
+        assert notes.items[0].id == long_note.id
+
+        with pytest.raises(ValueError) as err:
+            get_entities(Note, 1, 10,
+                         order=dict(column='relevance', dir='desc'))
+        assert 'The relevance order requires a match filter' in \
+            str(err.value)
+
+        with pytest.raises(ValueError):
+            get_entities_by_cursor(Note, 10, filters=filters,
+                                   order=dict(column='relevance',
+                                              dir='desc'))
+
+
+def test_filter_match_invalid_column(app):
+    """Test the match type filter on a column without a full-text index."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            apply_filter(User.query, User,
+                         {'column': 'username', 'type': 'match',
+                          'value': 'user'})
+        assert 'Invalid match column username' in str(err.value)
+
+
+def test_filter_match_empty_value(app):
+    """Test the match type filter with a value without words."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            apply_filter(Note.query, Note,
+                         {'column': 'title', 'type': 'match',
+                          'value': '  '})
+        assert 'Search value cannot be empty' in str(err.value)
+
+
+def test_apply_filter_prefix(app):
+    """Test setting a prefix type filter."""
+    with app.app_context():
+        users = apply_filter(User.query, User,
+                             {'column': 'username', 'type': 'prefix',
+                              'value': 'user_%'})
+        assert str(users.whereclause) == \
+            "users.username LIKE :username_1 ESCAPE '\\'"
+        assert users.whereclause.right.value == 'user\\_\\%%'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_filter_users_prefix(app, add_ten_users):
+    """Test the prefix type filter on an actual query."""
+    with app.app_context():
+        add_ten_users()
+        users = apply_filter(User.query, User,
+                             {'column': 'username', 'type': 'prefix',
+                              'value': 'username_1'})
+        assert len(users.all()) == 1
+
+        users = apply_filter(User.query, User,
+                             {'column': 'username', 'type': 'prefix',
+                              'value': 'name'})
+        assert len(users.all()) == 0
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_filter_users_in(app, add_ten_users):
+    """Test the in type filter on an actual query."""
+    with app.app_context():
+        add_ten_users()
+        filters = [dict(column='username', type='in',
+                        value=['username_1', 'username_3', 'other'])]
+        users = get_entities(User, 1, 5, filters)
+        assert sorted(user.username for user in users.items) == \
+            ['username_1', 'username_3']
+
+        filters[0]['value'] = ['username_2']
+        users = get_entities(User, 1, 5, filters)
+        assert [user.username for user in users.items] == ['username_2']
+
+
+def test_filter_in_invalid_value(app):
+    """Test the in type filter with values that aren't a valid list."""
+    with app.app_context():
+        for value in ['username', [], list(range(501))]:
+            with pytest.raises(ValueError) as err:
+                apply_filter(User.query, User,
+                             {'column': 'id', 'type': 'in', 'value': value})
+            assert 'The in filter' in str(err.value)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_filter_users_between(app, add_ten_users):
+    """Test the between type filter on an actual query."""
+    with app.app_context():
+        users = add_ten_users()
+        filters = [dict(column='id', type='between',
+                        value=[users[2].id, users[5].id])]
+        result = get_entities(User, 1, 10, filters)
+        assert result.total == 4
+
+        created = [user.ts_created_at for user in users]
+        filters = [dict(column='ts_created_at', type='between',
+                        value=[min(created), max(created)])]
+        result = get_entities(User, 1, 10, filters)
+        assert result.total == 10
+
+
+def test_filter_between_invalid_value(app):
+    """Test the between type filter without two bounds."""
+    with app.app_context():
+        with pytest.raises(ValueError) as err:
+            apply_filter(User.query, User,
+                         {'column': 'id', 'type': 'between', 'value': [1]})
+        assert 'The between filter requires two values' in str(err.value)
+
+
+def test_process_filter_value_list():
+    """Test converting a list of timestamps."""
+    now = dt.utcnow()
+    filter_ = {'column': "ts_created_at", 'value': [now.timestamp()] * 2,
+               'type': 'between'}
+    assert process_filter_value(filter_) == [now, now]
+
+
+def test_get_field_columns():
+    """Test mapping API fields to the columns they are built from."""
+    assert get_field_columns(Note, ['username', 'created_by', 'title']) == \
+        ['created_by', 'title']
+    assert get_field_columns(User, ['ts_last_seen']) == ['last_seen']
+
+    with pytest.raises(ValueError) as err:
+        get_field_columns(Note, ['author'])
+    assert 'Invalid field author' in str(err.value)
+
+    with pytest.raises(ValueError) as err:
+        get_field_columns(Note, 'title')
+    assert 'Fields must be a list' in str(err.value)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entity_fields(app, add_note):
+    """Test loading an entity with only the columns of some fields."""
+    with app.app_context():
+        note_id = add_note('Some title', 'some text').id
+
+    with app.app_context():
+        note = get_entity(Note, note_id, ['title'])
+        loaded = db.inspect(note).dict
+        assert loaded['title'] == 'Some title'
+        assert 'text' not in loaded
+        assert 'versions' not in loaded
+        # a deferred column is still available on access
+        assert note.text == 'some text'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_entities_fields(app, add_ten_notes):
+    """Test loading a page of entities with only some of their columns."""
+    with app.app_context():
+        add_ten_notes()
+
+    with app.app_context():
+        notes = get_entities(Note, 1, 5, order=dict(column='ts_created_at',
+                                                    dir='desc'),
+                             fields=['title'])
+        assert len(notes.items) == 5
+        for note in notes.items:
+            loaded = db.inspect(note).dict
+            assert 'title' in loaded
+            assert 'created_at' in loaded
+            assert 'text' not in loaded
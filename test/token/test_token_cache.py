@@ -0,0 +1,118 @@
+"""Tests for the verified tokens cache."""
+
+import time
+from datetime import timedelta
+import pytest
+from flask import url_for
+from flask_jwt_extended import create_access_token
+
+from app import jwt
+from app.token.cache import VerifiedTokenCache
+
+
+@pytest.fixture
+def token_cache(app):
+    """Empty the cache of the JWT manager before and after a test."""
+    jwt.token_cache.clear()
+    yield jwt.token_cache
+    jwt.token_cache.clear()
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_token_cache_hits(app, client, auth_headers, token_cache):
+    """Test that a token is verified once for repeated requests."""
+    with app.test_request_context():
+        headers = auth_headers({'is_admin': True})
+
+        for _ in range(3):
+            response = client.get(url_for('rest.admin_metrics'),
+                                  headers=headers)
+            assert response.status_code == 200
+
+        metrics = token_cache.get_metrics()
+        assert metrics['misses'] == 1
+        assert metrics['hits'] == 2
+        assert metrics['size'] == 1
+        assert response.json['jwt_cache']['hits'] == 2
+
+
+def test_token_cache_copy(app, token_cache):
+    """Test that the cached claims can't be changed by a caller."""
+    with app.test_request_context():
+        decoded = token_cache.decode('token', lambda: dict(sub='user'))
+        decoded['sub'] = 'other'
+
+        assert token_cache.decode('token', lambda: None) == dict(sub='user')
+
+
+def test_token_cache_expiry(app, token_cache):
+    """Test that a token is verified again once it expires."""
+    with app.test_request_context():
+        token_cache.decode('token', lambda: dict(exp=time.time() - 1))
+        token_cache.decode('token', lambda: dict(exp=time.time() + 60))
+
+        assert token_cache.get_metrics()['misses'] == 2
+        assert token_cache.get_metrics()['hits'] == 0
+
+
+def test_token_cache_size(app, token_cache):
+    """Test that the least recently used tokens are dropped."""
+    cache_size = app.config['JWT_CACHE_SIZE']
+    app.config['JWT_CACHE_SIZE'] = 2
+    try:
+        with app.test_request_context():
+            for token in ['a', 'b', 'a', 'c']:
+                token_cache.decode(token, lambda: dict(sub=token))
+
+            assert token_cache.get_metrics()['size'] == 2
+            token_cache.decode('a', lambda: None)
+            assert token_cache.get_metrics()['hits'] == 2
+    finally:
+        app.config['JWT_CACHE_SIZE'] = cache_size
+
+
+def test_token_cache_disabled(app):
+    """Test that a cache of size 0 verifies every token."""
+    cache_size = app.config['JWT_CACHE_SIZE']
+    app.config['JWT_CACHE_SIZE'] = 0
+    try:
+        with app.test_request_context():
+            token_cache = VerifiedTokenCache()
+            for _ in range(2):
+                token_cache.decode('token', lambda: dict(sub='user'))
+
+            assert token_cache.get_metrics() == dict(size=0, hits=0,
+                                                     misses=0)
+    finally:
+        app.config['JWT_CACHE_SIZE'] = cache_size
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_token_cache_expired_entry(app, client, auth_headers, token_cache):
+    """Test that a token is verified again when its entry expires."""
+    with app.test_request_context():
+        headers = auth_headers({'is_admin': True})
+        assert client.get(url_for('rest.admin_metrics'),
+                          headers=headers).status_code == 200
+
+        token = headers['Authorization'].split()[1]
+        key = token_cache.get_key(token)
+        claims, _ = token_cache._tokens[key]
+        token_cache._tokens[key] = (claims, time.time() - 1)
+
+        response = client.get(url_for('rest.admin_metrics'), headers=headers)
+        assert response.status_code == 200
+        assert token_cache.get_metrics()['misses'] == 2
+        assert token_cache.get_metrics()['hits'] == 0
+
+
+def test_token_cache_expired_token(app, client, token_cache):
+    """Test that an expired token is rejected and not cached."""
+    with app.test_request_context():
+        token = create_access_token('test_user',
+                                    expires_delta=timedelta(seconds=-60))
+        headers = {'Authorization': f'Bearer {token}'}
+
+        response = client.get(url_for('rest.admin_metrics'), headers=headers)
+        assert response.status_code == 401
+        assert token_cache.get_metrics()['size'] == 0
@@ -0,0 +1,205 @@
+"""Tests for the revocation of tokens."""
+
+from datetime import datetime as dt, timedelta
+import pytest
+from flask import url_for
+from flask_jwt_extended import create_access_token, decode_token, \
+    verify_jwt_in_request
+
+from app import db
+from app.token.models import RevokedToken
+from app.token.revocation import BloomFilter, revocation_list, \
+    get_user_key
+
+
+@pytest.fixture
+def revocations(app):
+    """Empty the revocation list and the revoked tokens around a test."""
+    def clear():
+        revocation_list.clear()
+        with app.app_context():
+            RevokedToken.query.delete()
+            db.session.commit()
+
+    clear()
+    yield revocation_list
+    clear()
+
+
+def test_bloom_filter():
+    """Test that the filter has every added string."""
+    bloom = BloomFilter(1 << 12, 5)
+    values = [f'token-{index}' for index in range(100)]
+    for value in values:
+        bloom.add(value)
+
+    assert all(value in bloom for value in values)
+    assert bloom.count == 100
+    false_positives = sum(f'other-{index}' in bloom for index in range(1000))
+    assert false_positives < 50
+
+
+def test_bloom_filter_invalid_size():
+    """Test that a filter needs bits and hashes."""
+    with pytest.raises(ValueError):
+        BloomFilter(0, 1)
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_logout(app, client, auth_headers, revocations):
+    """Test that a revoked access token is rejected."""
+    with app.test_request_context():
+        headers = auth_headers()
+        jti = decode_token(headers['Authorization'].split()[1])['jti']
+
+        response = client.post(url_for('rest.logout'), headers=headers)
+        assert response.status_code == 200
+        assert response.json['revoked_jti'] == jti
+        assert RevokedToken.query.filter_by(jti=jti).one().token_type == \
+            'access'
+
+        response = client.post(url_for('rest.logout'), headers=headers)
+        assert response.status_code == 401
+        assert response.json['error_message'] == 'Token has been revoked'
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_logout_refresh(app, client, add_user, revocations):
+    """Test that a revoked refresh token is rejected."""
+    with app.test_request_context():
+        add_user('someuser', 'some@email.com', 'password')
+        response = client.post(url_for('rest.login'),
+                               json=dict(username='someuser',
+                                         password='password'))
+        headers = {
+            'Authorization': f"Bearer {response.json['refresh_token']}"}
+
+        response = client.post(url_for('rest.logout_refresh'),
+                               headers=headers)
+        assert response.status_code == 200
+
+        response = client.get(url_for('rest.refresh'), headers=headers)
+        assert response.status_code == 401
+
+
+def test_revoked_by_other_process(app, revocations):
+    """Test that the tokens revoked in the table are picked up."""
+    with app.app_context():
+        token = create_access_token('someuser')
+        jti = decode_token(token)['jti']
+        assert not revocation_list.is_revoked(jti)
+
+        db.session.add(RevokedToken(jti=jti, token_type='access'))
+        db.session.commit()
+        sync_interval = app.config['JWT_REVOCATION_SYNC_INTERVAL']
+        app.config['JWT_REVOCATION_SYNC_INTERVAL'] = 0
+        try:
+            assert revocation_list.is_revoked(jti)
+        finally:
+            app.config['JWT_REVOCATION_SYNC_INTERVAL'] = sync_interval
+
+
+def test_revoked_out_of_order(app, revocations):
+    """Test that a sync picks up a token committed after a later one."""
+    sync_interval = app.config['JWT_REVOCATION_SYNC_INTERVAL']
+    app.config['JWT_REVOCATION_SYNC_INTERVAL'] = 0
+    try:
+        with app.app_context():
+            revoked_at = dt.utcnow()
+            db.session.add(RevokedToken(id=2, jti='later', token_type='access',
+                                        revoked_at=revoked_at))
+            db.session.commit()
+            assert revocation_list.is_revoked('later')
+
+            # the lower id, revoked earlier, is committed after the sync
+            db.session.add(RevokedToken(
+                id=1, jti='earlier', token_type='access',
+                revoked_at=revoked_at - timedelta(seconds=5)))
+            db.session.commit()
+            assert revocation_list.is_revoked('earlier')
+    finally:
+        app.config['JWT_REVOCATION_SYNC_INTERVAL'] = sync_interval
+
+
+def test_revoked_user(app, revocations):
+    """Test that only the tokens issued before a user's revocation are
+    revoked."""
+    with app.app_context():
+        claims = {'user_id': 7}
+        token = decode_token(create_access_token('someuser',
+                                                 user_claims=claims))
+        other_token = decode_token(create_access_token(
+            'otheruser', user_claims={'user_id': 8}))
+        assert not revocation_list.is_token_revoked(token)
+
+        revocation_list.revoke_user(7, 'someuser')
+        db.session.commit()
+        assert revocation_list.is_token_revoked(token)
+        assert not revocation_list.is_token_revoked(other_token)
+
+        # a token issued after the revocation is accepted
+        revoked_user = RevokedToken.query.filter_by(
+            jti=get_user_key(7)).one()
+        revoked_user.revoked_at = dt.utcnow() - timedelta(seconds=10)
+        db.session.commit()
+        revocation_list.clear()
+        assert not revocation_list.is_token_revoked(token)
+
+        revocation_list.revoke_user(7, 'newuser')
+        db.session.commit()
+        assert RevokedToken.query.count() == 1
+        assert revocation_list.is_token_revoked(token)
+
+
+def test_not_revoked_without_query(app, revocations):
+    """Test that checking a token not revoked runs no query."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        revocation_list.refresh()
+        token = create_access_token('someuser')
+
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context(headers=headers):
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        try:
+            verify_jwt_in_request()
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+
+    assert statements == []
+    assert revocation_list.get_metrics()['checked'] == 1
+    assert revocation_list.get_metrics()['lookups'] == 0
+
+
+def test_filter_false_positive(app, revocations):
+    """Test that a token in the filter is looked up once."""
+    with app.app_context():
+        revocation_list.refresh()
+        revocation_list._filter.add('not-revoked')
+
+        assert not revocation_list.is_revoked('not-revoked')
+        assert not revocation_list.is_revoked('not-revoked')
+
+        metrics = revocation_list.get_metrics()
+        assert metrics['filter_hits'] == 2
+        assert metrics['lookups'] == 1
+
+
+def test_prune(app, revocations):
+    """Test that only the expired tokens are pruned."""
+    with app.app_context():
+        now = dt.utcnow()
+        db.session.add(RevokedToken(jti='expired', token_type='access',
+                                    expires_at=now - timedelta(hours=1)))
+        db.session.add(RevokedToken(jti='valid', token_type='access',
+                                    expires_at=now + timedelta(hours=1)))
+        db.session.commit()
+
+        assert revocation_list.prune(now) == 1
+        assert [token.jti for token in RevokedToken.query] == ['valid']
@@ -0,0 +1,80 @@
+"""Tests for the User activity module."""
+
+import pytest
+from datetime import datetime as dt
+from flask import url_for
+
+from app import db
+from app.user.models import User
+from app.user.activity import LastSeenTracker, last_seen_tracker
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_last_seen_tracker(app, add_user):
+    """Test recording and storing the activity of users."""
+    first = dt(2026, 1, 1, 10)
+    second = dt(2026, 1, 1, 11)
+
+    with app.app_context():
+        add_user('user_1', 'user_1@email.com')
+        add_user('user_2', 'user_2@email.com')
+
+        tracker = LastSeenTracker()
+        assert tracker.record('user_1', first)
+        assert tracker.record('user_2', first)
+        assert not tracker.record('user_1', second)
+        assert tracker.is_due
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        try:
+            assert tracker.flush() == 2
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+        assert len(statements) == 1
+        assert statements[0].startswith('UPDATE users')
+        assert not tracker.is_due
+        assert tracker.flush() == 0
+
+        db.session.expire_all()
+        for username in ['user_1', 'user_2']:
+            user = User.query.filter_by(username=username).first()
+            assert user.last_seen == first
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_last_seen_tracker_granularity(app):
+    """Test that activity is recorded again after the granularity."""
+    with app.app_context():
+        tracker = LastSeenTracker()
+        app.config['LAST_SEEN_GRANULARITY'] = 0
+        try:
+            assert tracker.record('user_1')
+            assert tracker.record('user_1')
+        finally:
+            app.config['LAST_SEEN_GRANULARITY'] = 60
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_last_seen_request(app, client, auth_headers):
+    """Test that the activity of a request is stored at its teardown."""
+    last_seen_tracker.clear()
+    with app.test_request_context():
+        headers = auth_headers()
+        user = User.query.filter_by(username='default_user').first()
+        user.last_seen = dt(2000, 1, 1)
+        db.session.commit()
+
+        response = client.get(url_for('rest.user_get', id=user.id),
+                              headers=headers)
+        assert response.status_code == 200
+
+        db.session.expire_all()
+        user = User.query.filter_by(username='default_user').first()
+        assert user.last_seen > dt(2000, 1, 1)
@@ -0,0 +1,117 @@
+"""Tests for the User email module."""
+
+import time
+import dns.resolver
+import pytest
+from email_validator import EmailSyntaxError, EmailUndeliverableError
+
+from app.user.email import validate_email_address, email_domain_cache
+
+
+@pytest.fixture
+def lookups(app, monkeypatch):
+    """Replace the DNS resolver of the email module, recording the domains
+    looked up. Domains starting with "invalid" don't exist, the name servers
+    of domains starting with "down" don't answer."""
+    domains = []
+
+    class MockResolver(object):
+        """Answer the queries for the MX records of valid domains."""
+
+        @staticmethod
+        def query(name, record_type, lifetime=None):
+            domain = name.rstrip('.')
+            if record_type == 'MX':
+                domains.append(domain)
+            if domain.startswith('invalid'):
+                raise dns.resolver.NXDOMAIN()
+            if domain.startswith('down'):
+                raise dns.resolver.NoNameservers()
+            if record_type != 'MX':
+                raise dns.resolver.NoAnswer()
+            return []
+
+    monkeypatch.setattr(dns.resolver, 'get_default_resolver',
+                        lambda: MockResolver())
+    email_domain_cache.clear()
+    mode = app.config['EMAIL_VALIDATION_MODE']
+    yield domains
+    app.config['EMAIL_VALIDATION_MODE'] = mode
+    app.config['EMAIL_DNS_ASYNC'] = False
+    email_domain_cache.clear()
+
+
+def test_validate_email_syntax(app, lookups):
+    """Test validating only the syntax of email addresses."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'syntax'
+        assert validate_email_address('user@invalid.com')['domain'] == \
+            'invalid.com'
+        with pytest.raises(EmailSyntaxError):
+            validate_email_address('user')
+    assert lookups == []
+
+
+def test_validate_email_cached(app, lookups):
+    """Test that a domain is looked up once in the cached mode."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'cached'
+        validate_email_address('user_1@valid.com')
+        validate_email_address('user_2@valid.com')
+        for _ in range(2):
+            with pytest.raises(EmailUndeliverableError):
+                validate_email_address('user@invalid.com')
+    assert lookups == ['valid.com', 'invalid.com']
+
+
+def test_validate_email_cached_async(app, lookups):
+    """Test looking up domains in the background."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'cached'
+        app.config['EMAIL_DNS_ASYNC'] = True
+        validate_email_address('user@invalid.com')
+        for _ in range(100):
+            if email_domain_cache.get('invalid.com'):
+                break
+            time.sleep(0.05)
+
+        assert lookups == ['invalid.com']
+        with pytest.raises(EmailUndeliverableError):
+            validate_email_address('user@invalid.com')
+
+
+def test_validate_email_full(app, lookups):
+    """Test that every address is looked up in the full mode."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'full'
+        validate_email_address('user_1@valid.com')
+        validate_email_address('user_2@valid.com')
+    assert lookups == ['valid.com', 'valid.com']
+
+
+def test_validate_email_lookup_error(app, lookups):
+    """Test that a failed lookup accepts the address and is cached shortly."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'cached'
+        validate_email_address('user_1@down.com')
+        validate_email_address('user_2@down.com')
+        assert lookups == ['down.com']
+
+        result = email_domain_cache.get('down.com')
+        assert result.deliverable is None
+        expires_at = email_domain_cache._domains['down.com'][1]
+        assert expires_at - time.monotonic() <= \
+            app.config['EMAIL_DNS_ERROR_TTL']
+
+        app.config['EMAIL_VALIDATION_MODE'] = 'full'
+        validate_email_address('user_3@down.com')
+        assert lookups == ['down.com', 'down.com']
+
+
+def test_validate_email_invalid_mode(app, lookups):
+    """Test validating with an unknown mode."""
+    with app.app_context():
+        app.config['EMAIL_VALIDATION_MODE'] = 'some_mode'
+        with pytest.raises(ValueError) as err:
+            validate_email_address('user@valid.com')
+    assert 'Invalid email validation mode some_mode' in str(err.value)
@@ -0,0 +1,96 @@
+"""Tests for the User hashing module."""
+
+import threading
+import pytest
+
+from app.user.hashing import PasswordHasher, PasswordHashingUnavailable, \
+    HashPolicy, get_hash_parameters, verify_password
+
+
+def test_password_hasher_inline():
+    """Test hashing outside of an application context."""
+    hasher = PasswordHasher()
+    assert hasher.run(lambda value: value * 2, 2) == 4
+    assert hasher.get_metrics()['hashed'] == 0
+
+
+def test_password_hasher_pool(app):
+    """Test hashing in the worker pool."""
+    hasher = PasswordHasher()
+    try:
+        with app.app_context():
+            assert hasher.run(lambda value: value * 2, 2) == 4
+
+        metrics = hasher.get_metrics()
+        assert metrics['hashed'] == 1
+        assert metrics['in_flight'] == 0
+        assert metrics['avg_hash_seconds'] >= 0
+    finally:
+        hasher.shutdown()
+
+
+def test_password_hasher_saturated(app):
+    """Test rejecting hashes when the pool and its queue are full."""
+    workers = app.config['PASSWORD_HASH_WORKERS']
+    queue_size = app.config['PASSWORD_HASH_QUEUE_SIZE']
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = 0
+    hasher = PasswordHasher()
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_hash():
+        started.set()
+        release.wait(5)
+
+    def run_blocking():
+        with app.app_context():
+            hasher.run(blocking_hash)
+
+    thread = threading.Thread(target=run_blocking)
+    try:
+        thread.start()
+        assert started.wait(5)
+        with app.app_context():
+            with pytest.raises(PasswordHashingUnavailable):
+                hasher.run(lambda: None)
+        assert hasher.get_metrics()['rejected'] == 1
+    finally:
+        release.set()
+        thread.join()
+        hasher.shutdown()
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        app.config['PASSWORD_HASH_QUEUE_SIZE'] = queue_size
+
+
+def test_hash_policy_pbkdf2():
+    """Test hashing and verifying passwords with PBKDF2."""
+    policy = HashPolicy(iterations=1000)
+    password_hash = policy.hash('password')
+
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert get_hash_parameters(password_hash) == ('pbkdf2:sha256', 1000)
+    assert verify_password(password_hash, 'password')
+    assert not verify_password(password_hash, 'invalid')
+    assert not policy.needs_rehash(password_hash)
+    assert HashPolicy(iterations=2000).needs_rehash(password_hash)
+    assert not policy.needs_rehash(None)
+
+
+def test_hash_policy_bcrypt():
+    """Test hashing and verifying passwords with bcrypt."""
+    pytest.importorskip('bcrypt')
+    policy = HashPolicy('bcrypt', rounds=4)
+    password_hash = policy.hash('password')
+
+    assert get_hash_parameters(password_hash) == ('bcrypt', 4)
+    assert verify_password(password_hash, 'password')
+    assert not verify_password(password_hash, 'invalid')
+    assert HashPolicy(iterations=1000).needs_rehash(password_hash)
+
+
+def test_hash_policy_invalid_method():
+    """Test creating a policy with an unknown method."""
+    with pytest.raises(ValueError) as err:
+        HashPolicy('md5')
+    assert 'Invalid password hash method md5' in str(err.value)
@@ -2,9 +2,11 @@
 
 import pytest
 from datetime import datetime as dt
+from werkzeug.security import generate_password_hash
 from app import db
 from app.user.models import User, get_user_by_username, \
-    get_user_by_email, create_user, modify_user, toggle_admin, get_user_details
+    get_user_by_email, create_user, modify_user, toggle_admin, \
+    get_user_details, user_cache
 
 
 @pytest.mark.usefixtures('clean_up_existing_users')
@@ -306,3 +308,101 @@ def test_get_user_details(app):
         details = get_user_details(user)
         for key in details.keys():
             assert key in props
+
+
+def _count_user_selects(app, func):
+    """Return the number of users SELECT statements executed by func."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    db.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        func()
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+    return len([statement for statement in statements
+                if statement.startswith('SELECT') and 'FROM users' in
+                statement])
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_user_by_username_request_cache(app, add_user):
+    """Test that a user is looked up once per application context."""
+    with app.app_context():
+        add_user('username_1', 'email_1@test.com')
+
+    with app.app_context():
+        users = []
+        assert _count_user_selects(app, lambda: users.extend(
+            [get_user_by_username('username_1'),
+             get_user_by_username('username_1')])) == 1
+        assert users[0] is users[1]
+
+        modify_user(users[0], {'username': 'username_2'})
+        assert get_user_by_username('username_1') is None
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_user_by_username_process_cache(app, add_user):
+    """Test the process level cache of the users."""
+    app.config['USER_CACHE_TTL'] = 60
+    user_cache.clear()
+    try:
+        with app.app_context():
+            add_user('username_1', 'email_1@test.com')
+            get_user_by_username('username_1')
+
+        with app.app_context():
+            users = []
+            assert _count_user_selects(app, lambda: users.append(
+                get_user_by_username('username_1'))) == 0
+            assert users[0].email == 'email_1@test.com'
+            assert not users[0].is_admin
+            toggle_admin(users[0], True)
+
+        with app.app_context():
+            users = []
+            assert _count_user_selects(app, lambda: users.append(
+                get_user_by_username('username_1'))) == 1
+            assert users[0].is_admin
+
+            db.session.delete(users[0])
+            db.session.commit()
+
+        with app.app_context():
+            assert get_user_by_username('username_1') is None
+    finally:
+        app.config['USER_CACHE_TTL'] = 0
+        user_cache.clear()
+
+
+@pytest.mark.usefixtures('clean_up_existing_users')
+def test_get_user_by_username_process_cache_credentials(app, add_user):
+    """Test that the credentials and permissions of a cached user are read
+    from the database."""
+    app.config['USER_CACHE_TTL'] = 60
+    user_cache.clear()
+    try:
+        with app.app_context():
+            add_user('username_1', 'email_1@test.com', 'password')
+            get_user_by_username('username_1')
+
+            # changed by another process, which can't invalidate the cache
+            users = User.__table__
+            with db.engine.begin() as connection:
+                connection.execute(users.update().where(
+                    users.c.username == 'username_1').values(
+                    is_admin=True,
+                    password_hash=generate_password_hash('new password')))
+
+        with app.app_context():
+            user = get_user_by_username('username_1')
+            assert user.is_admin
+            assert user.check_password('new password')
+            assert not user.check_password('password')
+    finally:
+        app.config['USER_CACHE_TTL'] = 0
+        user_cache.clear()